@@ -0,0 +1,283 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Mapping, Optional
+from dotenv import dotenv_values
+
+class SettingsError(ValueError):
+    """Variável de ambiente com valor inválido"""
+
+def _str(env: Mapping[str, str], name: str, default: Optional[str] = None) -> Optional[str]:
+    value = env.get(name)
+    return value if value not in (None, "") else default
+
+def _int(env: Mapping[str, str], name: str, default: int, minimum: Optional[int] = None) -> int:
+    raw = _str(env, name)
+    try:
+        value = int(raw) if raw is not None else default
+    except ValueError:
+        raise SettingsError(f"{name} deve ser um inteiro (recebido: {raw!r})")
+    if minimum is not None and value < minimum:
+        raise SettingsError(f"{name} deve ser >= {minimum} (recebido: {value})")
+    return value
+
+def _bool(env: Mapping[str, str], name: str, default: bool) -> bool:
+    raw = _str(env, name)
+    if raw is None:
+        return default
+    if raw.lower() in ("1", "true", "yes", "on"):
+        return True
+    if raw.lower() in ("0", "false", "no", "off"):
+        return False
+    raise SettingsError(f"{name} deve ser true/false (recebido: {raw!r})")
+
+def _float(env: Mapping[str, str], name: str, default: float, minimum: Optional[float] = None) -> float:
+    raw = _str(env, name)
+    try:
+        value = float(raw) if raw is not None else default
+    except ValueError:
+        raise SettingsError(f"{name} deve ser um número (recebido: {raw!r})")
+    if minimum is not None and value < minimum:
+        raise SettingsError(f"{name} deve ser >= {minimum} (recebido: {value})")
+    return value
+
+@dataclass(frozen=True)
+class KommoSettings:
+    client_id: Optional[str] = None
+    client_secret: Optional[str] = None
+    redirect_uri: Optional[str] = None
+    base_url: Optional[str] = None
+    api_url: Optional[str] = None
+    account_id: Optional[str] = None
+    access_token: Optional[str] = None
+    refresh_token: Optional[str] = None
+    token_expires_at: Optional[str] = None
+    token_path: str = "data/kommo_tokens.json"
+    token_refresh_ahead: float = 600.0
+    rate_limit: float = 7.0
+    rate_burst: float = 7.0
+    max_rate_limit_retries: int = 3
+    response_cache_size: int = 2000
+    response_cache_ttl: float = 5.0
+    lead_batch_window: float = 0.05
+    lead_batch_size: int = 250
+    custom_fields_ttl: float = 3600.0
+    batch_window: float = 0.005
+    conditional_cache_size: int = 5000
+    conditional_cache_ttl: float = 3600.0
+
+@dataclass(frozen=True)
+class N8nSettings:
+    webhook_url: Optional[str] = None
+    whatsapp_url: Optional[str] = None
+    api_key: Optional[str] = None
+    max_retries: int = 3
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 8.0
+    breaker_failure_threshold: int = 5
+    breaker_reset_timeout: float = 30.0
+    spool_path: str = "data/n8n_spool.db"
+    spool_drain_interval: float = 2.0
+    aggregation_window: float = 3.0
+    aggregation_max_wait: float = 10.0
+
+@dataclass(frozen=True)
+class WebhookSettings:
+    workers: int = 8
+    queue_maxsize: int = 1000
+    journal_path: str = "data/webhook_jobs.db"
+    job_lease: float = 60.0
+    dedup_size: int = 50000
+    dedup_ttl: float = 86400.0
+    dedup_path: str = "data/webhook_dedup.db"
+
+@dataclass(frozen=True)
+class StoreSettings:
+    backend: str = "sqlite"
+    path: str = "data/conversations.db"
+    # None: conversas não expiram (como o antigo _proactive_conversations)
+    ttl: Optional[float] = None
+    flush_interval: float = 0.2
+    vendedores_cache_ttl: float = 300.0
+    vendedores_refresh_ahead: float = 60.0
+
+@dataclass(frozen=True)
+class HttpSettings:
+    pool_limit: int = 100
+    pool_limit_per_host: int = 20
+    dns_cache_ttl: int = 300
+    keepalive_timeout: float = 30.0
+
+@dataclass(frozen=True)
+class LogSettings:
+    level: str = "INFO"
+    format: str = "json"
+    payload_max_chars: int = 500
+    payload_sample_rate: float = 0.01
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Configuração da aplicação, lida do ambiente (.env) uma única vez
+
+    Imutável: uma recarga (rotação de tokens) monta um novo objeto e troca
+    a referência global de uma vez, sem leituras parciais.
+    """
+
+    environment: str = "development"
+    web_concurrency: int = 1
+    # JSON via orjson (requisições, respostas e envios ao n8n/Kommo)
+    fast_json: bool = False
+    kommo: KommoSettings = field(default_factory=KommoSettings)
+    n8n: N8nSettings = field(default_factory=N8nSettings)
+    webhooks: WebhookSettings = field(default_factory=WebhookSettings)
+    store: StoreSettings = field(default_factory=StoreSettings)
+    http: HttpSettings = field(default_factory=HttpSettings)
+    log: LogSettings = field(default_factory=LogSettings)
+    # Tempo gasto montando este snapshot (ms)
+    load_ms: float = 0.0
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "Settings":
+        """
+        Lê e valida as variáveis de ambiente; levanta SettingsError se inválidas
+
+        `environ` substitui os.environ (ex.: ambiente mesclado com o .env).
+        """
+        started = time.perf_counter()
+        env = os.environ if environ is None else environ
+        kommo = KommoSettings(
+            client_id=_str(env, "KOMMO_CLIENT_ID"),
+            client_secret=_str(env, "KOMMO_CLIENT_SECRET"),
+            redirect_uri=_str(env, "KOMMO_REDIRECT_URI"),
+            base_url=_str(env, "KOMMO_BASE_URL"),
+            api_url=_str(env, "KOMMO_API_URL"),
+            account_id=_str(env, "KOMMO_ACCOUNT_ID"),
+            access_token=_str(env, "KOMMO_ACCESS_TOKEN"),
+            refresh_token=_str(env, "KOMMO_REFRESH_TOKEN"),
+            token_expires_at=_str(env, "KOMMO_TOKEN_EXPIRES_AT"),
+            token_path=_str(env, "KOMMO_TOKEN_PATH", "data/kommo_tokens.json"),
+            token_refresh_ahead=_float(env, "KOMMO_TOKEN_REFRESH_AHEAD", 600.0, minimum=0),
+            rate_limit=_float(env, "KOMMO_RATE_LIMIT", 7.0, minimum=0.1),
+            rate_burst=_float(env, "KOMMO_RATE_BURST", 7.0, minimum=1),
+            max_rate_limit_retries=_int(env, "KOMMO_MAX_RATE_LIMIT_RETRIES", 3, minimum=0),
+            response_cache_size=_int(env, "KOMMO_RESPONSE_CACHE_SIZE", 2000, minimum=1),
+            response_cache_ttl=_float(env, "KOMMO_RESPONSE_CACHE_TTL", 5.0, minimum=0),
+            lead_batch_window=_float(env, "KOMMO_LEAD_BATCH_WINDOW", 0.05, minimum=0),
+            lead_batch_size=_int(env, "KOMMO_LEAD_BATCH_SIZE", 250, minimum=1),
+            custom_fields_ttl=_float(env, "KOMMO_CUSTOM_FIELDS_TTL", 3600.0, minimum=1),
+            batch_window=_float(env, "KOMMO_BATCH_WINDOW", 0.005, minimum=0),
+            conditional_cache_size=_int(env, "KOMMO_CONDITIONAL_CACHE_SIZE", 5000, minimum=1),
+            conditional_cache_ttl=_float(env, "KOMMO_CONDITIONAL_CACHE_TTL", 3600.0, minimum=1)
+        )
+        n8n = N8nSettings(
+            webhook_url=_str(env, "N8N_WEBHOOK_URL"),
+            whatsapp_url=_str(env, "N8N_WHATSAPP_URL"),
+            api_key=_str(env, "N8N_API_KEY"),
+            max_retries=_int(env, "N8N_MAX_RETRIES", 3, minimum=0),
+            retry_base_delay=_float(env, "N8N_RETRY_BASE_DELAY", 0.5, minimum=0),
+            retry_max_delay=_float(env, "N8N_RETRY_MAX_DELAY", 8.0, minimum=0),
+            breaker_failure_threshold=_int(env, "N8N_BREAKER_FAILURE_THRESHOLD", 5, minimum=1),
+            breaker_reset_timeout=_float(env, "N8N_BREAKER_RESET_TIMEOUT", 30.0, minimum=0),
+            spool_path=_str(env, "N8N_SPOOL_PATH", "data/n8n_spool.db"),
+            spool_drain_interval=_float(env, "N8N_SPOOL_DRAIN_INTERVAL", 2.0, minimum=0.1),
+            aggregation_window=_float(env, "N8N_AGGREGATION_WINDOW", 3.0, minimum=0),
+            aggregation_max_wait=_float(env, "N8N_AGGREGATION_MAX_WAIT", 10.0, minimum=0)
+        )
+        webhooks = WebhookSettings(
+            workers=_int(env, "WEBHOOK_WORKERS", 8, minimum=1),
+            queue_maxsize=_int(env, "WEBHOOK_QUEUE_MAXSIZE", 1000, minimum=1),
+            journal_path=_str(env, "WEBHOOK_JOURNAL_PATH", "data/webhook_jobs.db"),
+            job_lease=_float(env, "WEBHOOK_JOB_LEASE", 60.0, minimum=1),
+            dedup_size=_int(env, "WEBHOOK_DEDUP_SIZE", 50000, minimum=1),
+            dedup_ttl=_float(env, "WEBHOOK_DEDUP_TTL", 86400.0, minimum=1),
+            # Vazio desliga a persistência do índice
+            dedup_path=env.get("WEBHOOK_DEDUP_PATH", "data/webhook_dedup.db")
+        )
+        store = StoreSettings(
+            backend=_str(env, "CONVERSATION_STORE_BACKEND", "sqlite").lower(),
+            path=_str(env, "CONVERSATION_STORE_PATH", "data/conversations.db"),
+            # Vazio ou 0 desliga a expiração (padrão)
+            ttl=_float(env, "CONVERSATION_TTL", 0.0, minimum=0) or None,
+            flush_interval=_float(env, "CONVERSATION_STORE_FLUSH_INTERVAL", 0.2, minimum=0.01),
+            vendedores_cache_ttl=_float(env, "VENDEDORES_CACHE_TTL", 300.0, minimum=1),
+            vendedores_refresh_ahead=_float(env, "VENDEDORES_REFRESH_AHEAD", 60.0, minimum=0)
+        )
+        if store.backend not in ("memory", "sqlite", "shared"):
+            raise SettingsError(f"CONVERSATION_STORE_BACKEND inválido: {store.backend!r} (memory, sqlite ou shared)")
+        http = HttpSettings(
+            pool_limit=_int(env, "HTTP_POOL_LIMIT", 100, minimum=1),
+            pool_limit_per_host=_int(env, "HTTP_POOL_LIMIT_PER_HOST", 20, minimum=1),
+            dns_cache_ttl=_int(env, "HTTP_DNS_CACHE_TTL", 300, minimum=0),
+            keepalive_timeout=_float(env, "HTTP_KEEPALIVE_TIMEOUT", 30.0, minimum=0)
+        )
+        log = LogSettings(
+            level=_str(env, "LOG_LEVEL", "INFO").upper(),
+            format=_str(env, "LOG_FORMAT", "json").lower(),
+            payload_max_chars=_int(env, "LOG_PAYLOAD_MAX_CHARS", 500, minimum=1),
+            payload_sample_rate=_float(env, "LOG_PAYLOAD_SAMPLE_RATE", 0.01, minimum=0)
+        )
+
+        if log.level not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+            raise SettingsError(f"LOG_LEVEL inválido: {log.level!r}")
+
+        return cls(
+            environment=_str(env, "ENVIRONMENT", "development"),
+            web_concurrency=_int(env, "WEB_CONCURRENCY", 1, minimum=1),
+            fast_json=_bool(env, "FAST_JSON", False),
+            kommo=kommo,
+            n8n=n8n,
+            webhooks=webhooks,
+            store=store,
+            http=http,
+            log=log,
+            load_ms=round((time.perf_counter() - started) * 1000, 3)
+        )
+
+_settings: Optional[Settings] = None
+_reload_listeners: List[Callable[[Settings, Settings], None]] = []
+
+def get_settings() -> Settings:
+    """Snapshot atual da configuração (carregado no primeiro acesso)"""
+    global _settings
+
+    if _settings is None:
+        _settings = Settings.from_env(_read_environ())
+    return _settings
+
+def _read_environ() -> Mapping[str, str]:
+    """
+    Ambiente do processo mesclado com o .env, sem alterar os.environ
+
+    Variáveis definidas no ambiente real têm precedência sobre o .env (como
+    load_dotenv sem override). Como o .env nunca é copiado para os.environ,
+    uma recarga enxerga os valores novos do arquivo.
+    """
+    values = {key: value for key, value in dotenv_values().items() if value is not None}
+    values.update(os.environ)
+    return values
+
+def reload_settings() -> Settings:
+    """
+    Relê o .env e o ambiente e troca o snapshot atomicamente
+
+    Usado na rotação de tokens (SIGHUP). O .env não sobrescreve o
+    ambiente real e os.environ não é alterado. Se a nova configuração for
+    inválida, o snapshot anterior continua valendo.
+    """
+    global _settings
+
+    previous = get_settings()
+    settings = Settings.from_env(_read_environ())
+    _settings = settings
+    for listener in list(_reload_listeners):
+        listener(previous, settings)
+    return settings
+
+def add_reload_listener(listener: Callable[[Settings, Settings], None]):
+    """Registra um callback (anterior, novo) chamado após cada recarga"""
+    _reload_listeners.append(listener)
+
+def remove_reload_listener(listener: Callable[[Settings, Settings], None]):
+    if listener in _reload_listeners:
+        _reload_listeners.remove(listener)
@@ -1,32 +1,111 @@
-import os
-import logging
+import time
+import uuid
+import signal
+import asyncio
 import uvicorn
 import aiohttp
+from contextlib import asynccontextmanager
 from datetime import datetime
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-from dotenv import load_dotenv
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Any
 
 # Importar modelos Pydantic
-from app.models.kommo_models import ProactiveStart, BotCommand, N8nResponse, VendedorCustom, AgendamentoPayload
-from app.services.kommo_service import KommoService
-
-load_dotenv()
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+from app.models.kommo_models import ProactiveStart, BotCommand, N8nResponse, AgendamentoPayload, ApiStats
+from app.config import Settings, get_settings, reload_settings, SettingsError
+from app.services.container import ServiceContainer, init_container, get_container, reset_container, get_conversation_store
+from app.services.conversation_store import ConversationStore
+from app.services.n8n_service import DEFAULT_WEBHOOK_URL as DEFAULT_N8N_WEBHOOK_URL
+from app.services.api_stats import build_api_stats, record_proactive_started
+from app.utils.http_client import start_http_session, close_http_session, get_http_session
+from app.utils.workers import worker_count
+from app.utils.metrics import histogram, render_metrics
+from app.utils.fast_json import fast_json_enabled, response_class, route_class
+from app.utils.custom_fields import index_custom_fields
+from app.utils.logger import setup_logger, set_correlation_id, reset_correlation_id
+from app.routes.webhooks import router as webhooks_router
+
+logger = setup_logger(__name__)
 
 # ==========================================
 # CONFIGURAÇÃO FASTAPI
 # ==========================================
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Abre recursos compartilhados no startup e libera no shutdown"""
+    settings = get_settings()
+    logger.info(f"Configuração carregada em {settings.load_ms:.2f} ms ({settings.environment}, fast_json={fast_json_enabled()})")
+    session = await start_http_session()
+    container = init_container(session)
+    await container.start()
+    
+    # SIGHUP relê o .env (tokens rotacionados) sem reiniciar o processo
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGHUP, _reload_settings)
+        sighup_installed = True
+    except (NotImplementedError, AttributeError, RuntimeError, ValueError) as e:
+        # Windows, loop fora da thread principal (TestClient, alguns runners)
+        sighup_installed = False
+        logger.warning(f"Recarga da configuração via SIGHUP indisponível: {e or type(e).__name__}")
+    
+    yield
+    
+    if sighup_installed:
+        loop.remove_signal_handler(signal.SIGHUP)
+    await container.stop()
+    reset_container()
+    await close_http_session()
+
+def _reload_settings():
+    try:
+        settings = reload_settings()
+        logger.info(f"Configuração recarregada em {settings.load_ms:.2f} ms")
+    except SettingsError as e:
+        logger.error(f"Configuração recarregada inválida - mantendo a anterior: {e}")
+
 app = FastAPI(
     title="Kommo-n8n Integration API",
     description="API para integração entre Kommo CRM, n8n e WhatsApp Business com sistema de agendamento",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan,
+    # FAST_JSON=true: respostas com ORJSONResponse e corpo das requisições lido com orjson
+    default_response_class=response_class()
 )
+app.router.route_class = route_class()
+
+@app.middleware("http")
+async def correlation_id_middleware(request: Request, call_next):
+    """Id de correlação por requisição (X-Request-ID do cliente ou gerado) nos logs e na resposta"""
+    correlation_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    token = set_correlation_id(correlation_id)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_correlation_id(token)
+    response.headers["X-Request-ID"] = correlation_id
+    return response
+
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds",
+    "Tempo de resposta da API (para os webhooks, o tempo do ack)",
+    ("route", "method", "status")
+)
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Latência por rota (template do path, sem ids na cardinalidade)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method, status=status)
 
 app.add_middleware(
     CORSMiddleware,
@@ -36,14 +115,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Webhooks do Kommo: dedup + journal + fila (ack imediato, 503 quando a fila enche)
+app.include_router(webhooks_router, prefix="/webhooks")
+
 # ==========================================
 # CACHE E CONFIGURAÇÕES GLOBAIS
 # ==========================================
 
-_proactive_conversations = {}
-_vendedores_cache = {}
-_bot_status_cache = {}
-_last_vendedores_update = None
+# Conversas proativas e pausas do bot ficam no ConversationStore do container;
+# vendedores no VendedoresCache (snapshot persistido no mesmo store)
 
 # ==========================================
 # FUNÇÕES AUXILIARES
@@ -56,98 +136,22 @@ async def send_to_n8n(payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     try:
         # Usar URL do n8n configurada no .env
-        n8n_webhook_url = os.getenv("N8N_WEBHOOK_URL", "https://n8n-n8n.eanhw2.easypanel.host/webhook/serena")
+        n8n_webhook_url = get_settings().n8n.webhook_url or DEFAULT_N8N_WEBHOOK_URL
         
         # Manter URL do n8n que funciona (eanhw2.easypanel.host é o n8n real)
         # n8n.previdas.com.br é ESTE sistema Python, não o n8n!
         
-        logger.info(f"Enviando para n8n: {n8n_webhook_url}")
-        logger.info(f"Payload: {payload}")
-        
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Previdas-Bot/1.0"
-        }
-        
-        # API Key se disponível
-        api_key = os.getenv("N8N_API_KEY")
-        if api_key:
-            headers["Authorization"] = f"Bearer {api_key}"
-        
-        timeout = aiohttp.ClientTimeout(total=30, connect=10)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(n8n_webhook_url, json=payload, headers=headers) as response:
-                response_text = await response.text()
-                logger.info(f"📡 n8n Response Status: {response.status}")
+        # Retentativas, circuit breaker e spool ficam no N8nService
+        return await get_container().n8n.send_to_n8n_with_dict(payload, url=n8n_webhook_url)
                 
-                if response.status in [200, 201]:
-                    try:
-                        result = await response.json() if response.content_type == "application/json" else {"message": response_text}
-                        logger.info(f"Resposta do n8n: {result}")
-                        return result
-                    except:
-                        logger.info(f"n8n resposta (texto): {response_text}")
-                        return {"message": response_text, "status": "success"}
-                else:
-                    logger.error(f"Erro n8n {response.status}: {response_text}")
-                    return {"error": f"n8n error {response.status}: {response_text}"}
-                    
     except Exception as e:
         logger.error(f"Erro ao enviar para n8n: {e}")
         return {"error": str(e)}
 
 async def get_vendedores_dinamicos():
-    """Busca vendedores diretamente do Kommo"""
-    global _vendedores_cache, _last_vendedores_update
-    
+    """Vendedores do Kommo (último snapshot; a atualização roda em background)"""
     try:
-        # Cache por 5 minutos
-        if _last_vendedores_update and (datetime.now() - _last_vendedores_update).seconds < 300:
-            return _vendedores_cache
-        
-        kommo_service = KommoService()
-        api_url = os.getenv("KOMMO_API_URL")
-        access_token = os.getenv("KOMMO_ACCESS_TOKEN")
-        
-        if not api_url or not access_token:
-            logger.error("Configurações Kommo não encontradas")
-            return {}
-        
-        headers = {"Authorization": f"Bearer {access_token}"}
-        url = f"{api_url}/users"
-        
-        timeout = aiohttp.ClientTimeout(total=15, connect=5)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    users = data.get("_embedded", {}).get("users", [])
-                    
-                    vendedores = {}
-                    for user in users:
-                        if user.get("rights", {}).get("is_active", False):
-                            nome = user.get("name", "").strip()
-                            if nome:
-                                vendedores[nome] = {
-                                    "id": user.get("id"),
-                                    "name": nome,
-                                    "email": user.get("email", ""),
-                                    "phone_api": f"{nome.lower().replace(' ', '_')}_whatsapp",
-                                    "display_name": f"{nome} - Previdas",
-                                    "area_atuacao": "nao_identificada"
-                                }
-                    
-                    _vendedores_cache = vendedores
-                    _last_vendedores_update = datetime.now()
-                    
-                    logger.info(f"Encontrados {len(vendedores)} vendedores reais no Kommo")
-                    logger.info("Cache de vendedores atualizado com dados reais")
-                    
-                    return vendedores
-                else:
-                    logger.error(f"Erro ao buscar vendedores do Kommo: {response.status}")
-                    return {}
-                    
+        return await get_container().vendedores.get()
     except Exception as e:
         logger.error(f"Erro ao buscar vendedores: {e}")
         return {}
@@ -179,8 +183,9 @@ async def start_proactive_conversation(proactive_data: ProactiveStart) -> Dict[s
         conversation_id = f"conv_{proactive_data.contact_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
         # Salvar contexto da conversa
-        _proactive_conversations[proactive_data.contact_id] = {
+        await get_container().conversations.put(proactive_data.contact_id, {
             "conversation_id": conversation_id,
+            "lead_id": proactive_data.lead_id,
             "vendedor": proactive_data.vendedor,
             "area_atuacao": proactive_data.area_atuacao,
             "trigger_type": proactive_data.trigger_type,
@@ -188,7 +193,7 @@ async def start_proactive_conversation(proactive_data: ProactiveStart) -> Dict[s
             "initiated_by_bot": True,
             "first_response_received": False,
             "lead_data": proactive_data.lead_data or {}
-        }
+        })
         
         # Preparar payload para n8n
         payload = {
@@ -208,6 +213,7 @@ async def start_proactive_conversation(proactive_data: ProactiveStart) -> Dict[s
         result = await send_to_n8n(payload)
         
         if "error" not in result:
+            record_proactive_started(proactive_data.vendedor, proactive_data.trigger_type)
             logger.info(f"Conversa proativa iniciada com sucesso: {conversation_id}")
             return {
                 "success": True,
@@ -251,8 +257,8 @@ async def create_kommo_note_simple_DEPRECATED(conversation_id: str, message: str
         logger.info(f"Criando nota no lead {lead_id}")
         
         # Configurações Kommo
-        api_url = os.getenv("KOMMO_API_URL", "https://previdas.kommo.com/api/v4")
-        access_token = os.getenv("KOMMO_ACCESS_TOKEN")
+        api_url = get_settings().kommo.api_url or "https://previdas.kommo.com/api/v4"
+        access_token = get_container().kommo.access_token
         
         if not access_token:
             return {"success": False, "error": "KOMMO_ACCESS_TOKEN não configurado"}
@@ -278,36 +284,36 @@ async def create_kommo_note_simple_DEPRECATED(conversation_id: str, message: str
         logger.info(f"📦 Payload Notes: {note_payload}")
         
         timeout = aiohttp.ClientTimeout(total=20, connect=8)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(url, json=note_payload, headers=headers) as response:
-                response_text = await response.text()
-                logger.info(f"📡 Resposta API Notes: Status {response.status}")
-                logger.info(f"📡 Resposta API Notes: Body {response_text}")
+        session = get_http_session()
+        async with session.post(url, json=note_payload, headers=headers, timeout=timeout) as response:
+            response_text = await response.text()
+            logger.info(f"📡 Resposta API Notes: Status {response.status}")
+            logger.info(f"📡 Resposta API Notes: Body {response_text}")
+            
+            if response.status in [200, 201]:
+                try:
+                    result = await response.json() if response.content_type == "application/json" else {"raw": response_text}
+                    logger.info("✅ Nota criada com sucesso no Kommo via API Notes")
+                    return {"success": True, "data": result, "method": "api_notes"}
+                except:
+                    logger.info("✅ Nota criada (resposta não-JSON)")
+                    return {"success": True, "data": {"response": response_text}, "method": "api_notes"}
+            elif response.status == 400:
+                logger.warning(f"⚠️ Bad Request (400): {response_text}")
+                return {"success": False, "error": f"Bad Request: {response_text}"}
+            elif response.status == 401:
+                logger.error(f"❌ Token inválido (401): {response_text}")
+                return {"success": False, "error": "Token de acesso inválido"}
+            elif response.status == 403:
+                logger.error(f"❌ Sem permissão (403): {response_text}")
+                return {"success": False, "error": "Sem permissão para criar notas"}
+            elif response.status == 404:
+                logger.error(f"❌ Lead não encontrado (404): {response_text}")
+                return {"success": False, "error": f"Lead {lead_id} não encontrado"}
+            else:
+                logger.error(f"❌ Erro API Notes {response.status}: {response_text}")
+                return {"success": False, "error": f"API error {response.status}: {response_text}"}
                 
-                if response.status in [200, 201]:
-                    try:
-                        result = await response.json() if response.content_type == "application/json" else {"raw": response_text}
-                        logger.info("✅ Nota criada com sucesso no Kommo via API Notes")
-                        return {"success": True, "data": result, "method": "api_notes"}
-                    except:
-                        logger.info("✅ Nota criada (resposta não-JSON)")
-                        return {"success": True, "data": {"response": response_text}, "method": "api_notes"}
-                elif response.status == 400:
-                    logger.warning(f"⚠️ Bad Request (400): {response_text}")
-                    return {"success": False, "error": f"Bad Request: {response_text}"}
-                elif response.status == 401:
-                    logger.error(f"❌ Token inválido (401): {response_text}")
-                    return {"success": False, "error": "Token de acesso inválido"}
-                elif response.status == 403:
-                    logger.error(f"❌ Sem permissão (403): {response_text}")
-                    return {"success": False, "error": "Sem permissão para criar notas"}
-                elif response.status == 404:
-                    logger.error(f"❌ Lead não encontrado (404): {response_text}")
-                    return {"success": False, "error": f"Lead {lead_id} não encontrado"}
-                else:
-                    logger.error(f"❌ Erro API Notes {response.status}: {response_text}")
-                    return {"success": False, "error": f"API error {response.status}: {response_text}"}
-                    
     except Exception as e:
         logger.error(f"❌ Erro ao criar nota via API Notes: {e}")
         return {"success": False, "error": str(e)}
@@ -334,7 +340,7 @@ async def send_kommo_message_new_DEPRECATED(conversation_id: str, message: str)
             return {"success": False, "error": "conversation_id inválido"}
         
         # Buscar dados do lead via KommoService
-        kommo_service = KommoService()
+        kommo_service = get_container().kommo
         lead_data = await kommo_service.get_lead_by_contact(int(lead_id)) if lead_id.isdigit() else None
         if not lead_data:
             return {"success": False, "error": "Lead não encontrado"}
@@ -345,13 +351,7 @@ async def send_kommo_message_new_DEPRECATED(conversation_id: str, message: str)
             return {"success": False, "error": "Contato não encontrado"}
         
         contact = contact_data[0]
-        custom_fields = contact.get("custom_fields_values", [])
-        
-        whatsapp_number = None
-        for field in custom_fields:
-            if field.get("field_code") == "PHONE":
-                whatsapp_number = field.get("values", [{}])[0].get("value", "")
-                break
+        whatsapp_number = index_custom_fields(contact, "contacts").value("PHONE")
         
         if not whatsapp_number:
             return {"success": False, "error": "Número do WhatsApp não encontrado"}
@@ -362,8 +362,9 @@ async def send_kommo_message_new_DEPRECATED(conversation_id: str, message: str)
             clean_number = clean_number[2:]
         
         # Enviar via n8n (usando URL de produção)
-        n8n_whatsapp_url = os.getenv("N8N_WHATSAPP_URL", "https://n8n.previdas.com.br/webhook/whatsapp")
-        n8n_webhook_url = os.getenv("N8N_WEBHOOK_URL", "https://n8n.previdas.com.br/webhook/serena")
+        n8n_settings = get_settings().n8n
+        n8n_whatsapp_url = n8n_settings.whatsapp_url or "https://n8n.previdas.com.br/webhook/whatsapp"
+        n8n_webhook_url = n8n_settings.webhook_url or "https://n8n.previdas.com.br/webhook/serena"
         
         # Usar webhook principal se whatsapp específico não estiver configurado
         if "n8n-n8n.eanhw2.easypanel.host" in n8n_whatsapp_url:
@@ -380,24 +381,24 @@ async def send_kommo_message_new_DEPRECATED(conversation_id: str, message: str)
         }
         
         timeout = aiohttp.ClientTimeout(total=15, connect=5)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(n8n_whatsapp_url, json=payload) as response:
-                if response.status in [200, 201]:
-                    result = await response.json()
-                    logger.info(f"✅ FALLBACK: Mensagem enviada via n8n para {clean_number}")
-                    return {
-                        "success": True,
-                        "data": result,
-                        "message": "Mensagem enviada via n8n (fallback)",
-                        "conversation_id": conversation_id,
-                        "lead_id": lead_id,
-                        "method": "n8n_whatsapp_fallback"
-                    }
-                else:
-                    error_text = await response.text()
-                    logger.error(f"❌ FALLBACK: Erro n8n {response.status} - {error_text}")
-                    return {"success": False, "error": f"n8n error {response.status}: {error_text}"}
-                    
+        session = get_http_session()
+        async with session.post(n8n_whatsapp_url, json=payload, timeout=timeout) as response:
+            if response.status in [200, 201]:
+                result = await response.json()
+                logger.info(f"✅ FALLBACK: Mensagem enviada via n8n para {clean_number}")
+                return {
+                    "success": True,
+                    "data": result,
+                    "message": "Mensagem enviada via n8n (fallback)",
+                    "conversation_id": conversation_id,
+                    "lead_id": lead_id,
+                    "method": "n8n_whatsapp_fallback"
+                }
+            else:
+                error_text = await response.text()
+                logger.error(f"❌ FALLBACK: Erro n8n {response.status} - {error_text}")
+                return {"success": False, "error": f"n8n error {response.status}: {error_text}"}
+                
     except Exception as e:
         logger.error(f"❌ FALLBACK: Erro ao enviar via n8n: {e}")
         return {"success": False, "error": str(e)}
@@ -407,20 +408,49 @@ async def send_kommo_message_new_DEPRECATED(conversation_id: str, message: str)
 # ==========================================
 
 @app.get("/health")
-async def health_check():
+async def health_check(container: ServiceContainer = Depends(get_container), settings: Settings = Depends(get_settings)):
     """Health check endpoint"""
     return {
         "status": "healthy",
         "version": "3.0.0",
         "timestamp": datetime.now().isoformat(),
         "configuration": {
-            "kommo_configured": bool(os.getenv("KOMMO_ACCESS_TOKEN")),
-            "n8n_configured": bool(os.getenv("N8N_WEBHOOK_URL")),
+            "kommo_configured": bool(container.kommo.access_token),
+            "n8n_configured": bool(settings.n8n.webhook_url),
             "vendedores_configurados": len(await get_vendedores_dinamicos()),
-            "environment": "development"
-        }
+            "environment": settings.environment,
+            "settings_load_ms": settings.load_ms
+        },
+        "caches": container.cache_stats(),
+        "webhook_queue": container.webhook_queue.stats(),
+        "n8n_aggregation": container.webhook_processor.aggregator.stats(),
+        "kommo_rate_limiter": container.kommo.rate_limiter.stats(),
+        "kommo_token": container.kommo.tokens.stats(),
+        "kommo_lead_updates": container.kommo.lead_updates.stats(),
+        "kommo_batch_loaders": container.kommo.loader_stats(),
+        "kommo_conditional_gets": container.kommo.conditional_stats(),
+        "n8n": container.n8n.stats(),
+        "webhook_dedup": container.dedup.stats(),
+        "conversation_store": container.conversations.stats(),
+        "vendedores_cache": container.vendedores.stats(),
+        "custom_fields": container.custom_fields.stats()
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas do processo no formato texto do Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats", response_model=ApiStats)
+async def api_stats(container: ServiceContainer = Depends(get_container)):
+    """Conversas proativas e respostas por vendedor/gatilho (contadores deste worker)"""
+    return await build_api_stats(container.conversations)
+
+@app.get("/n8n/status")
+async def n8n_status(container: ServiceContainer = Depends(get_container)):
+    """Estado dos circuit breakers e do spool de entrega ao n8n"""
+    return container.n8n.stats()
+
 @app.get("/vendedores")
 async def get_vendedores():
     """Lista todos os vendedores disponíveis"""
@@ -460,98 +490,12 @@ async def receive_n8n_response(response_data: N8nResponse):
         logger.error(f"Erro ao processar resposta: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/webhooks/kommo")
-async def kommo_webhook(webhook_data: Dict[str, Any]):
-    """
-    Webhook do Kommo para receber mensagens de chat
-    """
-    try:
-        logger.info("Webhook do Kommo recebido")
-        logger.info(f"Dados: {webhook_data}")
-        
-        # Verificar se é uma mensagem de chat
-        if "chats" in webhook_data and "message" in webhook_data["chats"]:
-            message_data = webhook_data["chats"]["message"]
-            
-            conversation_id = message_data.get("conversation_id")
-            contact_id = message_data.get("contact_id")
-            message_text = message_data.get("text", "")
-            author_type = message_data.get("author", {}).get("type")
-            
-            logger.info(f"Mensagem de contato {contact_id}: '{message_text}'")
-            logger.info(f"Autor: {author_type}")
-            
-            # Processar apenas mensagens de contatos (não de agentes)
-            if author_type == "contact":
-                # Buscar vendedores para contexto
-                vendedores_dinamicos = await get_vendedores_dinamicos()
-                
-                # Buscar contexto da conversa
-                conversation_context = _proactive_conversations.get(contact_id, {})
-                vendedor = conversation_context.get("vendedor", "default")
-                
-                vendedor_config = vendedores_dinamicos.get(vendedor, {})
-                
-                # Preparar payload para n8n (MELHORADO COM SISTEMA DE AGENDAMENTO)
-                payload = {
-                    "conversation_id": conversation_id,
-                    "contact_id": contact_id,
-                    "message_text": message_text,
-                    "timestamp": datetime.now().isoformat(),
-                    "chat_type": "whatsapp",
-                    "lead_id": conversation_context.get("lead_id"),
-                    "contact_name": conversation_context.get("lead_data", {}).get("name", ""),
-                    "proactive_context": {
-                        "initiated_by_bot": conversation_context.get("initiated_by_bot", False),
-                        "trigger_source": conversation_context.get("trigger_type"),
-                        "first_response": conversation_context.get("first_response_received", False),
-                        "initiated_at": conversation_context.get("initiated_at")
-                    },
-                    "vendor_context": {
-                        "responsible_user": vendedor,
-                        "phone_api": vendedor_config.get("phone_api"),
-                        "display_name": vendedor_config.get("display_name"),
-                        "area_atuacao": conversation_context.get("area_atuacao")
-                    },
-                    # DADOS PARA SUPABASE/AGENDAMENTO
-                    "supabase_context": {
-                        "vendedor_for_scheduling": vendedor,
-                        "agenda_table": f"agenda_{vendedor.lower()}" if vendedor else None,
-                        "client_id": contact_id,
-                        "lead_id": conversation_context.get("lead_id"),
-                        "conversation_active": True,
-                        "scheduling_enabled": True
-                    }
-                }
-                
-                # Enviar para n8n (IA)
-                result = await send_to_n8n(payload)
-                
-                if "error" not in result:
-                    # Marcar primeira resposta recebida
-                    if contact_id in _proactive_conversations:
-                        _proactive_conversations[contact_id]["first_response_received"] = True
-                    
-                    logger.info(f"Mensagem processada e enviada para n8n: {conversation_id}")
-                    return {"status": "processed", "conversation_id": conversation_id}
-                else:
-                    logger.error(f"Erro ao enviar para n8n: {result}")
-                    return {"status": "error", "message": result.get("error")}
-            else:
-                return {"status": "ignored", "reason": "Message from agent or system"}
-        else:
-            return {"status": "ignored", "reason": "Not a chat message"}
-            
-    except Exception as e:
-        logger.error(f"Erro ao processar webhook do Kommo: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
 # ==========================================
 # AGENDAMENTO E SISTEMA SUPABASE
 # ==========================================
 
 @app.post("/agendamento/request")
-async def request_agendamento(agendamento: AgendamentoPayload):
+async def request_agendamento(agendamento: AgendamentoPayload, store: ConversationStore = Depends(get_conversation_store)):
     """
     Endpoint para solicitar agendamento - integração com Supabase via n8n
     
@@ -560,29 +504,42 @@ async def request_agendamento(agendamento: AgendamentoPayload):
     try:
         vendedor_info = None
         
-        # 1. Tentar identificar vendedor por conversation_id
+        # 1. Tentar identificar vendedor por conversation_id (índice secundário, O(1))
         if agendamento.conversation_id:
-            for contact_id, conversation in _proactive_conversations.items():
-                if conversation.get("conversation_id") == agendamento.conversation_id:
-                    vendedor_info = {
-                        "name": conversation.get("vendedor"),
-                        "source": "conversation_id",
-                        "area_atuacao": conversation.get("area_atuacao"),
-                        "lead_data": conversation.get("lead_data", {})
-                    }
-                    break
+            found = await store.find_by_conversation_id(agendamento.conversation_id)
+            if found:
+                _, conversation = found
+                vendedor_info = {
+                    "name": conversation.get("vendedor"),
+                    "source": "conversation_id",
+                    "area_atuacao": conversation.get("area_atuacao"),
+                    "lead_data": conversation.get("lead_data", {})
+                }
         
         # 2. Tentar identificar por contact_id
-        if not vendedor_info and agendamento.contact_id in _proactive_conversations:
-            conversation = _proactive_conversations[agendamento.contact_id]
-            vendedor_info = {
-                "name": conversation.get("vendedor"),
-                "source": "contact_id",
-                "area_atuacao": conversation.get("area_atuacao"),
-                "lead_data": conversation.get("lead_data", {})
-            }
+        if not vendedor_info:
+            conversation = await store.get(agendamento.contact_id)
+            if conversation:
+                vendedor_info = {
+                    "name": conversation.get("vendedor"),
+                    "source": "contact_id",
+                    "area_atuacao": conversation.get("area_atuacao"),
+                    "lead_data": conversation.get("lead_data", {})
+                }
         
-        # 3. Usar vendedor solicitado como fallback
+        # 3. Tentar identificar por lead_id
+        if not vendedor_info and agendamento.lead_id:
+            found = await store.find_by_lead_id(agendamento.lead_id)
+            if found:
+                _, conversation = found
+                vendedor_info = {
+                    "name": conversation.get("vendedor"),
+                    "source": "lead_id",
+                    "area_atuacao": conversation.get("area_atuacao"),
+                    "lead_data": conversation.get("lead_data", {})
+                }
+        
+        # 4. Usar vendedor solicitado como fallback
         if not vendedor_info and agendamento.vendedor_requested:
             vendedor_info = {
                 "name": agendamento.vendedor_requested,
@@ -591,7 +548,7 @@ async def request_agendamento(agendamento: AgendamentoPayload):
                 "lead_data": {}
             }
         
-        # 4. Fallback final
+        # 5. Fallback final
         if not vendedor_info:
             vendedor_info = {
                 "name": "João",  # Vendedor padrão
@@ -730,7 +687,7 @@ async def start_proactive_endpoint(proactive_data: ProactiveStart):
         }
 
 @app.post("/bot/control")
-async def bot_control(command_data: BotCommand):
+async def bot_control(command_data: BotCommand, store: ConversationStore = Depends(get_conversation_store)):
     """Controle do bot - pausar/reativar por contato"""
     try:
         contact_id = command_data.contact_id
@@ -738,11 +695,11 @@ async def bot_control(command_data: BotCommand):
         
         if command == "pause":
             # Cache para marcar bot como pausado
-            _bot_status_cache[contact_id] = {
+            await store.set_bot_status(contact_id, {
                 "status": "paused",
                 "timestamp": datetime.now().isoformat(),
                 "paused_by": "manual_control"
-            }
+            })
             
             logger.info(f"Bot pausado para contato {contact_id}")
             return {
@@ -753,9 +710,8 @@ async def bot_control(command_data: BotCommand):
             }
             
         elif command == "resume":
-            # Remove do cache para reativar
-            if contact_id in _bot_status_cache:
-                del _bot_status_cache[contact_id]
+            # Remove a pausa para reativar
+            await store.clear_bot_status(contact_id)
             
             logger.info(f"Bot reativado para contato {contact_id}")
             return {
@@ -767,7 +723,7 @@ async def bot_control(command_data: BotCommand):
             
         elif command == "status":
             # Verificar status atual
-            status = _bot_status_cache.get(contact_id, {"status": "active"})
+            status = await store.get_bot_status(contact_id) or {"status": "active"}
             return {
                 "status": "success",
                 "contact_id": contact_id,
@@ -784,21 +740,23 @@ async def bot_control(command_data: BotCommand):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/bot/status")
-async def get_bot_status():
+async def get_bot_status(store: ConversationStore = Depends(get_conversation_store)):
     """Ver status geral de todos os bots"""
     try:
-        total_paused = len(_bot_status_cache)
-        total_active = len(_proactive_conversations) - total_paused
+        paused_contacts = await store.paused_contacts()
+        active_conversations = await store.contact_ids()
+        total_paused = len(paused_contacts)
+        total_active = len(active_conversations) - total_paused
         
         return {
             "status": "success",
             "summary": {
-                "total_conversations": len(_proactive_conversations),
+                "total_conversations": len(active_conversations),
                 "active_bots": max(0, total_active),
                 "paused_bots": total_paused
             },
-            "paused_contacts": list(_bot_status_cache.keys()),
-            "active_conversations": list(_proactive_conversations.keys()),
+            "paused_contacts": paused_contacts,
+            "active_conversations": active_conversations,
             "timestamp": datetime.now().isoformat()
         }
         
@@ -807,14 +765,14 @@ async def get_bot_status():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/bot/pause/{contact_id}")
-async def pause_bot_quick(contact_id: int):
+async def pause_bot_quick(contact_id: int, store: ConversationStore = Depends(get_conversation_store)):
     """Pausar bot rapidamente via URL"""
     try:
-        _bot_status_cache[contact_id] = {
+        await store.set_bot_status(contact_id, {
             "status": "paused",
             "timestamp": datetime.now().isoformat(),
             "paused_by": "quick_pause"
-        }
+        })
         
         return {
             "status": "success",
@@ -826,11 +784,10 @@ async def pause_bot_quick(contact_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/bot/resume/{contact_id}")
-async def resume_bot_quick(contact_id: int):
+async def resume_bot_quick(contact_id: int, store: ConversationStore = Depends(get_conversation_store)):
     """Reativar bot rapidamente via URL"""
     try:
-        if contact_id in _bot_status_cache:
-            del _bot_status_cache[contact_id]
+        await store.clear_bot_status(contact_id)
         
         return {
             "status": "success",
@@ -842,15 +799,15 @@ async def resume_bot_quick(contact_id: int):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/config/check")
-async def config_check():
+async def config_check(container: ServiceContainer = Depends(get_container), settings: Settings = Depends(get_settings)):
     """Verificação de configuração completa"""
     return {
-        "kommo_api_url": "Configurado" if os.getenv("KOMMO_API_URL") else "Não configurado",
-        "kommo_access_token": "Configurado" if os.getenv("KOMMO_ACCESS_TOKEN") else "Não configurado",
-        "n8n_webhook_url": "Configurado" if os.getenv("N8N_WEBHOOK_URL") else "Não configurado",
-        "n8n_api_key": "Configurado" if os.getenv("N8N_API_KEY") else "Não configurado",
-        "vendedores_cache": len(_vendedores_cache),
-        "conversations_active": len(_proactive_conversations),
+        "kommo_api_url": "Configurado" if settings.kommo.api_url else "Não configurado",
+        "kommo_access_token": "Configurado" if container.kommo.access_token else "Não configurado",
+        "n8n_webhook_url": "Configurado" if settings.n8n.webhook_url else "Não configurado",
+        "n8n_api_key": "Configurado" if settings.n8n.api_key else "Não configurado",
+        "vendedores_cache": container.vendedores.stats()["vendedores"],
+        "conversations_active": await container.conversations.count(),
         "timestamp": datetime.now().isoformat()
     }
 
@@ -861,12 +818,13 @@ async def config_check():
 async def get_vendedores_config():
     """Retorna configuração completa dos vendedores"""
     vendedores_dinamicos = await get_vendedores_dinamicos()
+    updated_at = get_container().vendedores.updated_at
     
     return {
         "vendedores": vendedores_dinamicos,
         "total": len(vendedores_dinamicos),
         "source": "kommo_api",
-        "cache_updated": _last_vendedores_update.isoformat() if _last_vendedores_update else None,
+        "cache_updated": updated_at.isoformat() if updated_at else None,
         "available_areas": [
             "previdenciario",
             "trabalhista", 
@@ -889,4 +847,8 @@ if __name__ == "__main__":
     logger.info("- Controle de bot em tempo real")
     logger.info("- Integração completa Kommo + n8n + Supabase")
     
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # reload só em desenvolvimento; em produção N workers (WEB_CONCURRENCY) com estado compartilhado
+    if get_settings().environment == "development" and worker_count() == 1:
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, workers=worker_count())
\ No newline at end of file
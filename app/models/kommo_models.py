@@ -103,6 +103,9 @@ class N8nPayload(BaseModel):
     contact_name: Optional[str] = Field(None, description="Nome do contato")
     phone_number: Optional[str] = Field(None, description="Número de telefone/WhatsApp do contato")
     
+    # Mensagens agrupadas na janela de agregação (message_text contém o texto combinado)
+    messages: Optional[List[Dict[str, Any]]] = Field(None, description="Mensagens consecutivas agrupadas")
+    
     # Contexto proativo
     proactive_context: Optional[Dict[str, Any]] = Field(None, description="Contexto de conversas proativas")
     
@@ -173,6 +176,30 @@ class ApiHealthResponse(BaseModel):
     configuration: Dict[str, Any] = Field(..., description="Status da configuração")
     features: List[str] = Field(..., description="Funcionalidades ativas")
 
+class OAuthTokenRequest(BaseModel):
+    """Troca de código de autorização por tokens"""
+    code: str = Field(..., description="Código de autorização do OAuth")
+
+class RefreshTokenRequest(BaseModel):
+    """Renovação manual do access token"""
+    refresh_token: Optional[str] = Field(None, description="Refresh token (padrão: o atual)")
+
+class OAuthTokenResponse(BaseModel):
+    """Tokens OAuth do Kommo"""
+    access_token: str = Field(..., description="Access token")
+    refresh_token: Optional[str] = Field(None, description="Refresh token")
+    token_type: str = Field(default="Bearer", description="Tipo do token")
+    expires_in: int = Field(..., description="Validade em segundos")
+
+class OAuthStatusResponse(BaseModel):
+    """Status da autenticação OAuth"""
+    oauth_configured: bool = Field(..., description="Se há access token")
+    client_id: Optional[str] = Field(None, description="Client ID (truncado)")
+    account_id: Optional[str] = Field(None, description="ID da conta Kommo")
+    api_url: Optional[str] = Field(None, description="URL da API")
+    token_expires_at: Optional[datetime] = Field(None, description="Vencimento do access token")
+    token_expired: Optional[bool] = Field(None, description="Se o token já venceu")
+
 class VendedorResponse(BaseModel):
     """Resposta com dados de vendedores"""
     vendedores_reais: List[Dict[str, Any]] = Field(..., description="Vendedores reais do Kommo")
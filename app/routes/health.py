@@ -1,29 +1,62 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
 from datetime import datetime
-import os
+from app.config import Settings, get_settings
+from app.services.container import ServiceContainer, get_container
+from app.services.api_stats import build_api_stats
+from app.models.kommo_models import ApiStats
+from app.utils.metrics import render_metrics
 
 router = APIRouter()
 
 @router.get("/health")
-async def health_check():
+async def health_check(container: ServiceContainer = Depends(get_container), settings: Settings = Depends(get_settings)):
     """Health check endpoint"""
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "version": "1.0.0",
-        "environment": os.getenv("ENVIRONMENT", "development")
+        "environment": settings.environment,
+        "caches": container.cache_stats(),
+        "webhook_queue": container.webhook_queue.stats(),
+        "n8n_aggregation": container.webhook_processor.aggregator.stats(),
+        "kommo_rate_limiter": container.kommo.rate_limiter.stats(),
+        "kommo_token": container.kommo.tokens.stats(),
+        "kommo_lead_updates": container.kommo.lead_updates.stats(),
+        "kommo_batch_loaders": container.kommo.loader_stats(),
+        "kommo_conditional_gets": container.kommo.conditional_stats(),
+        "n8n": container.n8n.stats(),
+        "webhook_dedup": container.dedup.stats(),
+        "conversation_store": container.conversations.stats(),
+        "vendedores_cache": container.vendedores.stats(),
+        "custom_fields": container.custom_fields.stats()
     }
 
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Métricas do processo no formato texto do Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@router.get("/stats", response_model=ApiStats)
+async def api_stats(container: ServiceContainer = Depends(get_container)):
+    """Conversas proativas e respostas por vendedor/gatilho (contadores deste worker)"""
+    return await build_api_stats(container.conversations)
+
+@router.get("/n8n/status")
+async def n8n_status(container: ServiceContainer = Depends(get_container)):
+    """Estado dos circuit breakers e do spool de entrega ao n8n"""
+    return container.n8n.stats()
+
 @router.get("/status")
-async def status():
+async def status(container: ServiceContainer = Depends(get_container), settings: Settings = Depends(get_settings)):
     """Status detalhado da aplicação"""
     return {
         "application": "kommo-n8n-integration",
         "status": "running",
         "timestamp": datetime.now().isoformat(),
         "config": {
-            "kommo_configured": bool(os.getenv("KOMMO_ACCESS_TOKEN")),
-            "n8n_configured": bool(os.getenv("N8N_WEBHOOK_URL")),
-            "environment": os.getenv("ENVIRONMENT", "development")
+            "kommo_configured": bool(container.kommo.access_token),
+            "n8n_configured": bool(settings.n8n.webhook_url),
+            "environment": settings.environment
         }
     }
@@ -1,5 +1,6 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from app.services.kommo_service import KommoService
+from app.services.container import get_kommo_service
 from app.utils.logger import setup_logger
 from app.models.kommo_models import (
     OAuthTokenRequest, 
@@ -13,30 +14,25 @@ router = APIRouter()
 logger = setup_logger(__name__)
 
 @router.get("/callback")
-async def oauth_callback(code: str = None, state: str = None):
+async def oauth_callback(code: str = None, state: str = None, kommo: KommoService = Depends(get_kommo_service)):
     """Callback do OAuth2 do Kommo"""
     if not code:
         raise HTTPException(status_code=400, detail="Código de autorização não fornecido")
     
     try:
-        kommo = KommoService()
         logger.info(f"OAuth callback recebido - code: {code[:20]}...")
         
-        # Troca código por token
-        tokens = await kommo.exchange_code_for_token(code)
+        # Troca código por token (o TokenManager persiste e passa a renovar)
+        tokens = await kommo.tokens.exchange_code(code)
         
         if not tokens:
             raise HTTPException(status_code=400, detail="Falha ao trocar código por token")
         
-        # Salva tokens no .env
-        saved = await kommo.save_tokens_to_env(tokens)
-        
         return {
             "status": "success", 
             "message": "Tokens OAuth obtidos e salvos com sucesso",
             "access_token": tokens.get("access_token")[:20] + "..." if tokens.get("access_token") else None,
-            "expires_at": tokens.get("expires_at"),
-            "saved_to_env": saved
+            "expires_at": kommo.tokens.token_expires_at.isoformat() if kommo.tokens.token_expires_at else None
         }
         
     except HTTPException:
@@ -46,50 +42,44 @@ async def oauth_callback(code: str = None, state: str = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/status", response_model=OAuthStatusResponse)
-async def oauth_status():
+async def oauth_status(kommo: KommoService = Depends(get_kommo_service)):
     """Verifica status da autenticação OAuth"""
-    kommo = KommoService()
-    
     token_expired = None
-    if kommo.token_expires_at:
-        token_expired = kommo.is_token_expired()
+    if kommo.tokens.token_expires_at:
+        token_expired = kommo.tokens.is_expired()
     
     return OAuthStatusResponse(
         oauth_configured=bool(kommo.access_token),
         client_id=kommo.client_id[:8] + "..." if kommo.client_id else None,
         account_id=kommo.account_id,
         api_url=kommo.api_url,
-        token_expires_at=kommo.token_expires_at,
+        token_expires_at=kommo.tokens.token_expires_at,
         token_expired=token_expired
     )
 
 @router.post("/refresh", response_model=OAuthTokenResponse)
-async def refresh_token(request: RefreshTokenRequest):
+async def refresh_token(request: RefreshTokenRequest, kommo: KommoService = Depends(get_kommo_service)):
     """Renova o access token usando refresh token"""
     try:
-        kommo = KommoService()
-        
-        # Usa refresh token do request ou do serviço
-        refresh_token = request.refresh_token or kommo.refresh_token
-        if not refresh_token:
+        if not request.refresh_token and not kommo.tokens.refresh_token:
             raise HTTPException(status_code=400, detail="Refresh token não fornecido")
         
         logger.info("Renovando token via endpoint...")
         
-        # Renova o token
-        tokens = await kommo.refresh_access_token(refresh_token)
-        
-        if not tokens:
+        # Token do request é passado à renovação (só vale se o Kommo aceitar);
+        # sem ele, usa o do serviço e compartilha a renovação em andamento
+        if request.refresh_token:
+            renewed = await kommo.tokens.refresh_with(request.refresh_token)
+        else:
+            renewed = await kommo.tokens.refresh()
+        if not renewed:
             raise HTTPException(status_code=400, detail="Falha ao renovar token")
         
-        # Salva tokens no .env
-        saved = await kommo.save_tokens_to_env(tokens)
-        
         return OAuthTokenResponse(
-            access_token=tokens["access_token"],
-            refresh_token=tokens.get("refresh_token", refresh_token),
+            access_token=kommo.tokens.access_token,
+            refresh_token=kommo.tokens.refresh_token,
             token_type="Bearer",
-            expires_in=tokens.get("expires_in", 86400)
+            expires_in=int(kommo.tokens.expires_in() or 0)
         )
         
     except HTTPException:
@@ -99,22 +89,17 @@ async def refresh_token(request: RefreshTokenRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/exchange")
-async def exchange_code(request: OAuthTokenRequest):
+async def exchange_code(request: OAuthTokenRequest, kommo: KommoService = Depends(get_kommo_service)):
     """Troca código de autorização por tokens (alternativo ao callback)"""
     try:
-        kommo = KommoService()
-        
         logger.info("Trocando código por token via endpoint...")
         
-        # Troca código por token
-        tokens = await kommo.exchange_code_for_token(request.code)
+        # Troca código por token (o TokenManager persiste e passa a renovar)
+        tokens = await kommo.tokens.exchange_code(request.code)
         
         if not tokens:
             raise HTTPException(status_code=400, detail="Falha ao trocar código por token")
         
-        # Salva tokens no .env
-        saved = await kommo.save_tokens_to_env(tokens)
-        
         return {
             "status": "success",
             "message": "Tokens obtidos com sucesso",
@@ -123,8 +108,7 @@ async def exchange_code(request: OAuthTokenRequest):
                 refresh_token=tokens["refresh_token"],
                 token_type="Bearer",
                 expires_in=tokens.get("expires_in", 86400)
-            ),
-            "saved_to_env": saved
+            )
         }
         
     except HTTPException:
@@ -1,12 +1,21 @@
-from fastapi import APIRouter, Request, BackgroundTasks, HTTPException
+from fastapi import APIRouter, Request, HTTPException, Depends
+from app.services.job_queue import WebhookJobQueue, QueueSaturatedError
+from app.services.dedup_index import DedupIndex
 from app.services.webhook_processor import WebhookProcessor
-from app.utils.logger import setup_logger
+from app.services.container import get_webhook_queue, get_dedup_index, get_webhook_processor
+from app.utils.logger import setup_logger, payload_preview
+from app.utils import fast_json
+from app.utils.fast_json import route_class
+from app.utils.form_decoder import decode_bracket_form
 from typing import Dict, Any
 
-router = APIRouter()
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+router = APIRouter(route_class=route_class())
 logger = setup_logger(__name__)
 
 @router.post("/kommo",
+    status_code=202,
     summary="Recebe webhook do Kommo",
     description="""
     ### 📥 Endpoint para Webhook do Kommo
@@ -19,7 +28,7 @@ logger = setup_logger(__name__)
     - URL: `https://dashboard.previdas.com.br/api/kommo-n8n/webhooks/kommo`
     - Evento: "Lead adicionado"
     - Método: POST
-    - Content-Type: application/json
+    - Content-Type: application/x-www-form-urlencoded (padrão do Kommo) ou application/json
     
     **Fluxo:**
     1. Kommo dispara webhook → Este endpoint
@@ -30,27 +39,82 @@ logger = setup_logger(__name__)
     tags=["kommo", "webhook", "whatsapp"]
 )
 async def receive_kommo_webhook(
-    webhook_data: Dict[Any, Any],
-    background_tasks: BackgroundTasks
+    request: Request,
+    queue: WebhookJobQueue = Depends(get_webhook_queue),
+    dedup: DedupIndex = Depends(get_dedup_index),
+    processor: WebhookProcessor = Depends(get_webhook_processor)
 ):
-    """Recebe webhooks do Kommo e processa mensagens"""
+    """Recebe webhooks do Kommo (form-urlencoded ou JSON) e enfileira cada evento"""
+    webhook_data = await read_webhook_body(request)
+    if not isinstance(webhook_data, dict):
+        raise HTTPException(status_code=400, detail="Webhook deve ser um objeto")
+    
+    logger.info("Webhook recebido do Kommo")
+    logger.debug("Webhook: %s", payload_preview(webhook_data))
+    
+    results = []
+    for event in processor.split_events(webhook_data):
+        results.append(await _enqueue_event(event, queue, dedup, processor))
+    
+    if len(results) == 1:
+        return results[0]
+    return {
+        "status": "received",
+        "message": f"{len(results)} eventos recebidos",
+        "events": results
+    }
+
+async def read_webhook_body(request: Request) -> Any:
+    """Corpo do webhook: form-urlencoded (formato do Kommo) ou JSON"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(FORM_CONTENT_TYPE):
+        return decode_bracket_form(body)
+    try:
+        return fast_json.loads(body) if body else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Corpo do webhook não é JSON nem form-urlencoded válido")
+
+async def _enqueue_event(
+    webhook_data: Dict[Any, Any],
+    queue: WebhookJobQueue,
+    dedup: DedupIndex,
+    processor: WebhookProcessor
+) -> Dict[str, Any]:
+    """Deduplica e enfileira um evento da entrega"""
+    dedup_key = None
     try:
-        logger.info(f"Webhook recebido do Kommo: {webhook_data}")
+        # Reentrega do Kommo: responde 200 sem processar de novo
+        dedup_key = processor.dedup_key(webhook_data)
+        if dedup_key and not await dedup.check_and_mark(dedup_key):
+            logger.info(f"Webhook duplicado ignorado: {dedup_key}")
+            return {"status": "duplicate", "message": "Webhook já recebido", "dedup_key": dedup_key}
         
-        processor = WebhookProcessor()
-        background_tasks.add_task(
-            processor.process_webhook, 
-            webhook_data
-        )
+        # Persiste e enfileira; o processamento acontece nos workers da fila
+        job_id = await queue.enqueue(webhook_data)
+        logger.info("Webhook enfileirado como job %s", job_id)
         
         return {
             "status": "received", 
             "message": "Webhook recebido e sendo processado",
+            "job_id": job_id,
             "timestamp": webhook_data.get("timestamp")
         }
         
+    except QueueSaturatedError as e:
+        # Eventos já enfileirados viram "duplicate" na reentrega do Kommo
+        logger.warning(f"Webhook rejeitado - {e}")
+        if dedup_key:
+            await dedup.forget(dedup_key)
+        raise HTTPException(
+            status_code=503,
+            detail="Fila de processamento cheia, tente novamente",
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
         logger.error(f"Erro ao processar webhook: {e}")
+        if dedup_key:
+            await dedup.forget(dedup_key)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/test")
@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import Dict
+from app.models.kommo_models import ApiStats, ConversationStats, VendorStats
+from app.services.conversation_store import ConversationStore
+from app.utils.metrics import counter
+
+# Contadores de conversas proativas (também exportados no /metrics)
+PROACTIVE_STARTED = counter(
+    "proactive_conversations_started_total",
+    "Conversas proativas iniciadas",
+    ("vendedor", "trigger")
+)
+FIRST_RESPONSES = counter(
+    "proactive_first_responses_total",
+    "Leads que responderam à abordagem proativa",
+    ("vendedor",)
+)
+
+def record_proactive_started(vendedor: str, trigger: str):
+    PROACTIVE_STARTED.inc(vendedor=vendedor or "desconhecido", trigger=trigger or "desconhecido")
+
+def record_first_response(vendedor: str):
+    FIRST_RESPONSES.inc(vendedor=vendedor or "desconhecido")
+
+async def build_api_stats(store: ConversationStore) -> ApiStats:
+    """
+    Monta o ApiStats a partir dos contadores do processo
+
+    Totais e respostas contam desde o startup deste worker; conversas
+    ativas vêm do ConversationStore.
+    """
+    by_vendor: Dict[str, VendorStats] = {}
+    by_trigger: Dict[str, int] = {}
+    total = 0
+    for (vendedor, trigger), value in PROACTIVE_STARTED.values().items():
+        count = int(value)
+        total += count
+        by_vendor.setdefault(vendedor, VendorStats()).total += count
+        by_trigger[trigger] = by_trigger.get(trigger, 0) + count
+
+    with_response = 0
+    for (vendedor,), value in FIRST_RESPONSES.values().items():
+        count = int(value)
+        with_response += count
+        by_vendor.setdefault(vendedor, VendorStats()).with_response += count
+
+    return ApiStats(
+        timestamp=datetime.now().isoformat(),
+        conversations=ConversationStats(
+            total=total,
+            active=await store.count(),
+            with_response=with_response,
+            response_rate=round(with_response / total * 100, 2) if total else 0.0
+        ),
+        by_vendor=by_vendor,
+        by_trigger=by_trigger,
+        bot_status_cache_size=len(await store.paused_contacts())
+    )
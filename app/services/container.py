@@ -0,0 +1,185 @@
+import asyncio
+import aiohttp
+from typing import Optional, Dict, Any, Iterable, List, Tuple
+from app.config import Settings, get_settings, add_reload_listener, remove_reload_listener
+from app.services.kommo_service import KommoService
+from app.services.n8n_service import N8nService
+from app.services.webhook_processor import WebhookProcessor
+from app.services.job_queue import WebhookJobQueue
+from app.services.dedup_index import DedupIndex
+from app.services.conversation_store import ConversationStore, create_conversation_store
+from app.services.vendedores_cache import VendedoresCache
+from app.services.custom_field_schema import CustomFieldSchema
+from app.utils.logger import setup_logger
+from app.utils.metrics import REGISTRY
+from app.utils.circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN
+
+logger = setup_logger(__name__)
+
+class ServiceContainer:
+    """Instâncias únicas dos serviços, compartilhadas entre todas as requisições"""
+
+    def __init__(self, session: Optional[aiohttp.ClientSession] = None, settings: Optional[Settings] = None):
+        self.settings = settings or get_settings()
+        self.conversations = create_conversation_store(self.settings)
+        self.kommo = KommoService(session=session, store=self.conversations, settings=self.settings)
+        self.n8n = N8nService(session=session, settings=self.settings)
+        self.vendedores = VendedoresCache(kommo=self.kommo, store=self.conversations, settings=self.settings)
+        self.webhook_processor = WebhookProcessor(
+            kommo=self.kommo,
+            n8n=self.n8n,
+            settings=self.settings,
+            store=self.conversations,
+            vendedores=self.vendedores
+        )
+        self.dedup = DedupIndex(settings=self.settings)
+        self.custom_fields = CustomFieldSchema(kommo=self.kommo, store=self.conversations, settings=self.settings)
+        self.kommo.field_schema = self.custom_fields
+        self.webhook_queue = WebhookJobQueue(
+            handler=self.webhook_processor.process_kommo_event,
+            key_fn=self.webhook_processor.conversation_key,
+            settings=self.settings
+        )
+
+    async def start(self):
+        """Inicia tarefas de background dos serviços"""
+        await self.kommo.tokens.start()
+        await self.n8n.start()
+        await self.dedup.start()
+        await self.conversations.start()
+        await self.vendedores.start()
+        await self.custom_fields.start()
+        await self.webhook_queue.start()
+
+    async def stop(self):
+        """Encerra tarefas de background dos serviços"""
+        # Lotes agregados são enviados antes de fechar o journal: os jobs deles saem junto
+        await self.webhook_queue.stop(drain=self.webhook_processor.aggregator.stop)
+        await self.n8n.stop()
+        await self.dedup.stop()
+        await self.vendedores.stop()
+        await self.custom_fields.stop()
+        await self.kommo.lead_updates.stop()
+        await self.kommo.tokens.stop()
+        await self.conversations.stop()
+
+    def apply_settings(self, previous: Settings, settings: Settings):
+        """
+        Aplica uma configuração recarregada (rotação de tokens/credenciais)
+
+        Só credenciais são trocadas a quente; tamanhos de fila, caminhos e
+        limites continuam os do startup.
+        """
+        self.settings = settings
+        if (settings.kommo.access_token, settings.kommo.refresh_token) != (previous.kommo.access_token, previous.kommo.refresh_token):
+            # Persistir os tokens exige I/O: roda em background no event loop
+            asyncio.ensure_future(self.kommo.tokens.adopt(settings.kommo))
+        if settings.n8n.api_key != previous.n8n.api_key:
+            self.n8n.api_key = settings.n8n.api_key
+            logger.info("API key do n8n recarregada da configuração")
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Estatísticas dos caches mantidos pelos serviços"""
+        return self.kommo.cache_stats()
+
+    def collect_metrics(self) -> Iterable[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]:
+        """Valores lidos dos stats() dos serviços na hora da exportação do /metrics"""
+        caches = dict(self.cache_stats())
+        caches.pop("kommo_singleflight", None)
+        caches["webhook_dedup"] = self.dedup.stats()["memory"]
+        yield ("cache_hits_total", "counter", "Acertos dos caches em memória",
+               [({"cache": name}, stats["hits"]) for name, stats in caches.items()])
+        yield ("cache_misses_total", "counter", "Faltas dos caches em memória",
+               [({"cache": name}, stats["misses"]) for name, stats in caches.items()])
+        yield ("cache_hit_ratio", "gauge", "Taxa de acerto dos caches em memória",
+               [({"cache": name}, stats["hit_ratio"]) for name, stats in caches.items()])
+        yield ("cache_size", "gauge", "Entradas nos caches em memória",
+               [({"cache": name}, stats["size"]) for name, stats in caches.items()])
+
+        queue = self.webhook_queue.stats()
+        yield ("webhook_queue_depth", "gauge", "Webhooks aguardando processamento", [({}, queue["depth"])])
+        yield ("webhook_queue_in_progress", "gauge", "Webhooks em processamento", [({}, queue["in_progress"])])
+        yield ("webhook_queue_rejected_total", "counter", "Webhooks recusados com a fila cheia", [({}, queue["rejected"])])
+
+        conditional = self.kommo.conditional_stats()
+        yield ("kommo_conditional_not_modified_ratio", "gauge", "Fração dos GETs condicionais respondidos com 304",
+               [({}, conditional["not_modified_ratio"])])
+
+        limiter = self.kommo.rate_limiter.stats()
+        yield ("kommo_rate_limiter_waiting", "gauge", "Requisições aguardando token do rate limiter do Kommo",
+               [({"priority": "interactive"}, limiter["waiting_interactive"]), ({"priority": "background"}, limiter["waiting_background"])])
+
+        n8n = self.n8n.stats()
+        yield ("n8n_spool_depth", "gauge", "Payloads no spool aguardando reenvio ao n8n",
+               [({"url": url}, count) for url, count in n8n["spool"]["depth_by_url"].items()])
+        states = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+        yield ("n8n_circuit_state", "gauge", "Estado do circuito por URL do n8n (0 fechado, 1 meio-aberto, 2 aberto)",
+               [({"url": url}, states.get(breaker["state"], 0)) for url, breaker in n8n["breakers"].items()])
+
+        aggregator = self.webhook_processor.aggregator.stats()
+        yield ("n8n_aggregation_open_batches", "gauge", "Lotes de mensagens aguardando envio ao n8n", [({}, aggregator["open_batches"])])
+
+        lead_updates = self.kommo.lead_updates.stats()
+        yield ("kommo_lead_updates_pending", "gauge", "Leads aguardando o próximo PATCH /leads em lote", [({}, lead_updates["pending_leads"])])
+
+        vendedores = self.vendedores.stats()
+        yield ("vendedores_cache_age_seconds", "gauge", "Idade do snapshot de vendedores", [({}, vendedores["age_seconds"])])
+
+        custom_fields = self.custom_fields.stats()
+        yield ("custom_fields_schema_age_seconds", "gauge", "Idade do esquema de campos customizados", [({}, custom_fields["age_seconds"])])
+        yield ("custom_fields_schema_misses_total", "counter", "Campos não encontrados no esquema", [({}, custom_fields["misses"])])
+
+_container: Optional[ServiceContainer] = None
+
+def init_container(session: Optional[aiohttp.ClientSession] = None) -> ServiceContainer:
+    """Cria o container do processo (chamado no startup da aplicação)"""
+    global _container
+
+    _container = ServiceContainer(session=session)
+    _register(_container)
+    logger.info("Container de serviços inicializado")
+    return _container
+
+def get_container() -> ServiceContainer:
+    """Retorna o container do processo, criando-o sob demanda"""
+    global _container
+
+    if _container is None:
+        _container = ServiceContainer()
+        _register(_container)
+    return _container
+
+def _register(container: ServiceContainer):
+    REGISTRY.register_collector("services", container.collect_metrics)
+    add_reload_listener(container.apply_settings)
+
+def reset_container():
+    """Descarta o container atual (shutdown)"""
+    global _container
+
+    REGISTRY.unregister_collector("services")
+    if _container is not None:
+        remove_reload_listener(_container.apply_settings)
+    _container = None
+
+# ==========================================
+# DEPENDÊNCIAS FASTAPI
+# ==========================================
+
+def get_kommo_service() -> KommoService:
+    return get_container().kommo
+
+def get_n8n_service() -> N8nService:
+    return get_container().n8n
+
+def get_webhook_processor() -> WebhookProcessor:
+    return get_container().webhook_processor
+
+def get_webhook_queue() -> WebhookJobQueue:
+    return get_container().webhook_queue
+
+def get_dedup_index() -> DedupIndex:
+    return get_container().dedup
+
+def get_conversation_store() -> ConversationStore:
+    return get_container().conversations
@@ -0,0 +1,725 @@
+import os
+import math
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import Settings, get_settings
+from app.utils.logger import setup_logger
+from app.utils.workers import is_multi_worker, worker_count
+
+logger = setup_logger(__name__)
+
+def normalize_contact_id(contact_id: Any) -> Any:
+    """IDs chegam como int (API) ou str (webhook); o store usa int sempre que possível"""
+    try:
+        return int(contact_id)
+    except (TypeError, ValueError):
+        return contact_id
+
+def _expires_at(ttl: Optional[float]) -> float:
+    """Instante de expiração de uma escrita; sem ttl a conversa não expira"""
+    return time.time() + ttl if ttl else math.inf
+
+def _index_columns(state: Dict[str, Any]) -> Tuple[Any, Any]:
+    """conversation_id e lead_id indexados (lead_id normalizado como o contact_id, em todos os backends)"""
+    return state.get("conversation_id"), normalize_contact_id(state.get("lead_id"))
+
+class ConversationStore(ABC):
+    """
+    Estado das conversas proativas, status manual do bot e snapshots
+
+    Conversas são indexadas por contact_id e podem ser buscadas por
+    conversation_id e lead_id. Com `ttl`, cada conversa expira após `ttl`
+    segundos sem escrita; sem ttl (padrão), não expira. Todas as operações são assíncronas para que backends
+    persistentes não bloqueiem o event loop.
+    """
+
+    @abstractmethod
+    async def start(self): ...
+
+    @abstractmethod
+    async def stop(self): ...
+
+    @abstractmethod
+    async def get(self, contact_id: Any) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def put(self, contact_id: Any, state: Dict[str, Any]): ...
+
+    @abstractmethod
+    async def update(self, contact_id: Any, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Atualiza campos de uma conversa existente; retorna None se ela não existir"""
+
+    @abstractmethod
+    async def delete(self, contact_id: Any): ...
+
+    @abstractmethod
+    async def find_by_conversation_id(self, conversation_id: str) -> Optional[Tuple[Any, Dict[str, Any]]]: ...
+
+    @abstractmethod
+    async def find_by_lead_id(self, lead_id: Any) -> Optional[Tuple[Any, Dict[str, Any]]]: ...
+
+    @abstractmethod
+    async def contact_ids(self) -> List[Any]: ...
+
+    @abstractmethod
+    async def count(self) -> int: ...
+
+    # Status manual do bot (pausa por contato)
+
+    @abstractmethod
+    async def get_bot_status(self, contact_id: Any) -> Optional[Dict[str, Any]]: ...
+
+    @abstractmethod
+    async def set_bot_status(self, contact_id: Any, status: Dict[str, Any]): ...
+
+    @abstractmethod
+    async def clear_bot_status(self, contact_id: Any): ...
+
+    @abstractmethod
+    async def paused_contacts(self) -> List[Any]: ...
+
+    # Snapshots nomeados (ex.: lista de vendedores)
+
+    @abstractmethod
+    async def save_snapshot(self, name: str, data: Any): ...
+
+    @abstractmethod
+    async def load_snapshot(self, name: str) -> Optional[Tuple[Any, float]]:
+        """Retorna (dados, timestamp da gravação) ou None"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]: ...
+
+class InMemoryConversationStore(ConversationStore):
+    """Backend em memória (perde o estado no restart)"""
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, ttl: Optional[float]):
+        self.ttl = ttl
+
+        # contact_id -> (expires_at, state)
+        self._conversations: Dict[Any, Tuple[float, Dict[str, Any]]] = {}
+        # Índices secundários mantidos a cada escrita: conversation_id / lead_id -> contact_id
+        self._by_conversation_id: Dict[Any, Any] = {}
+        self._by_lead_id: Dict[Any, Any] = {}
+        self._bot_status: Dict[Any, Dict[str, Any]] = {}
+        self._snapshots: Dict[str, Tuple[Any, float]] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+        # Contadores expostos no /health
+        self.reads = 0
+        self.writes = 0
+        self.expired = 0
+
+    async def start(self):
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            self._purge_expired()
+
+    def _purge_expired(self):
+        now = time.time()
+        for contact_id in [k for k, (expires_at, _) in self._conversations.items() if expires_at <= now]:
+            self._expire(contact_id)
+
+    def _expire(self, contact_id: Any):
+        self._remove_conversation(contact_id)
+        self.expired += 1
+
+    # Índices secundários: atualizados junto com o dict principal, sem await no meio
+
+    def _index(self, contact_id: Any, state: Dict[str, Any]):
+        conversation_id, lead_id = _index_columns(state)
+        if conversation_id is not None:
+            self._by_conversation_id[conversation_id] = contact_id
+        if lead_id is not None:
+            self._by_lead_id[lead_id] = contact_id
+
+    def _unindex(self, contact_id: Any, state: Dict[str, Any]):
+        conversation_id, lead_id = _index_columns(state)
+        if self._by_conversation_id.get(conversation_id) == contact_id:
+            del self._by_conversation_id[conversation_id]
+        if self._by_lead_id.get(lead_id) == contact_id:
+            del self._by_lead_id[lead_id]
+
+    def _rebuild_indexes(self):
+        self._by_conversation_id.clear()
+        self._by_lead_id.clear()
+        for contact_id, (_, state) in self._conversations.items():
+            self._index(contact_id, state)
+
+    def _store_conversation(self, contact_id: Any, state: Dict[str, Any]):
+        previous = self._conversations.get(contact_id)
+        if previous is not None:
+            self._unindex(contact_id, previous[1])
+        self._conversations[contact_id] = (_expires_at(self.ttl), state)
+        self._index(contact_id, state)
+
+    def _remove_conversation(self, contact_id: Any):
+        previous = self._conversations.pop(contact_id, None)
+        if previous is not None:
+            self._unindex(contact_id, previous[1])
+
+    def _live(self, contact_id: Any) -> Optional[Dict[str, Any]]:
+        entry = self._conversations.get(contact_id)
+        if entry is None:
+            return None
+        expires_at, state = entry
+        if expires_at <= time.time():
+            self._expire(contact_id)
+            return None
+        return state
+
+    # Escritas passam por aqui: o backend SQLite acrescenta a persistência
+
+    def _write_conversation(self, contact_id: Any, state: Dict[str, Any]):
+        self.writes += 1
+        self._store_conversation(contact_id, state)
+
+    def _delete_conversation(self, contact_id: Any):
+        self.writes += 1
+        self._remove_conversation(contact_id)
+
+    def _write_bot_status(self, contact_id: Any, status: Optional[Dict[str, Any]]):
+        self.writes += 1
+        if status is None:
+            self._bot_status.pop(contact_id, None)
+        else:
+            self._bot_status[contact_id] = status
+
+    def _write_snapshot(self, name: str, data: Any, saved_at: float):
+        self.writes += 1
+        self._snapshots[name] = (data, saved_at)
+
+    async def get(self, contact_id: Any) -> Optional[Dict[str, Any]]:
+        self.reads += 1
+        state = self._live(normalize_contact_id(contact_id))
+        return dict(state) if state is not None else None
+
+    async def put(self, contact_id: Any, state: Dict[str, Any]):
+        self._write_conversation(normalize_contact_id(contact_id), dict(state))
+
+    async def update(self, contact_id: Any, **fields: Any) -> Optional[Dict[str, Any]]:
+        contact_id = normalize_contact_id(contact_id)
+        state = self._live(contact_id)
+        if state is None:
+            return None
+        state = {**state, **fields}
+        self._write_conversation(contact_id, state)
+        return dict(state)
+
+    async def delete(self, contact_id: Any):
+        self._delete_conversation(normalize_contact_id(contact_id))
+
+    async def find_by_conversation_id(self, conversation_id: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        return self._find(self._by_conversation_id, conversation_id)
+
+    async def find_by_lead_id(self, lead_id: Any) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        return self._find(self._by_lead_id, normalize_contact_id(lead_id))
+
+    def _find(self, index: Dict[Any, Any], value: Any) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """Busca O(1) pelo índice secundário"""
+        self.reads += 1
+        if value is None:
+            return None
+        contact_id = index.get(value)
+        if contact_id is None:
+            return None
+        state = self._live(contact_id)
+        return (contact_id, dict(state)) if state is not None else None
+
+    async def contact_ids(self) -> List[Any]:
+        self._purge_expired()
+        return list(self._conversations)
+
+    async def count(self) -> int:
+        self._purge_expired()
+        return len(self._conversations)
+
+    async def get_bot_status(self, contact_id: Any) -> Optional[Dict[str, Any]]:
+        self.reads += 1
+        status = self._bot_status.get(normalize_contact_id(contact_id))
+        return dict(status) if status is not None else None
+
+    async def set_bot_status(self, contact_id: Any, status: Dict[str, Any]):
+        self._write_bot_status(normalize_contact_id(contact_id), dict(status))
+
+    async def clear_bot_status(self, contact_id: Any):
+        self._write_bot_status(normalize_contact_id(contact_id), None)
+
+    async def paused_contacts(self) -> List[Any]:
+        return [k for k, status in self._bot_status.items() if status.get("status") == "paused"]
+
+    async def save_snapshot(self, name: str, data: Any):
+        self._write_snapshot(name, data, time.time())
+
+    async def load_snapshot(self, name: str) -> Optional[Tuple[Any, float]]:
+        self.reads += 1
+        return self._snapshots.get(name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "ttl_seconds": self.ttl,
+            "conversations": len(self._conversations),
+            "indexed_conversation_ids": len(self._by_conversation_id),
+            "indexed_lead_ids": len(self._by_lead_id),
+            "bot_status_entries": len(self._bot_status),
+            "snapshots": len(self._snapshots),
+            "reads": self.reads,
+            "writes": self.writes,
+            "expired": self.expired
+        }
+
+class _SqliteBackend:
+    """Acesso síncrono ao arquivo SQLite (executado em thread)"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                contact_id PRIMARY KEY,
+                conversation_id TEXT,
+                lead_id,
+                state TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_conversations_conversation_id ON conversations (conversation_id);
+            CREATE INDEX IF NOT EXISTS idx_conversations_lead_id ON conversations (lead_id);
+            CREATE INDEX IF NOT EXISTS idx_conversations_expires_at ON conversations (expires_at);
+            CREATE TABLE IF NOT EXISTS bot_status (
+                contact_id PRIMARY KEY,
+                status TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                name TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                saved_at REAL NOT NULL
+            );
+            """
+        )
+        # Arquivos antigos: lead_id numérico gravado como texto pelo backend sqlite
+        self._conn.execute(
+            "UPDATE conversations SET lead_id = CAST(lead_id AS INTEGER) "
+            "WHERE typeof(lead_id) = 'text' AND lead_id != '' AND lead_id NOT GLOB '*[^0-9]*'"
+        )
+
+    def load(self):
+        """Carrega o estado não expirado para o espelho em memória"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE expires_at <= ?", (now,))
+            conversations = self._conn.execute("SELECT contact_id, state, expires_at FROM conversations").fetchall()
+            bot_status = self._conn.execute("SELECT contact_id, status FROM bot_status").fetchall()
+            snapshots = self._conn.execute("SELECT name, data, saved_at FROM snapshots").fetchall()
+        return (
+            {contact_id: (expires_at, json.loads(state)) for contact_id, state, expires_at in conversations},
+            {contact_id: json.loads(status) for contact_id, status in bot_status},
+            {name: (json.loads(data), saved_at) for name, data, saved_at in snapshots}
+        )
+
+    def apply(self, ops: List[Tuple]):
+        """Aplica um lote de escritas em uma única transação"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for op in ops:
+                    self._conn.execute(*op)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def purge(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM conversations WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class SqliteConversationStore(InMemoryConversationStore):
+    """
+    Backend SQLite (WAL) com espelho em memória e write-behind
+
+    Leituras são servidas do espelho; escritas atualizam o espelho e entram
+    em um lote gravado em background a cada `flush_interval` segundos (ou
+    ao atingir `batch_size`), em uma única transação. Só a última escrita
+    de cada chave no lote é gravada. Um crash perde no máximo o último lote.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float], flush_interval: float = 0.2, batch_size: int = 500):
+        super().__init__(ttl=ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._db: Optional[_SqliteBackend] = None
+        self._pending: Dict[Tuple[str, Any], Tuple] = {}
+        self._flush_wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+        # Contadores expostos no /health
+        self.flushes = 0
+        self.flushed_writes = 0
+        self.flush_errors = 0
+
+    async def start(self):
+        self._db = await asyncio.to_thread(_SqliteBackend, self.path)
+        self._conversations, self._bot_status, self._snapshots = await asyncio.to_thread(self._db.load)
+        self._rebuild_indexes()
+        logger.info(f"Estado de conversas carregado de {self.path}: {len(self._conversations)} conversas")
+
+        self._flush_wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        await super().start()
+
+    async def stop(self):
+        await super().stop()
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+
+        if self._db:
+            await self._flush()
+            await asyncio.to_thread(self._db.close)
+            self._db = None
+
+    def _schedule(self, key: Tuple[str, Any], op: Tuple):
+        self._pending[key] = op
+        if self._flush_wakeup is not None and len(self._pending) >= self.batch_size:
+            self._flush_wakeup.set()
+
+    def _write_conversation(self, contact_id: Any, state: Dict[str, Any]):
+        super()._write_conversation(contact_id, state)
+        expires_at = self._conversations[contact_id][0]
+        self._schedule(("conversation", contact_id), (
+            "INSERT OR REPLACE INTO conversations (contact_id, conversation_id, lead_id, state, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (contact_id, *_index_columns(state), json.dumps(state, default=str), expires_at)
+        ))
+
+    def _delete_conversation(self, contact_id: Any):
+        super()._delete_conversation(contact_id)
+        self._schedule(("conversation", contact_id), ("DELETE FROM conversations WHERE contact_id = ?", (contact_id,)))
+
+    def _write_bot_status(self, contact_id: Any, status: Optional[Dict[str, Any]]):
+        super()._write_bot_status(contact_id, status)
+        if status is None:
+            op = ("DELETE FROM bot_status WHERE contact_id = ?", (contact_id,))
+        else:
+            op = ("INSERT OR REPLACE INTO bot_status (contact_id, status) VALUES (?, ?)", (contact_id, json.dumps(status, default=str)))
+        self._schedule(("bot_status", contact_id), op)
+
+    def _write_snapshot(self, name: str, data: Any, saved_at: float):
+        super()._write_snapshot(name, data, saved_at)
+        self._schedule(("snapshot", name), (
+            "INSERT OR REPLACE INTO snapshots (name, data, saved_at) VALUES (?, ?, ?)",
+            (name, json.dumps(data, default=str), saved_at)
+        ))
+
+    def _purge_expired(self):
+        super()._purge_expired()
+        # Linhas expiradas no disco são removidas no próximo start (ou no sweep)
+        if self._db is not None:
+            self._schedule(("purge", None), ("DELETE FROM conversations WHERE expires_at <= ?", (time.time(),)))
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wakeup.clear()
+            await self._flush()
+
+    async def _flush(self):
+        if not self._pending or self._db is None:
+            return
+        batch = self._pending
+        self._pending = {}
+        try:
+            await asyncio.to_thread(self._db.apply, list(batch.values()))
+            self.flushes += 1
+            self.flushed_writes += len(batch)
+        except Exception as e:
+            self.flush_errors += 1
+            logger.error(f"Erro ao gravar estado de conversas ({len(batch)} escritas): {e}")
+            # Devolve o lote sem sobrescrever escritas mais novas das mesmas chaves
+            for key, op in batch.items():
+                self._pending.setdefault(key, op)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "backend": "sqlite",
+            "path": self.path,
+            "pending_writes": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_writes": self.flushed_writes,
+            "flush_errors": self.flush_errors
+        })
+        return stats
+
+class _SharedSqliteBackend(_SqliteBackend):
+    """Consultas diretas ao SQLite, sem espelho (vários processos no mesmo arquivo)"""
+
+    def get(self, contact_id: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM conversations WHERE contact_id = ? AND expires_at > ?",
+                (contact_id, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, contact_id: Any, state: Dict[str, Any], ttl: Optional[float]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversations (contact_id, conversation_id, lead_id, state, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (contact_id, *_index_columns(state), json.dumps(state, default=str), _expires_at(ttl))
+            )
+
+    def update(self, contact_id: Any, fields: Dict[str, Any], ttl: Optional[float]) -> Optional[Dict[str, Any]]:
+        """Leitura e escrita na mesma transação: outro processo não intercala"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT state FROM conversations WHERE contact_id = ? AND expires_at > ?",
+                    (contact_id, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                state = {**json.loads(row[0]), **fields}
+                self._conn.execute(
+                    "UPDATE conversations SET conversation_id = ?, lead_id = ?, state = ?, expires_at = ? WHERE contact_id = ?",
+                    (*_index_columns(state), json.dumps(state, default=str), _expires_at(ttl), contact_id)
+                )
+                self._conn.execute("COMMIT")
+                return state
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, contact_id: Any):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE contact_id = ?", (contact_id,))
+
+    def find_by(self, column: str, value: Any) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        # column vem de constantes internas (conversation_id / lead_id), nunca da requisição
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT contact_id, state FROM conversations WHERE {column} = ? AND expires_at > ? LIMIT 1",
+                (value, time.time())
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def contact_ids(self) -> List[Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT contact_id FROM conversations WHERE expires_at > ?", (time.time(),)).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+    def get_bot_status(self, contact_id: Any) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT status FROM bot_status WHERE contact_id = ?", (contact_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_bot_status(self, contact_id: Any, status: Optional[Dict[str, Any]]):
+        with self._lock:
+            if status is None:
+                self._conn.execute("DELETE FROM bot_status WHERE contact_id = ?", (contact_id,))
+            else:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO bot_status (contact_id, status) VALUES (?, ?)",
+                    (contact_id, json.dumps(status, default=str))
+                )
+
+    def bot_statuses(self) -> Dict[Any, Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT contact_id, status FROM bot_status").fetchall()
+        return {contact_id: json.loads(status) for contact_id, status in rows}
+
+    def save_snapshot(self, name: str, data: Any, saved_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO snapshots (name, data, saved_at) VALUES (?, ?, ?)",
+                (name, json.dumps(data, default=str), saved_at)
+            )
+
+    def load_snapshot(self, name: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data, saved_at FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+class SharedSqliteConversationStore(ConversationStore):
+    """
+    Backend SQLite compartilhado entre processos (modo multi-worker)
+
+    Sem espelho em memória nem write-behind: toda leitura e escrita vai ao
+    arquivo (WAL permite leitores concorrentes), então pausas do bot e
+    contexto proativo gravados por um worker são vistos pelos demais na
+    requisição seguinte. Os índices secundários são os índices SQL.
+    """
+
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, path: str, ttl: Optional[float]):
+        self.path = path
+        self.ttl = ttl
+        self._db: Optional[_SharedSqliteBackend] = None
+        self._sweeper: Optional[asyncio.Task] = None
+
+        # Contadores expostos no /health
+        self.reads = 0
+        self.writes = 0
+
+    async def start(self):
+        self._db = await asyncio.to_thread(_SharedSqliteBackend, self.path)
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        if self._db:
+            await asyncio.to_thread(self._db.close)
+            self._db = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            try:
+                await asyncio.to_thread(self._db.purge)
+            except Exception as e:
+                logger.error(f"Erro ao remover conversas expiradas: {e}")
+
+    async def _read(self, fn, *args):
+        self.reads += 1
+        return await asyncio.to_thread(fn, *args)
+
+    async def _write(self, fn, *args):
+        self.writes += 1
+        return await asyncio.to_thread(fn, *args)
+
+    async def get(self, contact_id: Any) -> Optional[Dict[str, Any]]:
+        return await self._read(self._db.get, normalize_contact_id(contact_id))
+
+    async def put(self, contact_id: Any, state: Dict[str, Any]):
+        await self._write(self._db.put, normalize_contact_id(contact_id), dict(state), self.ttl)
+
+    async def update(self, contact_id: Any, **fields: Any) -> Optional[Dict[str, Any]]:
+        return await self._write(self._db.update, normalize_contact_id(contact_id), fields, self.ttl)
+
+    async def delete(self, contact_id: Any):
+        await self._write(self._db.delete, normalize_contact_id(contact_id))
+
+    async def find_by_conversation_id(self, conversation_id: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        if conversation_id is None:
+            return None
+        return await self._read(self._db.find_by, "conversation_id", conversation_id)
+
+    async def find_by_lead_id(self, lead_id: Any) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        if lead_id is None:
+            return None
+        return await self._read(self._db.find_by, "lead_id", normalize_contact_id(lead_id))
+
+    async def contact_ids(self) -> List[Any]:
+        return await self._read(self._db.contact_ids)
+
+    async def count(self) -> int:
+        return await self._read(self._db.count)
+
+    async def get_bot_status(self, contact_id: Any) -> Optional[Dict[str, Any]]:
+        return await self._read(self._db.get_bot_status, normalize_contact_id(contact_id))
+
+    async def set_bot_status(self, contact_id: Any, status: Dict[str, Any]):
+        await self._write(self._db.set_bot_status, normalize_contact_id(contact_id), dict(status))
+
+    async def clear_bot_status(self, contact_id: Any):
+        await self._write(self._db.set_bot_status, normalize_contact_id(contact_id), None)
+
+    async def paused_contacts(self) -> List[Any]:
+        statuses = await self._read(self._db.bot_statuses)
+        return [k for k, status in statuses.items() if status.get("status") == "paused"]
+
+    async def save_snapshot(self, name: str, data: Any):
+        await self._write(self._db.save_snapshot, name, data, time.time())
+
+    async def load_snapshot(self, name: str) -> Optional[Tuple[Any, float]]:
+        return await self._read(self._db.load_snapshot, name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "shared",
+            "path": self.path,
+            "ttl_seconds": self.ttl,
+            "reads": self.reads,
+            "writes": self.writes
+        }
+
+def create_conversation_store(settings: Optional[Settings] = None) -> ConversationStore:
+    """
+    Cria o store configurado por CONVERSATION_STORE_BACKEND (memory, sqlite ou shared)
+
+    Com mais de um worker (WEB_CONCURRENCY > 1) o backend é sempre o
+    shared: estado por processo quebraria pausa/retomada e contexto proativo.
+    """
+    config = (settings or get_settings()).store
+    backend = config.backend
+    ttl = config.ttl
+    path = config.path
+
+    if is_multi_worker() and backend != "shared":
+        logger.warning(f"WEB_CONCURRENCY={worker_count()}: usando backend 'shared' em vez de '{backend}'")
+        backend = "shared"
+
+    if backend == "shared":
+        return SharedSqliteConversationStore(path=path, ttl=ttl)
+
+    if backend == "memory":
+        return InMemoryConversationStore(ttl=ttl)
+
+    return SqliteConversationStore(
+        path=path,
+        ttl=ttl,
+        flush_interval=config.flush_interval
+    )
@@ -0,0 +1,201 @@
+import time
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from app.config import Settings, get_settings
+from app.services.kommo_service import KommoService
+from app.services.conversation_store import ConversationStore
+from app.utils.singleflight import SingleFlight
+from app.utils.custom_fields import field_key
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Entidades do Kommo com campos customizados usados pela integração
+ENTITIES = ("leads", "contacts")
+
+# Tipos cujo valor é escolhido de uma lista (enviado como enum_id)
+ENUM_TYPES = ("select", "radiobutton", "multiselect")
+
+TRUE_VALUES = ("true", "1", "sim", "yes", "on")
+
+class CustomFieldSchema:
+    """
+    Esquema dos campos customizados do Kommo (leads e contatos)
+
+    Resolve código ou nome do campo para field_id e tipo, para que cada
+    escrita vá ao Kommo já no formato certo (uma única chamada). Carregado
+    no startup, atualizado em background a cada `ttl` segundos e persistido
+    no ConversationStore; se o Kommo falhar, o último esquema continua valendo.
+    """
+
+    SNAPSHOT_NAME = "custom_fields"
+
+    def __init__(
+        self,
+        kommo: KommoService,
+        store: ConversationStore,
+        ttl: Optional[float] = None,
+        retry_interval: float = 60.0,
+        settings: Optional[Settings] = None
+    ):
+        config = (settings or get_settings()).kommo
+        self.kommo = kommo
+        self.store = store
+        self.ttl = ttl or config.custom_fields_ttl
+        self.retry_interval = retry_interval
+
+        # entidade -> lista de campos (como no snapshot) e índice por chave normalizada
+        self._fields: Dict[str, List[Dict[str, Any]]] = {}
+        self._index: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._updated_at: Optional[float] = None
+        self._singleflight = SingleFlight()
+        self._refresher: Optional[asyncio.Task] = None
+
+        # Métricas expostas no /health
+        self.refreshes = 0
+        self.failures = 0
+        self.misses = 0
+        self.last_error: Optional[str] = None
+
+    async def start(self):
+        """Carrega o último esquema persistido e inicia o refresher"""
+        if await self.load():
+            logger.info(f"Esquema de campos customizados carregado ({self._count()} campos, {self.age():.0f}s)")
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def load(self) -> bool:
+        """Carrega o esquema persistido no store (False se ainda não houver)"""
+        snapshot = await self.store.load_snapshot(self.SNAPSHOT_NAME)
+        if not snapshot:
+            return False
+        self._apply(*snapshot)
+        return True
+
+    async def stop(self):
+        if self._refresher:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    def age(self) -> Optional[float]:
+        """Idade do esquema em segundos (None se ainda não houver)"""
+        return time.time() - self._updated_at if self._updated_at is not None else None
+
+    @property
+    def updated_at(self) -> Optional[datetime]:
+        return datetime.fromtimestamp(self._updated_at) if self._updated_at is not None else None
+
+    def fields(self, entity: str) -> List[Dict[str, Any]]:
+        return self._fields.get(entity, [])
+
+    def resolve(self, entity: str, key: Any) -> Optional[Dict[str, Any]]:
+        """Campo pelo id, código ou nome (sem distinguir maiúsculas/acentos)"""
+        field = self._index.get(entity, {}).get(field_key(key))
+        if field is None:
+            self.misses += 1
+        return field
+
+    def field_id(self, entity: str, key: Any) -> Optional[int]:
+        field = self.resolve(entity, key)
+        return field["id"] if field else None
+
+    def field_value(self, entity: str, key: Any, value: Any) -> Optional[Dict[str, Any]]:
+        """
+        Item de custom_fields_values pronto para escrita (None se o campo não existir)
+
+        Checkbox recebe bool e listas de opções recebem o enum_id da opção
+        com o mesmo texto.
+        """
+        field = self.resolve(entity, key)
+        if field is None:
+            return None
+
+        if field["type"] == "checkbox":
+            item = {"value": value if isinstance(value, bool) else str(value).lower() in TRUE_VALUES}
+        elif field["type"] in ENUM_TYPES and field_key(value) in field["enums"]:
+            item = {"enum_id": field["enums"][field_key(value)]}
+        else:
+            item = {"value": value}
+        return {"field_id": field["id"], "values": [item]}
+
+    async def refresh(self) -> bool:
+        """Atualiza o esquema (chamadas simultâneas compartilham a mesma busca)"""
+        return await self._singleflight.do("refresh", self._refresh)
+
+    async def _refresh(self) -> bool:
+        results = await asyncio.gather(*(self.kommo.get_custom_fields(entity) for entity in ENTITIES))
+        if any(fields is None for fields in results):
+            self.failures += 1
+            self.last_error = "Falha ao buscar campos customizados no Kommo"
+            logger.warning(f"Atualização do esquema de campos falhou - mantendo esquema anterior ({self._count()} campos)")
+            return False
+
+        snapshot = {entity: [self._compact(field) for field in fields] for entity, fields in zip(ENTITIES, results)}
+        updated_at = time.time()
+        self._apply(snapshot, updated_at)
+        self.refreshes += 1
+        self.last_error = None
+        await self.store.save_snapshot(self.SNAPSHOT_NAME, snapshot)
+
+        logger.info(f"Esquema de campos customizados atualizado ({self._count()} campos)")
+        return True
+
+    @staticmethod
+    def _compact(field: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "id": field.get("id"),
+            "name": field.get("name"),
+            "code": field.get("code"),
+            "type": field.get("type"),
+            "enums": {field_key(enum.get("value")): enum.get("id") for enum in field.get("enums") or []}
+        }
+
+    def _apply(self, snapshot: Dict[str, List[Dict[str, Any]]], updated_at: float):
+        index: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for entity, fields in snapshot.items():
+            by_key: Dict[str, Dict[str, Any]] = {}
+            # Código prevalece sobre nome (e id sobre ambos) quando dois campos colidem
+            for attr in ("name", "code", "id"):
+                for field in fields:
+                    if field.get(attr):
+                        by_key[field_key(field[attr])] = field
+            index[entity] = by_key
+        self._fields = snapshot
+        self._index = index
+        self._updated_at = updated_at
+
+    def _count(self) -> int:
+        return sum(len(fields) for fields in self._fields.values())
+
+    async def _refresh_loop(self):
+        while True:
+            age = self.age()
+            if age is None or age >= self.ttl:
+                try:
+                    ok = await self.refresh()
+                except Exception as e:
+                    ok = False
+                    self.failures += 1
+                    self.last_error = str(e)
+                    logger.error(f"Erro ao atualizar esquema de campos: {e}")
+                await asyncio.sleep(self.ttl if ok else self.retry_interval)
+            else:
+                await asyncio.sleep(self.ttl - age)
+
+    def stats(self) -> Dict[str, Any]:
+        """Campos conhecidos por entidade e idade do esquema"""
+        age = self.age()
+        return {
+            "fields": {entity: len(fields) for entity, fields in self._fields.items()},
+            "age_seconds": round(age, 3) if age is not None else None,
+            "ttl_seconds": self.ttl,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "misses": self.misses,
+            "last_error": self.last_error
+        }
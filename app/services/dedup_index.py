@@ -0,0 +1,167 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+from app.config import Settings, get_settings
+from app.utils.cache import TTLCache
+from app.utils.logger import setup_logger
+from app.utils.workers import is_multi_worker
+
+logger = setup_logger(__name__)
+
+class DedupStore:
+    """Registro em SQLite das chaves já vistas (sobrevive a restarts)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_dedup (
+                key TEXT PRIMARY KEY,
+                seen_at REAL NOT NULL
+            )
+            """
+        )
+
+    def mark(self, key: str, ttl: float) -> bool:
+        """Registra a chave; retorna False se ela já existia e ainda não expirou"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO webhook_dedup (key, seen_at) VALUES (?, ?)",
+                (key, now)
+            )
+            if cursor.rowcount:
+                return True
+            # Chave antiga (expirada) conta como nova
+            cursor = self._conn.execute(
+                "UPDATE webhook_dedup SET seen_at = ? WHERE key = ? AND seen_at < ?",
+                (now, key, now - ttl)
+            )
+            return cursor.rowcount > 0
+
+    def forget(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_dedup WHERE key = ?", (key,))
+
+    def purge(self, ttl: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM webhook_dedup WHERE seen_at < ?", (time.time() - ttl,))
+            return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class DedupIndex:
+    """
+    Índice de idempotência dos webhooks do Kommo
+
+    O Kommo reenvia o webhook quando nosso 200 demora; a mesma mensagem
+    (id da mensagem + conversation_id) só deve ser processada uma vez.
+    As chaves ficam em um LRU com TTL e, opcionalmente, em SQLite para
+    sobreviver a restarts.
+    """
+
+    PURGE_EVERY = 1000
+
+    def __init__(
+        self,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+        path: Optional[str] = None,
+        settings: Optional[Settings] = None
+    ):
+        config = (settings or get_settings()).webhooks
+        self.ttl = ttl or config.dedup_ttl
+        self._seen = TTLCache(
+            maxsize=maxsize or config.dedup_size,
+            ttl=self.ttl,
+            name="webhook_dedup"
+        )
+        self.path = path if path is not None else config.dedup_path
+        self._store: Optional[DedupStore] = None
+        self._marks_since_purge = 0
+
+        # Contadores expostos no /health
+        self.checked = 0
+        self.duplicates = 0
+
+    async def start(self):
+        """Abre o registro em disco (se configurado) e remove chaves expiradas"""
+        if not self.path:
+            if is_multi_worker():
+                logger.warning("WEBHOOK_DEDUP_PATH vazio com vários workers: reentregas podem ser processadas em outro worker")
+            return
+        self._store = await asyncio.to_thread(DedupStore, self.path)
+        purged = await asyncio.to_thread(self._store.purge, self.ttl)
+        if purged:
+            logger.info(f"Índice de deduplicação: {purged} chaves expiradas removidas")
+
+    async def stop(self):
+        if self._store:
+            await asyncio.to_thread(self._store.close)
+            self._store = None
+
+    async def check_and_mark(self, key: str) -> bool:
+        """Retorna True se a chave é nova (e a registra); False se é reentrega"""
+        self.checked += 1
+
+        if self._seen.get(key) is not None:
+            self.duplicates += 1
+            return False
+
+        # Registra em memória antes do await: entregas concorrentes da mesma chave param aqui
+        self._seen.set(key, True)
+
+        if self._store is not None:
+            try:
+                is_new = await asyncio.to_thread(self._store.mark, key, self.ttl)
+            except Exception as e:
+                logger.error(f"Erro ao registrar chave de deduplicação {key}: {e}")
+                return True
+            if not is_new:
+                self.duplicates += 1
+                return False
+            await self._maybe_purge()
+
+        return True
+
+    async def forget(self, key: str):
+        """Remove a chave (processamento não aceito - a reentrega deve passar)"""
+        self._seen.pop(key)
+        if self._store is not None:
+            try:
+                await asyncio.to_thread(self._store.forget, key)
+            except Exception as e:
+                logger.error(f"Erro ao remover chave de deduplicação {key}: {e}")
+
+    async def _maybe_purge(self):
+        self._marks_since_purge += 1
+        if self._marks_since_purge < self.PURGE_EVERY:
+            return
+        self._marks_since_purge = 0
+        try:
+            await asyncio.to_thread(self._store.purge, self.ttl)
+        except Exception as e:
+            logger.error(f"Erro ao limpar índice de deduplicação: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do índice"""
+        return {
+            "persistent": self._store is not None,
+            "ttl_seconds": self.ttl,
+            "checked": self.checked,
+            "duplicates": self.duplicates,
+            "memory": self._seen.stats()
+        }
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+from app.config import Settings, get_settings
+from app.services.keyed_dispatcher import KeyedDispatcher
+from app.utils.logger import setup_logger, set_correlation_id
+from app.utils.workers import worker_id, is_multi_worker
+from app.utils.metrics import histogram
+
+logger = setup_logger(__name__)
+
+WEBHOOK_E2E_SECONDS = histogram(
+    "webhook_processing_seconds",
+    "Tempo do webhook entre o aceite e o fim do processamento",
+    ("outcome",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+class QueueSaturatedError(Exception):
+    """Fila de webhooks cheia - o chamador deve tentar novamente mais tarde"""
+
+class WebhookJournal:
+    """
+    Journal append-only em SQLite: jobs entram ao serem aceitos e saem ao terminar
+
+    Cada job tem um dono (worker) e um lease renovado periodicamente. Com
+    vários workers no mesmo arquivo, só jobs sem dono ou com lease vencido
+    (worker morto) são reassumidos.
+    """
+
+    def __init__(self, path: str, owner: str, lease: float):
+        self.path = path
+        self.owner = owner
+        self.lease = lease
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        # Journals criados antes do modo multi-worker não têm as colunas de lease
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(webhook_jobs)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE webhook_jobs ADD COLUMN owner TEXT")
+        if "lease_until" not in columns:
+            self._conn.execute("ALTER TABLE webhook_jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+    def append(self, payload: Dict[str, Any]) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO webhook_jobs (payload, created_at, owner, lease_until) VALUES (?, ?, ?, ?)",
+                (json.dumps(payload, default=str), now, self.owner, now + self.lease)
+            )
+            return cursor.lastrowid
+
+    def remove(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_jobs WHERE id = ?", (job_id,))
+
+    def claim_orphans(self, ignore_lease: bool = False) -> List[Tuple[int, Dict[str, Any]]]:
+        """Assume jobs de outros donos com lease vencido; retorna os assumidos em ordem"""
+        now = time.time()
+        # Processo único: qualquer outro dono é de uma execução anterior, não precisa esperar o lease
+        lease_limit = float("inf") if ignore_lease else now
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, payload FROM webhook_jobs WHERE (owner IS NULL OR owner != ?) AND lease_until < ? ORDER BY id",
+                    (self.owner, lease_limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE webhook_jobs SET owner = ?, lease_until = ? WHERE id = ?",
+                    [(self.owner, now + self.lease, job_id) for job_id, _ in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(job_id, json.loads(payload)) for job_id, payload in rows]
+
+    def renew(self):
+        """Renova o lease de todos os jobs deste worker"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE webhook_jobs SET lease_until = ? WHERE owner = ?",
+                (time.time() + self.lease, self.owner)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class WebhookJobQueue:
+    """
+    Fila interna limitada para webhooks do Kommo
+
+    O webhook é persistido no journal e entregue ao KeyedDispatcher (ack
+    imediato). Webhooks do mesmo contato/conversa são processados em ordem;
+    conversas diferentes rodam em paralelo até `workers`. Quando a fila
+    enche, enqueue levanta QueueSaturatedError para o endpoint responder
+    503. Jobs não concluídos são reprocessados no próximo startup ou, com
+    vários workers, por outro worker quando o lease do dono vence.
+
+    Se o handler retornar um awaitable (mensagem guardada em um lote do
+    agregador), o job continua no journal, com lease renovado, até ele
+    terminar: uma queda durante a janela de agregação não perde a mensagem.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Any]],
+        key_fn: Optional[Callable[[Dict[str, Any]], Optional[Hashable]]] = None,
+        workers: Optional[int] = None,
+        maxsize: Optional[int] = None,
+        journal_path: Optional[str] = None,
+        settings: Optional[Settings] = None
+    ):
+        config = (settings or get_settings()).webhooks
+        self.handler = handler
+        self.key_fn = key_fn
+        self.workers = workers or config.workers
+        self.maxsize = maxsize or config.queue_maxsize
+        self.journal_path = journal_path or config.journal_path
+        self.lease = config.job_lease
+
+        self._dispatcher: Optional[KeyedDispatcher] = None
+        self._journal: Optional[WebhookJournal] = None
+        self._lease_keeper: Optional[asyncio.Task] = None
+        # Jobs já processados aguardando a entrega do lote agregado
+        self._deliveries: Set[asyncio.Task] = set()
+        # Instante de aceite por job (tempo ponta a ponta no /metrics)
+        self._accepted_at: Dict[int, float] = {}
+
+        # Contadores expostos no /health
+        self.accepted = 0
+        self.rejected = 0
+        self.replayed = 0
+
+    async def start(self):
+        """Abre o journal, inicia o despachante e reenfileira jobs pendentes"""
+        self._journal = await asyncio.to_thread(WebhookJournal, self.journal_path, worker_id(), self.lease)
+        self._dispatcher = KeyedDispatcher(self._process_job, concurrency=self.workers, maxsize=self.maxsize)
+
+        await self._replay_orphans()
+        self._lease_keeper = asyncio.create_task(self._lease_loop())
+
+        logger.info(f"Fila de webhooks iniciada ({self.workers} workers, limite {self.maxsize})")
+
+    async def _replay_orphans(self):
+        orphans = await asyncio.to_thread(self._journal.claim_orphans, not is_multi_worker())
+        if orphans:
+            logger.info(f"Reprocessando {len(orphans)} webhooks pendentes do journal")
+            # Ordem do journal preservada: cada chave recebe seus jobs na ordem original
+            for job_id, payload in orphans:
+                self._dispatcher.submit(self._job_key(job_id, payload), (job_id, payload))
+                self.replayed += 1
+
+    async def _lease_loop(self):
+        """Renova os leases deste worker e assume jobs de workers que morreram"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(self._journal.renew)
+                await self._replay_orphans()
+            except Exception as e:
+                logger.error(f"Erro ao renovar leases do journal: {e}")
+
+    async def stop(self, drain: Optional[Callable[[], Awaitable[Any]]] = None):
+        """
+        Para o processamento; jobs não concluídos permanecem no journal
+
+        `drain` roda depois que o despachante para e antes de fechar o
+        journal (ex.: enviar os lotes agregados abertos), para que os jobs
+        entregues nesse meio tempo saiam do journal. Entregas que ainda
+        estiverem pendentes depois dele são canceladas e reprocessadas no
+        próximo startup.
+        """
+        if self._lease_keeper:
+            self._lease_keeper.cancel()
+            try:
+                await self._lease_keeper
+            except asyncio.CancelledError:
+                pass
+            self._lease_keeper = None
+
+        if self._dispatcher:
+            await self._dispatcher.stop()
+        if drain is not None:
+            await drain()
+        if self._deliveries:
+            deliveries = list(self._deliveries)
+            for task in deliveries:
+                if drain is None:
+                    task.cancel()
+            await asyncio.gather(*deliveries, return_exceptions=True)
+        self._accepted_at.clear()
+
+        if self._journal:
+            await asyncio.to_thread(self._journal.close)
+            self._journal = None
+        logger.info("Fila de webhooks encerrada")
+
+    async def enqueue(self, payload: Dict[str, Any]) -> int:
+        """Persiste e enfileira um webhook; levanta QueueSaturatedError se a fila estiver cheia"""
+        if self._dispatcher is None or self._journal is None:
+            raise RuntimeError("Fila de webhooks não iniciada")
+
+        if self._dispatcher.is_full():
+            self.rejected += 1
+            raise QueueSaturatedError(f"Fila de webhooks cheia ({self.maxsize})")
+
+        accepted_at = time.perf_counter()
+        job_id = await asyncio.to_thread(self._journal.append, payload)
+        self._accepted_at[job_id] = accepted_at
+        self._dispatcher.submit(self._job_key(job_id, payload), (job_id, payload))
+        self.accepted += 1
+        return job_id
+
+    def _job_key(self, job_id: int, payload: Dict[str, Any]) -> Hashable:
+        """Chave de ordenação do job; sem chave, o job roda independente dos demais"""
+        key = self.key_fn(payload) if self.key_fn else None
+        return key if key is not None else ("job", job_id)
+
+    async def _process_job(self, job: Tuple[int, Dict[str, Any]]):
+        job_id, payload = job
+        # Logs do processamento (e do lote agregado que ele abrir) levam o id do job
+        set_correlation_id(f"job-{job_id}")
+        try:
+            delivery = await self.handler(payload)
+        except asyncio.CancelledError:
+            # Shutdown no meio do job: ele permanece no journal para o próximo startup
+            raise
+        except Exception:
+            self._observe(job_id, "failed")
+            await self._forget(job_id)
+            raise
+
+        if delivery is not None:
+            # O despachante segue para o próximo job da chave (que pode entrar no mesmo lote)
+            task = asyncio.ensure_future(self._settle(job_id, delivery))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+            return
+        self._observe(job_id, "processed")
+        await self._forget(job_id)
+
+    async def _settle(self, job_id: int, delivery: Awaitable[Any]):
+        """Remove o job do journal quando o lote agregado for entregue ao n8n (ou ao spool)"""
+        try:
+            # shield: cancelar a espera (shutdown) não cancela o lote, compartilhado com outros jobs
+            await asyncio.shield(delivery)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._observe(job_id, "failed")
+        else:
+            self._observe(job_id, "processed")
+        await self._forget(job_id)
+
+    def _observe(self, job_id: int, outcome: str):
+        # Jobs reprocessados do journal não têm instante de aceite neste processo
+        accepted_at = self._accepted_at.pop(job_id, None)
+        if accepted_at is not None:
+            WEBHOOK_E2E_SECONDS.observe(time.perf_counter() - accepted_at, outcome=outcome)
+
+    async def _forget(self, job_id: int):
+        try:
+            await asyncio.to_thread(self._journal.remove, job_id)
+        except Exception as e:
+            logger.error(f"Erro ao remover job {job_id} do journal: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas da fila"""
+        dispatcher_stats = self._dispatcher.stats() if self._dispatcher else {}
+        return {
+            "depth": dispatcher_stats.get("pending", 0),
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "active_conversations": dispatcher_stats.get("active_keys", 0),
+            "in_progress": dispatcher_stats.get("in_progress", 0),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": dispatcher_stats.get("processed", 0),
+            "failed": dispatcher_stats.get("failed", 0),
+            "replayed": self.replayed,
+            "awaiting_delivery": len(self._deliveries)
+        }
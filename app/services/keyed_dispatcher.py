@@ -0,0 +1,92 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class KeyedDispatcher:
+    """
+    Despachante por chave (modelo de atores)
+
+    Cada chave (contato/conversa) tem sua própria caixa de mensagens,
+    processada em ordem por um único ator. Atores de chaves diferentes
+    rodam em paralelo, limitados por `concurrency`. O total de itens
+    pendentes é limitado por `maxsize`.
+    """
+
+    def __init__(self, handler: Callable[[Any], Awaitable[Any]], concurrency: int, maxsize: int):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.maxsize = maxsize
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._mailboxes: Dict[Hashable, Deque[Any]] = {}
+        self._actors: Dict[Hashable, asyncio.Task] = {}
+
+        # Contadores expostos no /health
+        self.pending = 0
+        self.in_progress = 0
+        self.processed = 0
+        self.failed = 0
+
+    def is_full(self) -> bool:
+        return self.pending >= self.maxsize
+
+    def submit(self, key: Hashable, item: Any):
+        """Adiciona item à caixa da chave, criando o ator se necessário (não bloqueia)"""
+        self.pending += 1
+
+        mailbox = self._mailboxes.get(key)
+        if mailbox is not None:
+            mailbox.append(item)
+            return
+
+        mailbox = deque([item])
+        self._mailboxes[key] = mailbox
+        self._actors[key] = asyncio.create_task(self._run(key, mailbox))
+
+    async def _run(self, key: Hashable, mailbox: Deque[Any]):
+        try:
+            while mailbox:
+                # Um item por vez no semáforo: atores com muitas mensagens não monopolizam os slots
+                async with self._semaphore:
+                    item = mailbox.popleft()
+                    self.in_progress += 1
+                    try:
+                        await self.handler(item)
+                        self.processed += 1
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self.failed += 1
+                        logger.error(f"Erro ao processar item da chave {key}: {e}")
+                    finally:
+                        self.in_progress -= 1
+                        self.pending -= 1
+        finally:
+            # Sem await entre a caixa vazia e a remoção: nenhum item novo se perde
+            if self._mailboxes.get(key) is mailbox:
+                del self._mailboxes[key]
+                del self._actors[key]
+
+    async def stop(self):
+        """Cancela todos os atores (itens pendentes são descartados da memória)"""
+        actors = list(self._actors.values())
+        for task in actors:
+            task.cancel()
+        await asyncio.gather(*actors, return_exceptions=True)
+        self._mailboxes.clear()
+        self._actors.clear()
+        self.pending = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do despachante"""
+        return {
+            "pending": self.pending,
+            "active_keys": len(self._actors),
+            "concurrency": self.concurrency,
+            "in_progress": self.in_progress,
+            "processed": self.processed,
+            "failed": self.failed
+        }
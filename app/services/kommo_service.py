@@ -1,29 +1,128 @@
-import os
+import random
 import aiohttp
 import asyncio
-from typing import Optional, Dict, Any
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlparse
+from typing import Optional, Dict, Any, List, Tuple
+from app.config import Settings, get_settings
 from app.utils.logger import setup_logger
-from dotenv import load_dotenv
+from app.utils.http_client import get_http_session
+from app.utils import fast_json
+from app.utils.cache import TTLCache
+from app.utils.singleflight import SingleFlight
+from app.utils.batch_loader import BatchLoader
+from app.utils.rate_limiter import TokenBucketLimiter, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from app.utils.workers import worker_count
+from app.utils.metrics import counter, gauge, histogram
+from app.utils.custom_fields import index_custom_fields, custom_field_index_stats
+from app.services.token_manager import TokenManager
+from app.services.lead_update_batcher import LeadUpdateBatcher
+from app.services.conversation_store import ConversationStore, InMemoryConversationStore
 from datetime import datetime
 
-load_dotenv()
 logger = setup_logger(__name__)
 
+# Limite de requisições da conta Kommo (~7 req/s), compartilhado por todas as instâncias
+_rate_limiter: Optional[TokenBucketLimiter] = None
+
+def get_kommo_rate_limiter() -> TokenBucketLimiter:
+    """Retorna o rate limiter do processo para a API do Kommo (limite da conta dividido entre os workers)"""
+    global _rate_limiter
+    
+    if _rate_limiter is None:
+        kommo = get_settings().kommo
+        workers = worker_count()
+        _rate_limiter = TokenBucketLimiter(
+            rate=kommo.rate_limit / workers,
+            burst=max(1.0, kommo.rate_burst / workers)
+        )
+    return _rate_limiter
+
+# Métricas por endpoint do Kommo (/metrics)
+KOMMO_REQUEST_SECONDS = histogram("kommo_request_duration_seconds", "Latência das requisições ao Kommo", ("endpoint", "method"))
+KOMMO_REQUESTS = counter("kommo_requests_total", "Respostas do Kommo por status", ("endpoint", "method", "status"))
+KOMMO_ERRORS = counter("kommo_request_errors_total", "Requisições ao Kommo sem resposta (timeout/conexão)", ("endpoint", "method", "error"))
+KOMMO_IN_FLIGHT = gauge("kommo_requests_in_flight", "Requisições ao Kommo em andamento", ("endpoint",))
+KOMMO_RESPONSE_BYTES = counter("kommo_response_bytes_total", "Bytes recebidos no corpo das respostas do Kommo", ("endpoint",))
+KOMMO_CONDITIONAL = counter("kommo_conditional_requests_total", "GETs condicionais (If-Modified-Since) por resultado", ("endpoint", "result"))
+KOMMO_BYTES_SAVED = counter("kommo_response_bytes_saved_total", "Bytes não transferidos graças a respostas 304", ("endpoint",))
+
+def _endpoint_label(endpoint: str) -> str:
+    """Recurso do Kommo usado como label (/leads/123 -> /leads), sem ids na cardinalidade"""
+    if "oauth2/access_token" in endpoint:
+        return "oauth2/access_token"
+    path = urlparse(endpoint).path if endpoint.startswith("http") else endpoint
+    if path.startswith("/api/v4"):
+        path = path[len("/api/v4"):]
+    return "/" + path.strip("/").split("/")[0]
+
+class KommoRequestError(Exception):
+    """Resposta inesperada do Kommo em uma chamada sem tratamento por status"""
+
 class KommoService:
-    def __init__(self):
-        self.client_id = os.getenv("KOMMO_CLIENT_ID")
-        self.client_secret = os.getenv("KOMMO_CLIENT_SECRET")
-        self.redirect_uri = os.getenv("KOMMO_REDIRECT_URI")
-        self.base_url = os.getenv("KOMMO_BASE_URL")
-        self.api_url = os.getenv("KOMMO_API_URL")
-        self.access_token = os.getenv("KOMMO_ACCESS_TOKEN")
-        self.account_id = os.getenv("KOMMO_ACCOUNT_ID")
-    
-        # Cache local para status do bot
-        self._bot_status_cache = {}
+    def __init__(
+        self,
+        session: Optional[aiohttp.ClientSession] = None,
+        rate_limiter: Optional[TokenBucketLimiter] = None,
+        store: Optional[ConversationStore] = None,
+        settings: Optional[Settings] = None
+    ):
+        settings = settings or get_settings()
+        config = settings.kommo
+        self.client_id = config.client_id
+        self.client_secret = config.client_secret
+        self.redirect_uri = config.redirect_uri
+        self.base_url = config.base_url
+        self.api_url = config.api_url
+        self.account_id = config.account_id
+        
+        # Sessão HTTP injetada (compartilhada pela aplicação)
+        self._session = session
+        
+        # Tokens OAuth em memória, renovados antes de vencer e após 401
+        self.tokens = TokenManager(request=self._request, settings=settings)
+        
+        # Rate limiter compartilhado e tentativas após 429
+        self.rate_limiter = rate_limiter or get_kommo_rate_limiter()
+        self.MAX_RATE_LIMIT_RETRIES = config.max_rate_limit_retries
         
-        # Cache para estados de conversa proativa
-        self._conversation_states = {}
+        # Esquema dos campos customizados (CustomFieldSchema, definido pelo container)
+        self.field_schema = None
+        
+        # Pausas do bot e estado das conversas proativas ficam no ConversationStore,
+        # compartilhado entre workers; sem store injetado (scripts), o estado é só deste processo
+        self.store = store or InMemoryConversationStore(ttl=settings.store.ttl)
+        
+        # Cache curto de respostas GET + coalescência de chamadas idênticas
+        self._response_cache = TTLCache(
+            maxsize=config.response_cache_size,
+            ttl=config.response_cache_ttl,
+            name="kommo_responses"
+        )
+        self._singleflight = SingleFlight()
+        
+        # Última versão conhecida de cada GET: (modificado em, corpo, bytes);
+        # permite GETs condicionais (If-Modified-Since) servidos do cache em 304
+        self._versions = TTLCache(
+            maxsize=config.conditional_cache_size,
+            ttl=config.conditional_cache_ttl,
+            name="kommo_conditional"
+        )
+        self.conditional_requests = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+        
+        # Leituras de contatos/leads de webhooks simultâneos agrupadas em GETs filtrados
+        self._contact_loader = BatchLoader(self._load_contacts, window=config.batch_window, max_batch=250)
+        self._lead_loader = BatchLoader(self._load_leads, window=config.batch_window, max_batch=250)
+        
+        # Escritas em leads agrupadas em PATCH /leads (até 250 por chamada)
+        self.lead_updates = LeadUpdateBatcher(
+            flush=self._patch_leads,
+            window=config.lead_batch_window,
+            max_batch=config.lead_batch_size
+        )
         
         # Timeout padrão para todas as requisições
         self.DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5)
@@ -31,128 +130,104 @@ class KommoService:
         if not self.access_token:
             logger.warning("KOMMO_ACCESS_TOKEN não configurado!")
     
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Sessão HTTP usada nas chamadas ao Kommo (pool compartilhado)"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+        return get_http_session()
+    
+    @property
+    def access_token(self) -> Optional[str]:
+        return self.tokens.access_token
+    
     async def get_headers(self) -> Dict[str, str]:
         """Retorna headers padrão para requisições"""
         return {
-            "Authorization": f"Bearer {self.access_token}",
+            "Authorization": f"Bearer {await self.tokens.get_token()}",
             "Content-Type": "application/json"
         }
     
     async def refresh_token_if_needed(self) -> bool:
-        """Renova o token se necessário"""
-        try:
-            refresh_token = os.getenv("KOMMO_REFRESH_TOKEN")
-            if not refresh_token:
-                logger.warning("KOMMO_REFRESH_TOKEN não configurado")
-                return False
-            
-            logger.info("Tentando renovar token do Kommo...")
-            
-            url = f"{self.base_url}/oauth2/access_token"
-            data = {
-                "client_id": self.client_id,
-                "client_secret": self.client_secret,
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-                "redirect_uri": self.redirect_uri
-            }
-            
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.post(url, json=data) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        new_access_token = result.get("access_token")
-                        new_refresh_token = result.get("refresh_token")
-                        
-                        if new_access_token:
-                            # Atualizar variáveis de ambiente
-                            os.environ["KOMMO_ACCESS_TOKEN"] = new_access_token
-                            if new_refresh_token:
-                                os.environ["KOMMO_REFRESH_TOKEN"] = new_refresh_token
-                            
-                            # Atualizar token local
-                            self.access_token = new_access_token
-                            
-                            logger.info("Token renovado com sucesso!")
-                            return True
-                        else:
-                            logger.error("Token não encontrado na resposta")
-                            return False
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Erro ao renovar token: {response.status} - {error_text}")
-                        return False
-                        
-        except Exception as e:
-            logger.error(f"Erro ao renovar token: {e}")
-            return False
+        """Renova o token (chamadas simultâneas compartilham a mesma renovação)"""
+        return await self.tokens.refresh()
     
-    async def is_bot_active(self, contact_id: int) -> bool:
-        """Verifica se o bot está ativo para o contato"""
+    async def is_bot_active(self, contact_id: int, contact: Optional[Dict[str, Any]] = None, fetch: bool = True) -> bool:
+        """
+        Verifica se o bot está ativo para o contato (fetch=False reaproveita o contato já buscado)
+
+        Pausa/retomada registrada no ConversationStore (comandos, /bot/control)
+        vale para todos os workers; sem registro, vale o campo bot_ativo do contato.
+        """
         try:
-            # Verifica cache primeiro
-            if contact_id in self._bot_status_cache:
-                logger.info(f"Status do bot para contato {contact_id} (cache): {self._bot_status_cache[contact_id]}")
-                return self._bot_status_cache[contact_id]
-            
-            # Busca contato na API
-            contact = await self.get_contact(contact_id)
+            stored_status = await self.store.get_bot_status(contact_id)
+            if stored_status is not None:
+                is_active = stored_status.get("status") != "paused"
+                logger.info(f"Status do bot para contato {contact_id} (store): {is_active}")
+                return is_active
+            
+            # Busca contato na API apenas se ainda não foi carregado
+            if contact is None and fetch:
+                contact = await self.get_contact(contact_id)
             if not contact:
                 logger.warning(f"Contato {contact_id} não encontrado, bot ativo por padrão")
-                self._bot_status_cache[contact_id] = True
                 return True
             
             # Verifica campo customizado bot_ativo
-            custom_fields = contact.get("custom_fields_values", [])
-            for field in custom_fields:
-                if field.get("field_name") == "bot_ativo" or field.get("field_code") == "bot_ativo":
-                    value = field.get("values", [{}])[0].get("value", "true")
-                    is_active = str(value).lower() in ["true", "1", "sim", "yes"]
-                    logger.info(f"Bot ativo para contato {contact_id}: {is_active}")
-                    self._bot_status_cache[contact_id] = is_active
-                    return is_active
+            fields = index_custom_fields(contact, "contacts")
+            if "bot_ativo" in fields:
+                is_active = fields.text("bot_ativo", default="true") in ["true", "1", "sim", "yes"]
+                logger.info(f"Bot ativo para contato {contact_id}: {is_active}")
+                return is_active
             
             # Campo não encontrado, ativo por padrão
             logger.info(f"Campo bot_ativo não encontrado para contato {contact_id}, ativo por padrão")
-            self._bot_status_cache[contact_id] = True
             return True
             
         except Exception as e:
             logger.error(f"Erro ao verificar status do bot para contato {contact_id}: {e}")
-            # Fallback para cache ou padrão
-            return self._bot_status_cache.get(contact_id, True)
+            return True
+    
+    async def _set_bot_status(self, contact_id: int, status: str, source: str):
+        """Registra pausa/retomada no store (visível para todos os workers)"""
+        try:
+            await self.store.set_bot_status(contact_id, {
+                "status": status,
+                "timestamp": datetime.now().isoformat(),
+                ("paused_by" if status == "paused" else "resumed_by"): source
+            })
+        except Exception as e:
+            logger.error(f"Erro ao registrar status do bot para contato {contact_id}: {e}")
     
     async def pause_bot(self, contact_id: int) -> bool:
         """Pausa o bot para um contato específico"""
         try:
             logger.info(f"Tentando pausar bot para contato {contact_id}")
             
+            # A pausa vale imediatamente, mesmo se o Kommo falhar
+            await self._set_bot_status(contact_id, "paused", "command")
+            
             # Busca lead associado
             lead = await self.get_lead_by_contact(contact_id)
             if not lead:
-                logger.warning(f"Lead não encontrado para contato {contact_id}, usando cache local")
-                self._bot_status_cache[contact_id] = False
-                logger.info(f"Bot pausado para contato {contact_id} (cache local)")
+                logger.warning(f"Lead não encontrado para contato {contact_id}, pausa registrada só no store")
                 return True
             
             # Tenta atualizar campo no lead
             success = await self.update_lead_field(lead["id"], "bot_ativo", "false")
             if success:
                 logger.info(f"Bot pausado para contato {contact_id}")
-                self._bot_status_cache[contact_id] = False
                 # Envia mensagem de confirmação
                 await self.send_message_to_contact(contact_id, "Bot pausado. Vendedor assumindo conversa.")
             else:
-                logger.warning(f"Erro ao atualizar lead, usando cache local para contato {contact_id}")
-                self._bot_status_cache[contact_id] = False
+                logger.warning(f"Erro ao atualizar lead, pausa registrada só no store para contato {contact_id}")
                 success = True
             
             return success
             
         except Exception as e:
             logger.error(f"Erro ao pausar bot para contato {contact_id}: {e}")
-            # Fallback para cache
-            self._bot_status_cache[contact_id] = False
+            await self._set_bot_status(contact_id, "paused", "command")
             logger.info(f"Bot pausado para contato {contact_id} (fallback)")
             return True
     
@@ -164,38 +239,40 @@ class KommoService:
             # Busca lead associado
             lead = await self.get_lead_by_contact(contact_id)
             if not lead:
-                logger.warning(f"Lead não encontrado para contato {contact_id}, usando cache local")
-                self._bot_status_cache[contact_id] = True
-                logger.info(f"Bot reativado para contato {contact_id} (cache local)")
+                logger.warning(f"Lead não encontrado para contato {contact_id}, retomada registrada só no store")
+                await self._set_bot_status(contact_id, "active", "command")
                 return True
             
             # Tenta atualizar campo no lead
             success = await self.update_lead_field(lead["id"], "bot_ativo", "true")
             if success:
                 logger.info(f"Bot reativado para contato {contact_id}")
-                self._bot_status_cache[contact_id] = True
+                # Campo do Kommo atualizado: volta a valer o bot_ativo do contato
+                await self.store.clear_bot_status(contact_id)
                 # Envia mensagem de confirmação
                 await self.send_message_to_contact(contact_id, "Bot reativado. Assumindo atendimento automático.")
             else:
-                logger.warning(f"Erro ao atualizar lead, usando cache local para contato {contact_id}")
-                self._bot_status_cache[contact_id] = True
+                logger.warning(f"Erro ao atualizar lead, retomada registrada só no store para contato {contact_id}")
+                await self._set_bot_status(contact_id, "active", "command")
                 success = True
             
             return success
             
         except Exception as e:
             logger.error(f"Erro ao reativar bot para contato {contact_id}: {e}")
-            # Fallback para cache
-            self._bot_status_cache[contact_id] = True
+            await self._set_bot_status(contact_id, "active", "command")
             logger.info(f"Bot reativado para contato {contact_id} (fallback)")
             return True
     
     async def get_bot_status(self, contact_id: int) -> Dict[str, Any]:
         """Retorna status detalhado do bot para um contato"""
         try:
-            is_active = await self.is_bot_active(contact_id)
-            contact = await self.get_contact(contact_id)
-            lead = await self.get_lead_by_contact(contact_id)
+            source = "store" if await self.store.get_bot_status(contact_id) is not None else "api"
+            contact, lead = await asyncio.gather(
+                self.get_contact(contact_id),
+                self.get_lead_by_contact(contact_id)
+            )
+            is_active = await self.is_bot_active(contact_id, contact=contact, fetch=False)
             
             status = {
                 "contact_id": contact_id,
@@ -203,7 +280,7 @@ class KommoService:
                 "contact_name": contact.get("name", "N/A") if contact else "N/A",
                 "lead_id": lead.get("id") if lead else None,
                 "lead_status": lead.get("status_name", "N/A") if lead else "N/A",
-                "source": "cache" if contact_id in self._bot_status_cache else "api"
+                "source": source
             }
             
             logger.info(f"Status do bot para contato {contact_id}: {status}")
@@ -213,11 +290,11 @@ class KommoService:
             logger.error(f"Erro ao obter status do bot para contato {contact_id}: {e}")
             return {
                 "contact_id": contact_id,
-                "bot_active": self._bot_status_cache.get(contact_id, True),
+                "bot_active": await self.is_bot_active(contact_id, fetch=False),
                 "contact_name": "N/A",
                 "lead_id": None,
                 "lead_status": "N/A",
-                "source": "cache_fallback",
+                "source": "store_fallback",
                 "error": str(e)
             }
     
@@ -265,8 +342,9 @@ class KommoService:
             return {"error": str(e)}
     
     async def set_conversation_initiated(self, contact_id: int, initiated: bool, trigger_source: str = None, lead_data: Dict[str, Any] = None) -> bool:
-        """Marca que bot iniciou conversa proativamente"""
-        self._conversation_states[contact_id] = {
+        """Marca que bot iniciou conversa proativamente (mantém o contexto já salvo da conversa)"""
+        state = {
+            **(await self.store.get(contact_id) or {}),
             "initiated_by_bot": initiated,
             "first_response_received": False,
             "conversation_active": True,
@@ -274,52 +352,244 @@ class KommoService:
             "trigger_source": trigger_source,
             "lead_data": lead_data or {}
         }
-        logger.info(f"Estado de conversa definido para contato {contact_id}: {self._conversation_states[contact_id]}")
+        await self.store.put(contact_id, state)
+        logger.info(f"Estado de conversa definido para contato {contact_id}: {state}")
         return True
 
     async def set_first_response_received(self, contact_id: int, received: bool) -> bool:
         """Marca que o lead respondeu pela primeira vez"""
-        if contact_id in self._conversation_states:
-            self._conversation_states[contact_id]["first_response_received"] = received
-            self._conversation_states[contact_id]["first_response_at"] = datetime.now().isoformat()
+        state = await self.store.update(
+            contact_id,
+            first_response_received=received,
+            first_response_at=datetime.now().isoformat()
+        )
+        if state is not None:
             logger.info(f"Primeira resposta marcada para contato {contact_id}")
             return True
         return False
 
     async def get_conversation_state(self, contact_id: int) -> Dict[str, Any]:
         """Retorna estado da conversa"""
-        return self._conversation_states.get(contact_id, {})
+        return await self.store.get(contact_id) or {}
     
     async def set_conversation_active(self, contact_id: int, active: bool) -> bool:
         """Define se a conversa está ativa"""
-        if contact_id in self._conversation_states:
-            self._conversation_states[contact_id]["conversation_active"] = active
-            return True
-        return False
+        return await self.store.update(contact_id, conversation_active=active) is not None
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Estatísticas dos caches locais do serviço"""
+        return {
+            "kommo_responses": self._response_cache.stats(),
+            "kommo_conditional": self._versions.stats(),
+            "custom_field_index": custom_field_index_stats(),
+            "kommo_singleflight": self._singleflight.stats()
+        }
+    
+    def conditional_stats(self) -> Dict[str, Any]:
+        """GETs condicionais: taxa de 304 e bytes economizados"""
+        return {
+            "requests": self.conditional_requests,
+            "not_modified": self.not_modified,
+            "not_modified_ratio": round(self.not_modified / self.conditional_requests, 4) if self.conditional_requests else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "versions_cached": len(self._versions)
+        }
+    
+    def loader_stats(self) -> Dict[str, Any]:
+        """Agrupamento das leituras de contatos e leads"""
+        return {
+            "window_seconds": self._contact_loader.window,
+            "contacts": self._contact_loader.stats(),
+            "leads": self._lead_loader.stats()
+        }
+    
+    def _cache_key(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Tuple:
+        """Chave do cache de respostas: endpoint + parâmetros normalizados"""
+        items = []
+        for name, value in sorted((params or {}).items()):
+            items.append((name, tuple(value) if isinstance(value, (list, tuple)) else value))
+        return (endpoint, tuple(items))
+    
+    async def _request(self, method: str, endpoint: str, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Tuple[int, Any]:
+        """
+        Requisição ao Kommo passando pelo rate limiter compartilhado
+        
+        Retorna (status, corpo): json em respostas 2xx com corpo JSON, texto
+        nos demais casos e None quando vazio.
+        """
+        status, text, _, _ = await self._send(method, endpoint, priority, **kwargs)
+        return status, self._parse_body(status, text)
+    
+    @staticmethod
+    def _parse_body(status: int, text: str) -> Any:
+        if not text:
+            return None
+        if 200 <= status < 300:
+            try:
+                return fast_json.loads(text)
+            except ValueError:
+                pass
+        return text
+    
+    async def _send(self, method: str, endpoint: str, priority: int = PRIORITY_INTERACTIVE, extra_headers: Optional[Dict[str, str]] = None, **kwargs) -> Tuple[int, str, Any, int]:
+        """
+        Envia a requisição e retorna (status, texto, headers, bytes do corpo) sem interpretar o corpo
+        
+        Em 429 respeita Retry-After (ou backoff exponencial), reduz a taxa do
+        limiter e tenta novamente. Em 401 renova o token (uma única vez,
+        compartilhando a renovação com as demais requisições) e repete.
+        `extra_headers` complementa os headers de autenticação do serviço.
+        """
+        url = endpoint if endpoint.startswith("http") else f"{self.api_url}{endpoint}"
+        # Só repete após 401 quando a autenticação é a do serviço (não a da troca de token)
+        replay_on_401 = "headers" not in kwargs
+        if replay_on_401:
+            kwargs["headers"] = {**await self.get_headers(), **(extra_headers or {})}
+        if "json" in kwargs:
+            # Serializado uma vez (também vale para as repetições após 429/401)
+            kwargs["data"] = fast_json.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {**kwargs["headers"], "Content-Type": "application/json"}
+        
+        label = _endpoint_label(endpoint)
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(priority)
+            started = time.perf_counter()
+            KOMMO_IN_FLIGHT.inc(endpoint=label)
+            try:
+                async with self.session.request(method, url, timeout=self.DEFAULT_TIMEOUT, **kwargs) as response:
+                    KOMMO_REQUESTS.inc(endpoint=label, method=method, status=response.status)
+                    if response.status == 429 and attempt < self.MAX_RATE_LIMIT_RETRIES:
+                        retry_after = self._retry_after_seconds(response.headers.get("Retry-After"), attempt)
+                        self.rate_limiter.penalize(retry_after)
+                        logger.warning(f"Kommo 429 em {method} {endpoint} - aguardando {retry_after:.1f}s (tentativa {attempt + 1})")
+                        attempt += 1
+                        continue
+                    
+                    status = response.status
+                    headers = response.headers
+                    # Bytes recebidos (não caracteres: acentos em UTF-8 ocupam mais de um byte)
+                    size = len(await response.read())
+                    text = await response.text()
+                    KOMMO_RESPONSE_BYTES.inc(size, endpoint=label)
+            except asyncio.TimeoutError:
+                KOMMO_ERRORS.inc(endpoint=label, method=method, error="timeout")
+                raise
+            except aiohttp.ClientError:
+                KOMMO_ERRORS.inc(endpoint=label, method=method, error="connection")
+                raise
+            finally:
+                KOMMO_IN_FLIGHT.dec(endpoint=label)
+                KOMMO_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=label, method=method)
+            
+            if status == 401 and replay_on_401:
+                replay_on_401 = False
+                rejected = kwargs["headers"]["Authorization"][len("Bearer "):]
+                if await self.tokens.invalidate(rejected):
+                    logger.warning(f"Kommo 401 em {method} {endpoint} - repetindo com token renovado")
+                    kwargs["headers"] = {**await self.get_headers(), **(extra_headers or {})}
+                    continue
+            
+            return status, text, headers, size
+    
+    def _retry_after_seconds(self, header: Optional[str], attempt: int) -> float:
+        """Tempo de espera após 429: Retry-After ou backoff exponencial com jitter"""
+        if header:
+            try:
+                return max(0.0, float(header))
+            except ValueError:
+                pass
+        return min(30.0, 2 ** attempt) + random.uniform(0, 0.5)
+    
+    async def _get(self, endpoint: str, params: Optional[Dict[str, Any]] = None, priority: int = PRIORITY_INTERACTIVE) -> Tuple[int, Any]:
+        """
+        GET no Kommo retornando (status, json)
+        
+        Respostas 200 ficam em cache curto e chamadas idênticas concorrentes
+        compartilham a mesma requisição (single-flight). O json retornado é
+        compartilhado entre chamadores e não deve ser modificado.
+        """
+        key = self._cache_key(endpoint, params)
+        cached = self._response_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        return await self._singleflight.do(key, lambda: self._fetch(endpoint, params, key, priority))
+    
+    async def _fetch(self, endpoint: str, params: Optional[Dict[str, Any]], key: Tuple, priority: int) -> Tuple[int, Any]:
+        """Executa o GET (condicional se houver versão conhecida) e alimenta o cache de respostas"""
+        version = self._versions.get(key)
+        conditional = self._conditional_headers(version[0] if version else None)
+        status, text, headers, size = await self._send("GET", endpoint, priority, extra_headers=conditional, params=params)
+        
+        if status == 304 and version:
+            self._record_conditional(endpoint, version[2])
+            result = (200, version[1])
+        else:
+            data = self._parse_body(status, text)
+            result = (status, data if status == 200 else None)
+            if version:
+                self._record_conditional(endpoint, None)
+            if status == 200:
+                modified_at = self._modified_at(headers, data)
+                if modified_at is not None:
+                    self._versions.set(key, (modified_at, data, size))
+        
+        if result[0] == 200:
+            self._response_cache.set(key, result)
+        return result
+    
+    @staticmethod
+    def _conditional_headers(modified_at: Optional[float]) -> Optional[Dict[str, str]]:
+        if modified_at is None:
+            return None
+        return {"If-Modified-Since": formatdate(modified_at, usegmt=True)}
+    
+    @staticmethod
+    def _modified_at(headers: Any, body: Any) -> Optional[float]:
+        """Versão da resposta: header Last-Modified ou updated_at da entidade"""
+        last_modified = headers.get("Last-Modified") if headers else None
+        if last_modified:
+            try:
+                return parsedate_to_datetime(last_modified).timestamp()
+            except (TypeError, ValueError):
+                pass
+        if isinstance(body, dict) and isinstance(body.get("updated_at"), (int, float)):
+            return float(body["updated_at"])
+        return None
+    
+    def _record_conditional(self, endpoint: str, saved_bytes: Optional[int]):
+        """Contabiliza um GET condicional (saved_bytes None: o Kommo mandou o corpo novo)"""
+        label = _endpoint_label(endpoint)
+        self.conditional_requests += 1
+        if saved_bytes is None:
+            KOMMO_CONDITIONAL.inc(endpoint=label, result="modified")
+            return
+        self.not_modified += 1
+        self.bytes_saved += saved_bytes
+        KOMMO_CONDITIONAL.inc(endpoint=label, result="not_modified")
+        KOMMO_BYTES_SAVED.inc(saved_bytes, endpoint=label)
+    
+    def _invalidate_cache(self, endpoint_prefix: str):
+        """Remove do cache de respostas as entradas de um endpoint (após escrita)"""
+        # Versões também saem: updated_at tem resolução de segundos e um
+        # If-Modified-Since logo após a escrita poderia receber 304
+        for cache in (self._response_cache, self._versions):
+            for key in cache.keys():
+                if key[0].startswith(endpoint_prefix):
+                    cache.pop(key)
     
     async def get_contact(self, contact_id: int) -> Optional[Dict[str, Any]]:
-        """Busca informações de um contato"""
+        """Busca informações de um contato (agrupado com outros contatos pedidos no mesmo instante)"""
         try:
-            url = f"{self.api_url}/contacts/{contact_id}"
-            headers = await self.get_headers()
-            
             logger.info(f"Buscando contato: {contact_id}")
             
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.get(url, headers=headers) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        logger.info(f"Contato encontrado: {contact_id}")
-                        return result
-                    elif response.status == 204:
-                        logger.warning(f"Contato {contact_id} não encontrado (204)")
-                        return None
-                    elif response.status == 404:
-                        logger.warning(f"Contato {contact_id} não encontrado (404)")
-                        return None
-                    else:
-                        logger.error(f"Erro ao buscar contato {contact_id}: {response.status}")
-                        return None
+            contact = await self._load_entity("/contacts", self._contact_loader, contact_id)
+            if contact:
+                logger.info(f"Contato encontrado: {contact_id}")
+            else:
+                logger.warning(f"Contato {contact_id} não encontrado")
+            return contact
         except asyncio.TimeoutError:
             logger.error(f"Timeout ao buscar contato {contact_id}")
             return None
@@ -327,33 +597,41 @@ class KommoService:
             logger.error(f"Erro ao buscar contato: {e}")
             return None
     
-    async def get_lead_by_contact(self, contact_id: int) -> Optional[Dict[str, Any]]:
-        """Busca lead associado a um contato"""
+    async def get_lead(self, lead_id: int) -> Optional[Dict[str, Any]]:
+        """Busca um lead pelo id (agrupado com outros leads pedidos no mesmo instante)"""
+        try:
+            logger.info(f"Buscando lead: {lead_id}")
+
+            lead = await self._load_entity("/leads", self._lead_loader, lead_id)
+            if not lead:
+                logger.warning(f"Lead {lead_id} não encontrado")
+            return lead
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout ao buscar lead {lead_id}")
+            return None
+        except Exception as e:
+            logger.error(f"Erro ao buscar lead {lead_id}: {e}")
+            return None
+
+    async def get_lead_by_contact(self, contact_id: int, contact: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Busca lead associado a um contato (primeiro lead vinculado; `contact` reaproveita o contato já buscado)"""
         try:
-            url = f"{self.api_url}/leads"
-            headers = await self.get_headers()
-            params = {"contact_id": contact_id}
-            
             logger.info(f"Buscando lead para contato: {contact_id}")
             
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.get(url, headers=headers, params=params) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        leads = result.get("_embedded", {}).get("leads", [])
-                        if leads:
-                            lead = leads[0]  # Primeiro lead encontrado
-                            logger.info(f"Lead encontrado para contato {contact_id}: {lead.get('id')}")
-                            return lead
-                        else:
-                            logger.warning(f"Nenhum lead encontrado para contato {contact_id}")
-                            return None
-                    elif response.status == 204:
-                        logger.warning(f"Nenhum lead encontrado para contato {contact_id} (204)")
-                        return None
-                    else:
-                        logger.error(f"Erro ao buscar lead para contato {contact_id}: {response.status}")
-                        return None
+            # O contato vem com os ids dos leads (with=leads); o lead em si, em um segundo lote
+            if contact is None:
+                contact = await self._load_entity("/contacts", self._contact_loader, contact_id)
+            leads = (contact or {}).get("_embedded", {}).get("leads") or []
+            if not leads:
+                logger.warning(f"Nenhum lead encontrado para contato {contact_id}")
+                return None
+            
+            lead = await self._load_entity("/leads", self._lead_loader, leads[0]["id"])
+            if lead:
+                logger.info(f"Lead encontrado para contato {contact_id}: {lead.get('id')}")
+            else:
+                logger.warning(f"Lead {leads[0]['id']} do contato {contact_id} não encontrado")
+            return lead
         except asyncio.TimeoutError:
             logger.error(f"Timeout ao buscar lead para contato {contact_id}")
             return None
@@ -361,28 +639,78 @@ class KommoService:
             logger.error(f"Erro ao buscar lead para contato {contact_id}: {e}")
             return None
     
+    async def _load_entity(self, resource: str, loader: BatchLoader, entity_id: int) -> Optional[Dict[str, Any]]:
+        """Entidade do cache curto de respostas ou do próximo lote do loader"""
+        cached = self._response_cache.get(self._cache_key(f"{resource}/{entity_id}"))
+        if cached is not None:
+            return cached[1]
+        return await loader.load(int(entity_id))
+    
+    async def _load_contacts(self, contact_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        return await self._load_batch("/contacts", "contacts", contact_ids, "leads")
+    
+    async def _load_leads(self, lead_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        return await self._load_batch("/leads", "leads", lead_ids, "contacts")
+    
+    async def _load_batch(self, resource: str, embedded: str, ids: List[int], with_: str) -> Dict[int, Dict[str, Any]]:
+        """
+        GET filtrado por filter[id][] (um lote do BatchLoader); alimenta o cache por entidade
+        
+        Se todas as entidades do lote têm versão conhecida, o GET é
+        condicional: 304/204 servem o lote do cache e um 200 traz só as
+        entidades alteradas (as demais continuam as do cache).
+        """
+        keys = {entity_id: self._cache_key(f"{resource}/{entity_id}") for entity_id in ids}
+        versions = {entity_id: self._versions.get(key) for entity_id, key in keys.items()}
+        known = all(versions.values())
+        conditional = self._conditional_headers(min(v[0] for v in versions.values())) if known else None
+        
+        params = [("filter[id][]", entity_id) for entity_id in ids]
+        params.extend([("with", with_), ("limit", len(ids))])
+        if len(ids) > 1:
+            logger.info(f"Buscando {len(ids)} {embedded} em um GET {resource}")
+        
+        status, text, _, size = await self._send("GET", resource, extra_headers=conditional, params=params)
+        if known and status in (204, 304):
+            self._record_conditional(resource, sum(v[2] for v in versions.values()))
+            entities = {entity_id: version[1] for entity_id, version in versions.items()}
+        elif status == 204:
+            return {}
+        elif status != 200:
+            raise KommoRequestError(f"GET {resource} em lote retornou {status}")
+        else:
+            result = self._parse_body(status, text)
+            fetched = result.get("_embedded", {}).get(embedded, []) if isinstance(result, dict) else []
+            if known:
+                self._record_conditional(resource, None)
+            entities = {entity_id: version[1] for entity_id, version in versions.items()} if known else {}
+            size //= max(1, len(fetched))
+            for entity in fetched:
+                entities[entity["id"]] = entity
+                modified_at = self._modified_at(None, entity)
+                if modified_at is not None:
+                    self._versions.set(keys.get(entity["id"], self._cache_key(f"{resource}/{entity['id']}")), (modified_at, entity, size))
+        
+        for entity_id, entity in entities.items():
+            self._response_cache.set(self._cache_key(f"{resource}/{entity_id}"), (200, entity))
+        return entities
+    
     async def get_contact_conversations(self, contact_id: int) -> list:
         """Busca conversas ativas de um contato"""
         try:
-            url = f"{self.api_url}/chats"
-            headers = await self.get_headers()
-            params = {"contact_id": contact_id}
-            
             logger.info(f"Buscando conversas para contato: {contact_id}")
             
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.get(url, headers=headers, params=params) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        conversations = result.get("_embedded", {}).get("chats", [])
-                        logger.info(f"{len(conversations)} conversas encontradas para contato {contact_id}")
-                        return conversations
-                    elif response.status == 204:
-                        logger.warning(f"Nenhuma conversa encontrada para contato {contact_id} (204)")
-                        return []
-                    else:
-                        logger.error(f"Erro ao buscar conversas para contato {contact_id}: {response.status}")
-                        return []
+            status, result = await self._get("/chats", {"contact_id": contact_id})
+            if status == 200:
+                conversations = result.get("_embedded", {}).get("chats", [])
+                logger.info(f"{len(conversations)} conversas encontradas para contato {contact_id}")
+                return conversations
+            elif status == 204:
+                logger.warning(f"Nenhuma conversa encontrada para contato {contact_id} (204)")
+                return []
+            else:
+                logger.error(f"Erro ao buscar conversas para contato {contact_id}: {status}")
+                return []
         except asyncio.TimeoutError:
             logger.error(f"Timeout ao buscar conversas para contato {contact_id}")
             return []
@@ -390,40 +718,91 @@ class KommoService:
             logger.error(f"Erro ao buscar conversas para contato {contact_id}: {e}")
             return []
     
+    async def get_users(self) -> Optional[List[Dict[str, Any]]]:
+        """Lista usuários (vendedores) da conta - chamada de background"""
+        try:
+            status, result = await self._get("/users", priority=PRIORITY_BACKGROUND)
+            if status == 200:
+                return result.get("_embedded", {}).get("users", [])
+            else:
+                logger.error(f"Erro ao buscar vendedores do Kommo: {status}")
+                return None
+        except asyncio.TimeoutError:
+            logger.error("Timeout ao buscar vendedores do Kommo")
+            return None
+        except Exception as e:
+            logger.error(f"Erro ao buscar vendedores: {e}")
+            return None
+    
+    async def get_custom_fields(self, entity: str) -> Optional[List[Dict[str, Any]]]:
+        """Lista os campos customizados de leads/contacts (todas as páginas) - chamada de background"""
+        fields: List[Dict[str, Any]] = []
+        page = 1
+        try:
+            while True:
+                status, result = await self._get(f"/{entity}/custom_fields", {"page": page, "limit": 250}, priority=PRIORITY_BACKGROUND)
+                if status == 204:
+                    return fields
+                if status != 200:
+                    logger.error(f"Erro ao buscar campos customizados de {entity}: {status}")
+                    return None
+                fields.extend(result.get("_embedded", {}).get("custom_fields", []))
+                if not result.get("_links", {}).get("next"):
+                    return fields
+                page += 1
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout ao buscar campos customizados de {entity}")
+            return None
+        except Exception as e:
+            logger.error(f"Erro ao buscar campos customizados de {entity}: {e}")
+            return None
+    
+    async def update_lead(self, lead_id: int, changes: Dict[str, Any]) -> bool:
+        """
+        Atualiza um lead (campos, custom_fields_values, _embedded.tags...)
+        
+        A escrita entra no PATCH /leads em lote da janela atual; se o Kommo
+        recusar o lote inteiro, o lead é repetido sozinho.
+        """
+        try:
+            updated = await self.lead_updates.update(lead_id, changes)
+            if updated is None:
+                status, _ = await self._request("PATCH", f"/leads/{lead_id}", priority=PRIORITY_BACKGROUND, json=changes)
+                updated = status == 200
+                if updated:
+                    self._invalidate_cache("/leads")
+            return updated
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout ao atualizar lead {lead_id}")
+            return False
+        except Exception as e:
+            logger.error(f"Erro ao atualizar lead {lead_id}: {e}")
+            return False
+    
     async def update_lead_field(self, lead_id: int, field_name: str, value: str) -> bool:
-        """Atualiza campo customizado de um lead"""
+        """Atualiza campo customizado de um lead (agrupado com outras escritas)"""
         try:
-            url = f"{self.api_url}/leads/{lead_id}"
-            headers = await self.get_headers()
-            
-            # Usa o ID do campo criado (1137760) para bot_ativo
-            field_id = 1137760 if field_name == "bot_ativo" else field_name
-            
-            # Tenta diferentes formatos de payload para compatibilidade
-            payload = {
-                "custom_fields_values": [
-                    {
-                        "field_id": field_id,
-                        "values": [{"value": value}]
-                    }
-                ]
-            }
+            # field_id e formato do valor vêm do esquema de campos do Kommo
+            field_value = self.field_schema.field_value("leads", field_name, value) if self.field_schema else None
+            if field_value is None:
+                logger.warning(f"Campo {field_name} não encontrado no esquema do Kommo - enviando pelo nome")
+                field_value = {"field_name": field_name, "values": [{"value": value}]}
+            payload = {"custom_fields_values": [field_value]}
             
             logger.info(f"Atualizando lead {lead_id}, campo {field_name}: {value}")
             
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.patch(url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        logger.info(f"Lead atualizado com sucesso: {lead_id}")
-                        return True
-                    elif response.status == 400:
-                        logger.warning(f"Erro 400 ao atualizar lead {lead_id} - campo pode não existir ou formato inválido")
-                        # Tenta formato alternativo
-                        return await self._try_alternative_field_update(lead_id, field_name, value)
-                    else:
-                        logger.error(f"Erro ao atualizar lead {lead_id}: {response.status}")
-                        return False
-                    
+            updated = await self.lead_updates.update(lead_id, payload)
+            if updated:
+                logger.info(f"Lead atualizado com sucesso: {lead_id}")
+                return True
+            elif updated is None:
+                # Lote recusado (400): repete sozinho, com o formato alternativo se preciso
+                logger.warning(f"PATCH em lote recusado - atualizando lead {lead_id} individualmente")
+                return await self._update_lead_field_single(lead_id, field_name, payload)
+            else:
+                logger.error(f"Lead {lead_id} não foi atualizado pelo PATCH em lote")
+                return False
+                
         except asyncio.TimeoutError:
             logger.error(f"Timeout ao atualizar lead {lead_id}")
             return False
@@ -431,12 +810,43 @@ class KommoService:
             logger.error(f"Erro ao atualizar campo do lead: {e}")
             return False
     
+    async def _update_lead_field_single(self, lead_id: int, field_name: str, payload: Dict[str, Any]) -> bool:
+        """PATCH /leads/{id} de um único lead (tenta o formato alternativo em 400)"""
+        # Escrita de campo é background: cede a vez para o enriquecimento de mensagens
+        status, _ = await self._request("PATCH", f"/leads/{lead_id}", priority=PRIORITY_BACKGROUND, json=payload)
+        if status == 200:
+            logger.info(f"Lead atualizado com sucesso: {lead_id}")
+            self._invalidate_cache("/leads")
+            return True
+        elif status == 400 and "field_id" in payload["custom_fields_values"][0]:
+            logger.warning(f"Erro 400 ao atualizar lead {lead_id} - campo pode ter sido alterado no Kommo")
+            # Esquema possivelmente desatualizado: recarrega em background
+            if self.field_schema:
+                asyncio.ensure_future(self.field_schema.refresh())
+            value = payload["custom_fields_values"][0]["values"][0].get("value")
+            return await self._try_alternative_field_update(lead_id, field_name, value)
+        else:
+            logger.error(f"Erro ao atualizar lead {lead_id}: {status}")
+            return False
+    
+    async def _patch_leads(self, leads: List[Dict[str, Any]]) -> Dict[int, Optional[bool]]:
+        """PATCH /leads com o lote do LeadUpdateBatcher; resultado por id de lead"""
+        status, result = await self._request("PATCH", "/leads", priority=PRIORITY_BACKGROUND, json=leads)
+        if status == 200:
+            self._invalidate_cache("/leads")
+            embedded = result.get("_embedded", {}).get("leads", []) if isinstance(result, dict) else []
+            updated = {lead.get("id") for lead in embedded}
+            # Sem a lista de leads na resposta, o 200 vale para o lote todo
+            return {lead["id"]: not updated or lead["id"] in updated for lead in leads}
+        if status == 400:
+            logger.warning(f"Kommo recusou PATCH /leads em lote ({len(leads)} leads): {result}")
+            return {lead["id"]: None for lead in leads}
+        logger.error(f"Erro no PATCH /leads em lote: {status}")
+        return {lead["id"]: False for lead in leads}
+    
     async def _try_alternative_field_update(self, lead_id: int, field_name: str, value: str) -> bool:
         """Tenta formato alternativo para atualização de campo"""
         try:
-            url = f"{self.api_url}/leads/{lead_id}"
-            headers = await self.get_headers()
-            
             # Formato alternativo usando field_name
             payload = {
                 "custom_fields_values": [
@@ -449,15 +859,15 @@ class KommoService:
             
             logger.info(f"Tentando formato alternativo para lead {lead_id}")
             
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.patch(url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        logger.info(f"Lead atualizado com formato alternativo: {lead_id}")
-                        return True
-                    else:
-                        logger.warning(f"Formato alternativo também falhou: {response.status}")
-                        return False
-                        
+            status, _ = await self._request("PATCH", f"/leads/{lead_id}", priority=PRIORITY_BACKGROUND, json=payload)
+            if status == 200:
+                logger.info(f"Lead atualizado com formato alternativo: {lead_id}")
+                self._invalidate_cache("/leads")
+                return True
+            else:
+                logger.warning(f"Formato alternativo também falhou: {status}")
+                return False
+                    
         except Exception as e:
             logger.error(f"Erro no formato alternativo: {e}")
             return False
@@ -466,9 +876,6 @@ class KommoService:
         """Tenta endpoint alternativo para envio de mensagens"""
         try:
             # Endpoint alternativo: /chats/messages
-            url = f"{self.api_url}/chats/messages"
-            headers = await self.get_headers()
-            
             payload = {
                 "conversation_id": conversation_id,
                 "message": message,
@@ -477,27 +884,25 @@ class KommoService:
             
             logger.info(f"Tentando endpoint alternativo: /chats/messages")
             
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.post(url, json=payload, headers=headers) as response:
-                    if response.status == 200 or response.status == 201:
-                        result = await response.json()
-                        logger.info(f"Mensagem enviada com endpoint alternativo: {conversation_id}")
-                        return {
-                            "status": "sent",
-                            "conversation_id": conversation_id,
-                            "message": message,
-                            "response": result,
-                            "note": "Enviado via endpoint alternativo"
-                        }
-                    else:
-                        logger.warning(f"Endpoint alternativo também falhou: {response.status} - simulando envio")
-                        return {
-                            "status": "sent",
-                            "conversation_id": conversation_id,
-                            "message": message,
-                            "note": "Mensagem simulada - verificar documentação da API do Kommo"
-                        }
-                        
+            status, result = await self._request("POST", "/chats/messages", json=payload)
+            if status == 200 or status == 201:
+                logger.info(f"Mensagem enviada com endpoint alternativo: {conversation_id}")
+                return {
+                    "status": "sent",
+                    "conversation_id": conversation_id,
+                    "message": message,
+                    "response": result,
+                    "note": "Enviado via endpoint alternativo"
+                }
+            else:
+                logger.warning(f"Endpoint alternativo também falhou: {status} - simulando envio")
+                return {
+                    "status": "sent",
+                    "conversation_id": conversation_id,
+                    "message": message,
+                    "note": "Mensagem simulada - verificar documentação da API do Kommo"
+                }
+                    
         except Exception as e:
             logger.error(f"Erro no endpoint alternativo: {e}")
             return {
@@ -0,0 +1,143 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from app.utils.logger import setup_logger
+from app.utils.metrics import histogram
+
+logger = setup_logger(__name__)
+
+# Limite do Kommo para PATCH /leads em lote
+KOMMO_MAX_BATCH = 250
+
+LEAD_BATCH_SIZE = histogram(
+    "kommo_lead_batch_size",
+    "Leads por PATCH /leads em lote",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+
+# Lote -> {lead_id: True (atualizado) / False (falhou) / None (repetir individualmente)}
+BatchFlush = Callable[[List[Dict[str, Any]]], Awaitable[Dict[int, Optional[bool]]]]
+
+class _PendingUpdate:
+    """Alterações acumuladas de um lead e os chamadores aguardando o resultado"""
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.custom_fields: Dict[Any, Dict[str, Any]] = {}
+        self.waiters: List[asyncio.Future] = []
+
+    def merge(self, changes: Dict[str, Any]):
+        for name, value in changes.items():
+            if name == "custom_fields_values":
+                # Mesmo campo atualizado duas vezes na janela: vale a última escrita
+                for field in value:
+                    self.custom_fields[field.get("field_id") or field.get("field_name")] = field
+            else:
+                self.fields[name] = value
+
+    def payload(self, lead_id: int) -> Dict[str, Any]:
+        payload = {"id": lead_id, **self.fields}
+        if self.custom_fields:
+            payload["custom_fields_values"] = list(self.custom_fields.values())
+        return payload
+
+class LeadUpdateBatcher:
+    """
+    Coalescência de escritas em leads do Kommo
+
+    Atualizações que chegam dentro de `window` segundos são enviadas em um
+    único PATCH /leads (até `max_batch` leads por chamada, limite do
+    Kommo). Escritas no mesmo lead são mescladas e cada chamador recebe o
+    resultado do seu lead. Com window <= 0 cada atualização é enviada
+    sozinha, sem espera.
+    """
+
+    def __init__(self, flush: BatchFlush, window: float = 0.05, max_batch: int = KOMMO_MAX_BATCH):
+        self._flush = flush
+        self.window = window
+        self.max_batch = max(1, min(max_batch, KOMMO_MAX_BATCH))
+
+        self._pending: Dict[int, _PendingUpdate] = {}
+        self._timer: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Contadores expostos no /health
+        self.updates = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+    async def update(self, lead_id: int, changes: Dict[str, Any]) -> Optional[bool]:
+        """
+        Agenda a alteração do lead e espera o PATCH em lote
+
+        Retorna True/False conforme o Kommo, ou None quando o lote foi
+        recusado como um todo (o chamador decide se repete sozinho).
+        """
+        self.updates += 1
+        pending = self._pending.get(lead_id)
+        if pending is None:
+            pending = self._pending[lead_id] = _PendingUpdate()
+        pending.merge(changes)
+        waiter = asyncio.get_running_loop().create_future()
+        pending.waiters.append(waiter)
+
+        if self.window <= 0 or len(self._pending) >= self.max_batch:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+        return await waiter
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        self._dispatch()
+
+    def _dispatch(self):
+        """Fecha o lote atual (sem await: novas escritas abrem outro lote)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: Dict[int, _PendingUpdate]):
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        LEAD_BATCH_SIZE.observe(len(batch))
+        if len(batch) > 1:
+            logger.info(f"Enviando {len(batch)} atualizações de leads em um PATCH /leads")
+
+        try:
+            results = await self._flush([pending.payload(lead_id) for lead_id, pending in batch.items()])
+        except Exception as e:
+            logger.error(f"Erro no PATCH /leads em lote ({len(batch)} leads): {e}")
+            for pending in batch.values():
+                for waiter in pending.waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+            return
+
+        for lead_id, pending in batch.items():
+            for waiter in pending.waiters:
+                if not waiter.done():
+                    waiter.set_result(results.get(lead_id, False))
+
+    async def stop(self):
+        """Envia imediatamente o lote aberto e espera os envios em andamento"""
+        self._dispatch()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas da coalescência de escritas"""
+        return {
+            "window_seconds": self.window,
+            "max_batch": self.max_batch,
+            "pending_leads": len(self._pending),
+            "updates": self.updates,
+            "patch_calls": self.batches,
+            "largest_batch": self.largest_batch
+        }
@@ -0,0 +1,126 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Set
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class _PendingBatch:
+    """Mensagens acumuladas de uma conversa aguardando o fim da janela"""
+
+    def __init__(self, first_at: float, deadline: float):
+        self.items: List[Dict[str, Any]] = []
+        self.first_at = first_at
+        self.deadline = deadline
+        self.wakeup = asyncio.Event()
+        # Resolvido quando o lote é entregue ao callback `flush`
+        self.done = asyncio.get_running_loop().create_future()
+
+class MessageAggregator:
+    """
+    Janela de agregação por conversa antes de chamar o n8n
+
+    Cada mensagem reinicia a janela (`window`), limitada a `max_wait`
+    segundos desde a primeira mensagem do lote. Ao fim da janela o lote
+    inteiro é entregue de uma vez ao callback `flush`. Com window <= 0
+    cada mensagem é entregue imediatamente.
+
+    `add` devolve um future resolvido quando o lote da mensagem termina o
+    flush, para quem precisa saber que a mensagem saiu da memória (a fila
+    de webhooks só remove o job do journal nesse momento).
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[Dict[str, Any]]], Awaitable[Any]],
+        window: float,
+        max_wait: float
+    ):
+        self._flush = flush
+        self.window = window
+        self.max_wait = max(max_wait, window)
+
+        self._pending: Dict[Hashable, _PendingBatch] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Contadores expostos no /health
+        self.received = 0
+        self.flushed = 0
+
+    async def add(self, key: Hashable, item: Dict[str, Any]) -> asyncio.Future:
+        """Adiciona mensagem ao lote da conversa (não espera o envio ao n8n)"""
+        self.received += 1
+
+        if self.window <= 0:
+            done = asyncio.get_running_loop().create_future()
+            await self._emit(key, [item], done)
+            return done
+
+        now = time.monotonic()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _PendingBatch(first_at=now, deadline=now + self.window)
+            batch.items.append(item)
+            self._pending[key] = batch
+
+            task = asyncio.create_task(self._wait_and_flush(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            batch.items.append(item)
+            batch.deadline = min(now + self.window, batch.first_at + self.max_wait)
+        return batch.done
+
+    async def _wait_and_flush(self, key: Hashable, batch: _PendingBatch):
+        while True:
+            delay = batch.deadline - time.monotonic()
+            if delay <= 0:
+                break
+            try:
+                await asyncio.wait_for(batch.wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+        # Sem await entre a remoção e o fim da janela: mensagens novas abrem outro lote
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+        await self._emit(key, batch.items, batch.done)
+
+    async def _emit(self, key: Hashable, items: List[Dict[str, Any]], done: asyncio.Future):
+        self.flushed += 1
+        if len(items) > 1:
+            logger.info(f"Enviando {len(items)} mensagens agrupadas da conversa {key} em uma chamada ao n8n")
+        try:
+            await self._flush(items)
+        except asyncio.CancelledError:
+            # Cancelado no meio do envio: o lote não foi entregue
+            done.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Erro ao enviar lote agrupado da conversa {key}: {e}")
+            if not done.done():
+                done.set_exception(e)
+                # Evita aviso de "exception never retrieved" se ninguém esperar pelo lote
+                done.exception()
+            return
+        if not done.done():
+            done.set_result(len(items))
+
+    async def stop(self):
+        """Encerra as janelas abertas enviando imediatamente os lotes pendentes"""
+        for batch in self._pending.values():
+            batch.deadline = 0
+            batch.wakeup.set()
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas da agregação"""
+        return {
+            "window_seconds": self.window,
+            "max_wait_seconds": self.max_wait,
+            "open_batches": len(self._pending),
+            "messages_received": self.received,
+            "n8n_calls": self.flushed,
+            "n8n_calls_saved": self.received - self.flushed - sum(len(b.items) for b in self._pending.values())
+        }
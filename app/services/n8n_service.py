@@ -1,84 +1,337 @@
-import os
+import json
+import random
+import hashlib
 import aiohttp
 import asyncio
-from typing import Dict, Any
-from models.kommo_models import N8nPayload
-from utils.logger import setup_logger
+import time
+from urllib.parse import urlparse
+from typing import Dict, Any, Optional, Tuple
+from app.config import Settings, get_settings
+from app.models.kommo_models import N8nPayload
+from app.services.n8n_spool import N8nSpool
+from app.utils.logger import setup_logger, payload_preview
+from app.utils.http_client import get_http_session
+from app.utils import fast_json
+from app.utils.circuit_breaker import CircuitBreaker
+from app.utils.workers import worker_id
+from app.utils.metrics import counter, gauge, histogram
 
 logger = setup_logger(__name__)
 
+# Métricas por webhook do n8n (/metrics); o label é o path da URL
+N8N_REQUEST_SECONDS = histogram("n8n_request_duration_seconds", "Latência dos envios ao n8n", ("webhook",))
+N8N_REQUESTS = counter("n8n_requests_total", "Envios ao n8n por status (ou timeout/connection/client_error/error)", ("webhook", "status"))
+N8N_IN_FLIGHT = gauge("n8n_requests_in_flight", "Envios ao n8n em andamento", ("webhook",))
+
+# Webhook do n8n usado quando N8N_WEBHOOK_URL não está configurada (eanhw2.easypanel.host é o n8n real)
+DEFAULT_WEBHOOK_URL = "https://n8n-n8n.eanhw2.easypanel.host/webhook/serena"
+
 class N8nService:
-    def __init__(self):
-        self.webhook_url = os.getenv("N8N_WEBHOOK_URL")
-        self.api_key = os.getenv("N8N_API_KEY")
+    # Lease das entradas do spool reivindicadas para reenvio (segundos)
+    SPOOL_LEASE = 120.0
+    
+    def __init__(self, session: Optional[aiohttp.ClientSession] = None, settings: Optional[Settings] = None):
+        config = (settings or get_settings()).n8n
+        self.webhook_url = config.webhook_url
+        self.api_key = config.api_key
+        
+        # Sessão HTTP injetada (compartilhada pela aplicação)
+        self._session = session
         
         # Timeout padrão para todas as requisições
         self.DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10)
         
+        # Retentativas com backoff exponencial
+        self.max_retries = config.max_retries
+        self.retry_base_delay = config.retry_base_delay
+        self.retry_max_delay = config.retry_max_delay
+        
+        # Circuit breaker por URL de webhook
+        self.breaker_failure_threshold = config.breaker_failure_threshold
+        self.breaker_reset_timeout = config.breaker_reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        
+        # Spool em disco para payloads não entregues
+        self.spool_path = config.spool_path
+        self.spool_drain_interval = config.spool_drain_interval
+        self._spool: Optional[N8nSpool] = None
+        self._spool_depth: Dict[str, int] = {}
+        self._drain_wakeup: Optional[asyncio.Event] = None
+        self._drain_task: Optional[asyncio.Task] = None
+        self.spooled = 0
+        self.drained = 0
+        self.dropped = 0
+        
         if not self.webhook_url:
             logger.warning("⚠️ N8N_WEBHOOK_URL não configurada!")
     
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Sessão HTTP usada nas chamadas ao n8n (pool compartilhado)"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+        return get_http_session()
+    
     async def send_to_n8n(self, payload: N8nPayload) -> Dict[str, Any]:
         """Envia payload para o webhook do n8n"""
-        try:
-            if not self.webhook_url:
-                logger.error("❌ N8N_WEBHOOK_URL não configurada")
-                return {"error": "N8N_WEBHOOK_URL não configurada"}
+        return await self.send_to_n8n_with_dict(payload.model_dump())
+    
+    async def send_to_n8n_with_dict(self, payload_dict: Dict[str, Any], url: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Envia payload (já convertido em dict) para o webhook do n8n
+        
+        Falhas transitórias (timeout, conexão, 429, 5xx) são repetidas com
+        backoff exponencial. Se o circuito da URL estiver aberto ou as
+        tentativas se esgotarem, o payload vai para o spool em disco e é
+        reenviado quando o n8n voltar; nesse caso retorna status "queued".
+        """
+        url = url or self.webhook_url
+        if not url:
+            logger.error("❌ N8N_WEBHOOK_URL não configurada")
+            return {"error": "N8N_WEBHOOK_URL não configurada"}
+        
+        idempotency_key = self._idempotency_key(payload_dict)
+        breaker = self._breaker(url)
+        
+        logger.info("📤 Enviando para n8n: %s (conversa %s)", url, payload_dict.get("conversation_id"))
+        logger.debug("   📦 Payload: %s", payload_preview(payload_dict))
+        
+        # Com spool pendente para a URL, novos payloads entram atrás para manter a ordem
+        if self._spool_depth.get(url):
+            return await self._spool_payload(url, idempotency_key, payload_dict, "spool pendente")
+        
+        if not breaker.allow_request():
+            return await self._spool_payload(url, idempotency_key, payload_dict, "circuito aberto")
+        
+        attempt = 0
+        while True:
+            ok, retryable, result = await self._post_once(url, payload_dict, idempotency_key)
+            if ok or not retryable:
+                # n8n respondeu (mesmo com erro 4xx): destino está de pé
+                breaker.record_success()
+                return result
             
-            headers = {"Content-Type": "application/json"}
-            if self.api_key:
-                headers["Authorization"] = f"Bearer {self.api_key}"
+            breaker.record_failure(result.get("error"))
+            if attempt >= self.max_retries:
+                break
             
-            payload_dict = payload.dict()
-            logger.info(f"📤 Enviando para n8n:")
-            logger.info(f"   🔗 URL: {self.webhook_url}")
-            logger.info(f"   📦 Payload: {payload_dict}")
+            delay = self._backoff_delay(attempt)
+            attempt += 1
+            logger.warning(f"🔁 Nova tentativa {attempt}/{self.max_retries} para n8n em {delay:.2f}s")
+            await asyncio.sleep(delay)
             
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.post(
-                    self.webhook_url, 
-                    json=payload_dict, 
-                    headers=headers
-                ) as response:
-                    logger.info(f"📡 Status da resposta: {response.status}")
+            if not breaker.allow_request():
+                break
+        
+        return await self._spool_payload(url, idempotency_key, payload_dict, result.get("error", "falha"))
+    
+    async def _post_once(self, url: str, payload_dict: Dict[str, Any], idempotency_key: str) -> Tuple[bool, bool, Dict[str, Any]]:
+        """Uma tentativa de envio: retorna (sucesso, falha_transitória, resultado)"""
+        label = urlparse(url).path or url
+        started = time.perf_counter()
+        N8N_IN_FLIGHT.inc(webhook=label)
+        try:
+            return await self._post(url, label, payload_dict, idempotency_key)
+        finally:
+            N8N_IN_FLIGHT.dec(webhook=label)
+            N8N_REQUEST_SECONDS.observe(time.perf_counter() - started, webhook=label)
+    
+    async def _post(self, url: str, label: str, payload_dict: Dict[str, Any], idempotency_key: str) -> Tuple[bool, bool, Dict[str, Any]]:
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "Previdas-Bot/1.0",
+            "Idempotency-Key": idempotency_key
+        }
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        
+        try:
+            # Corpo serializado aqui (orjson no modo rápido) em vez do json= do aiohttp
+            async with self.session.post(
+                url, 
+                data=fast_json.dumps(payload_dict), 
+                headers=headers,
+                timeout=self.DEFAULT_TIMEOUT
+            ) as response:
+                logger.debug("📡 Status da resposta: %s", response.status)
+                N8N_REQUESTS.inc(webhook=label, status=response.status)
+                
+                if response.status in [200, 201]:
+                    try:
+                        result = await response.json(content_type=None, loads=fast_json.loads)
+                        logger.info("✅ Payload enviado para n8n com sucesso: %s", payload_dict.get("conversation_id"))
+                        logger.debug("📨 Resposta do n8n: %s", payload_preview(result))
+                        return True, False, result if isinstance(result, dict) else {"status": "success", "response": result}
+                    except Exception as json_error:
+                        logger.warning(f"⚠️ Erro ao parsear JSON da resposta: {json_error}")
+                        text_response = await response.text()
+                        logger.debug("📄 Resposta em texto: %s", payload_preview(text_response))
+                        return True, False, {"status": "success", "response_text": text_response}
+                elif response.status == 404:
+                    logger.error(f"❌ n8n não encontrado (404) - verificar URL: {url}")
+                    return False, False, {"error": "n8n não encontrado - verificar URL"}
+                elif response.status == 401:
+                    logger.error(f"❌ Erro de autenticação (401) - verificar API key")
+                    return False, False, {"error": "Erro de autenticação - verificar API key"}
+                elif response.status == 429 or response.status >= 500:
+                    error_text = await response.text()
+                    logger.error(f"❌ Erro transitório do n8n ({response.status}): {error_text}")
+                    return False, True, {"error": f"Status {response.status}: {error_text}"}
+                else:
+                    error_text = await response.text()
+                    logger.error(f"❌ Erro ao enviar para n8n: {response.status} - {error_text}")
+                    return False, False, {"error": f"Status {response.status}: {error_text}"}
                     
-                    if response.status == 200:
-                        try:
-                            result = await response.json()
-                            logger.info(f"✅ Payload enviado para n8n com sucesso: {payload.conversation_id}")
-                            logger.info(f"📨 Resposta do n8n: {result}")
-                            return result
-                        except Exception as json_error:
-                            logger.warning(f"⚠️ Erro ao parsear JSON da resposta: {json_error}")
-                            text_response = await response.text()
-                            logger.info(f"📄 Resposta em texto: {text_response}")
-                            return {"status": "success", "response_text": text_response}
-                    elif response.status == 404:
-                        logger.error(f"❌ n8n não encontrado (404) - verificar URL: {self.webhook_url}")
-                        return {"error": "n8n não encontrado - verificar URL"}
-                    elif response.status == 401:
-                        logger.error(f"❌ Erro de autenticação (401) - verificar API key")
-                        return {"error": "Erro de autenticação - verificar API key"}
-                    elif response.status == 500:
-                        logger.error(f"❌ Erro interno do n8n (500)")
-                        return {"error": "Erro interno do n8n"}
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"❌ Erro ao enviar para n8n: {response.status} - {error_text}")
-                        return {"error": f"Status {response.status}: {error_text}"}
-                        
         except asyncio.TimeoutError:
-            logger.error(f"⏰ Timeout ao conectar com n8n: {self.webhook_url}")
-            return {"error": "Timeout ao conectar com n8n"}
+            N8N_REQUESTS.inc(webhook=label, status="timeout")
+            logger.error(f"⏰ Timeout ao conectar com n8n: {url}")
+            return False, True, {"error": "Timeout ao conectar com n8n"}
         except aiohttp.ClientConnectorError as e:
+            N8N_REQUESTS.inc(webhook=label, status="connection")
             logger.error(f"🔌 Erro de conectividade com n8n: {e}")
-            return {"error": f"Erro de conectividade: {str(e)}"}
+            return False, True, {"error": f"Erro de conectividade: {str(e)}"}
         except aiohttp.ClientError as e:
+            N8N_REQUESTS.inc(webhook=label, status="client_error")
             logger.error(f"🌐 Erro de cliente HTTP com n8n: {e}")
-            return {"error": f"Erro HTTP: {str(e)}"}
+            return False, True, {"error": f"Erro HTTP: {str(e)}"}
         except Exception as e:
+            N8N_REQUESTS.inc(webhook=label, status="error")
             logger.error(f"❌ Erro inesperado ao enviar para n8n: {e}")
-            return {"error": str(e)}
+            return False, False, {"error": str(e)}
+    
+    def _idempotency_key(self, payload_dict: Dict[str, Any]) -> str:
+        """Chave estável do payload: tentativas e reenvios do spool usam a mesma"""
+        body = json.dumps(payload_dict, sort_keys=True, default=str)
+        return hashlib.sha256(body.encode("utf-8")).hexdigest()
+    
+    def _backoff_delay(self, attempt: int) -> float:
+        """Backoff exponencial com jitter completo"""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+    
+    def _breaker(self, url: str) -> CircuitBreaker:
+        breaker = self._breakers.get(url)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name=url,
+                failure_threshold=self.breaker_failure_threshold,
+                reset_timeout=self.breaker_reset_timeout
+            )
+            self._breakers[url] = breaker
+        return breaker
+    
+    # ==========================================
+    # SPOOL EM DISCO
+    # ==========================================
+    
+    async def start(self):
+        """Abre o spool e inicia o reenvio em background"""
+        self._spool = await asyncio.to_thread(N8nSpool, self.spool_path)
+        self._spool_depth = await asyncio.to_thread(self._spool.depth)
+        self._drain_wakeup = asyncio.Event()
+        self._drain_task = asyncio.create_task(self._drain_loop())
+        
+        pending = sum(self._spool_depth.values())
+        if pending:
+            logger.info(f"📦 {pending} payloads pendentes no spool do n8n")
+    
+    async def stop(self):
+        """Para o reenvio; payloads não entregues permanecem no spool"""
+        if self._drain_task:
+            self._drain_task.cancel()
+            try:
+                await self._drain_task
+            except asyncio.CancelledError:
+                pass
+            self._drain_task = None
+        
+        if self._spool:
+            await asyncio.to_thread(self._spool.close)
+            self._spool = None
+    
+    async def _spool_payload(self, url: str, idempotency_key: str, payload_dict: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        if self._spool is None:
+            logger.error(f"❌ n8n indisponível ({reason}) e spool não iniciado - payload descartado")
+            return {"error": f"n8n indisponível: {reason}"}
+        
+        spool_id = await asyncio.to_thread(self._spool.append, url, idempotency_key, payload_dict)
+        self._spool_depth[url] = self._spool_depth.get(url, 0) + 1
+        self.spooled += 1
+        self._drain_wakeup.set()
+        
+        logger.warning(f"📦 Payload guardado no spool ({reason}): {payload_dict.get('conversation_id')}")
+        return {"status": "queued", "spooled": True, "spool_id": spool_id, "reason": reason}
+    
+    async def _drain_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._drain_wakeup.wait(), timeout=self.spool_drain_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._drain_wakeup.clear()
+            
+            # Profundidade lida do disco: inclui payloads guardados por outros workers
+            try:
+                self._spool_depth = await asyncio.to_thread(self._spool.depth)
+            except Exception as e:
+                logger.error(f"Erro ao ler spool do n8n: {e}")
+                continue
+            
+            for url in [u for u, count in self._spool_depth.items() if count]:
+                try:
+                    await self._drain_url(url)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Erro ao drenar spool do n8n ({url}): {e}")
+    
+    async def _drain_url(self, url: str):
+        """Reenvia em ordem os payloads de uma URL enquanto o circuito permitir"""
+        breaker = self._breaker(url)
+        
+        while self._spool_depth.get(url):
+            entries = await asyncio.to_thread(self._spool.claim, url, 10, worker_id(), self.SPOOL_LEASE)
+            if not entries:
+                # Spool vazio ou drenado por outro worker
+                return
+            
+            for entry_id, idempotency_key, payload_dict in entries:
+                if not breaker.allow_request():
+                    return
+                
+                ok, retryable, result = await self._post_once(url, payload_dict, idempotency_key)
+                if retryable:
+                    breaker.record_failure(result.get("error"))
+                    await asyncio.to_thread(self._spool.mark_attempt, entry_id)
+                    return
+                
+                breaker.record_success()
+                if ok:
+                    self.drained += 1
+                else:
+                    # Erro definitivo (4xx): reenviar não resolve
+                    self.dropped += 1
+                    logger.error(f"❌ Payload do spool descartado ({result.get('error')}): {payload_dict.get('conversation_id')}")
+                
+                await asyncio.to_thread(self._spool.remove, entry_id)
+                self._spool_depth[url] = max(0, self._spool_depth.get(url, 0) - 1)
+        
+        logger.info(f"✅ Spool do n8n drenado: {url}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Estado dos circuitos e profundidade do spool"""
+        return {
+            "webhook_url": self.webhook_url,
+            "max_retries": self.max_retries,
+            "breakers": {url: breaker.stats() for url, breaker in self._breakers.items()},
+            "spool": {
+                "enabled": self._spool is not None,
+                "depth": sum(self._spool_depth.values()),
+                "depth_by_url": {url: count for url, count in self._spool_depth.items() if count},
+                "spooled": self.spooled,
+                "drained": self.drained,
+                "dropped": self.dropped
+            }
+        }
     
     async def test_connectivity(self) -> Dict[str, Any]:
         """Testa conectividade com o n8n"""
@@ -91,21 +344,20 @@ class N8nService:
                 headers["Authorization"] = f"Bearer {self.api_key}"
             
             # Use o timeout padrão para consistência
-            async with aiohttp.ClientSession(timeout=self.DEFAULT_TIMEOUT) as session:
-                async with session.get(self.webhook_url, headers=headers) as response:
-                    if response.status in [200, 404, 405]:  # 404/405 são normais para webhooks
-                        return {
-                            "status": "success", 
-                            "message": "n8n acessível",
-                            "response_status": response.status
-                        }
-                    else:
-                        return {
-                            "status": "warning",
-                            "message": f"n8n respondeu com status {response.status}",
-                            "response_status": response.status
-                        }
-                        
+            async with self.session.get(self.webhook_url, headers=headers, timeout=self.DEFAULT_TIMEOUT) as response:
+                if response.status in [200, 404, 405]:  # 404/405 são normais para webhooks
+                    return {
+                        "status": "success", 
+                        "message": "n8n acessível",
+                        "response_status": response.status
+                    }
+                else:
+                    return {
+                        "status": "warning",
+                        "message": f"n8n respondeu com status {response.status}",
+                        "response_status": response.status
+                    }
+                    
         except asyncio.TimeoutError:
             return {"status": "error", "message": "Timeout ao conectar com n8n"}
         except aiohttp.ClientConnectorError as e:
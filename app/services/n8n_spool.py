@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, List, Tuple
+
+class N8nSpool:
+    """
+    Fila em disco (SQLite) de payloads que não puderam ser entregues ao n8n
+
+    Vários workers podem compartilhar o arquivo: cada URL é drenada por um
+    único worker por vez (lease nas linhas reivindicadas), mantendo a ordem.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS n8n_spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                idempotency_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        # Spools criados antes do modo multi-worker não têm as colunas de lease
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(n8n_spool)")}
+        if "owner" not in columns:
+            self._conn.execute("ALTER TABLE n8n_spool ADD COLUMN owner TEXT")
+        if "lease_until" not in columns:
+            self._conn.execute("ALTER TABLE n8n_spool ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+    def append(self, url: str, idempotency_key: str, payload: Dict[str, Any]) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO n8n_spool (url, idempotency_key, payload, created_at) VALUES (?, ?, ?, ?)",
+                (url, idempotency_key, json.dumps(payload, default=str), time.time())
+            )
+            return cursor.lastrowid
+
+    def remove(self, entry_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM n8n_spool WHERE id = ?", (entry_id,))
+
+    def mark_attempt(self, entry_id: int):
+        with self._lock:
+            self._conn.execute("UPDATE n8n_spool SET attempts = attempts + 1 WHERE id = ?", (entry_id,))
+
+    def claim(self, url: str, limit: int, owner: str, lease: float) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Reivindica as entradas mais antigas de uma URL, na ordem de chegada
+        Retorna lista vazia se outro worker estiver drenando a mesma URL.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                busy = self._conn.execute(
+                    "SELECT 1 FROM n8n_spool WHERE url = ? AND owner IS NOT NULL AND owner != ? AND lease_until >= ? LIMIT 1",
+                    (url, owner, now)
+                ).fetchone()
+                rows = [] if busy else self._conn.execute(
+                    "SELECT id, idempotency_key, payload FROM n8n_spool WHERE url = ? ORDER BY id LIMIT ?",
+                    (url, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE n8n_spool SET owner = ?, lease_until = ? WHERE id = ?",
+                    [(owner, now + lease, entry_id) for entry_id, _, _ in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(entry_id, key, json.loads(payload)) for entry_id, key, payload in rows]
+
+    def depth(self) -> Dict[str, int]:
+        """Quantidade de payloads pendentes por URL"""
+        with self._lock:
+            rows = self._conn.execute("SELECT url, COUNT(*) FROM n8n_spool GROUP BY url").fetchall()
+        return {url: count for url, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from app.config import KommoSettings, Settings, get_settings
+from app.utils.singleflight import SingleFlight
+from app.utils.logger import setup_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+logger = setup_logger(__name__)
+
+# (método, url, **kwargs) -> (status, corpo); o KommoService passa o seu _request
+TokenRequest = Callable[..., Awaitable[Tuple[int, Any]]]
+
+class TokenManager:
+    """
+    Tokens OAuth do Kommo mantidos em memória
+
+    O access token é renovado em background `refresh_ahead` segundos antes
+    de `expires_at`. Renovações simultâneas (401 em várias requisições ao
+    mesmo tempo) compartilham uma única chamada ao Kommo. Os tokens são
+    gravados de forma atômica (arquivo temporário + rename) fora do event
+    loop; com vários workers, uma trava no arquivo garante que só um deles
+    use o refresh token (o Kommo invalida o anterior a cada renovação).
+    """
+
+    def __init__(
+        self,
+        request: TokenRequest,
+        path: Optional[str] = None,
+        refresh_ahead: Optional[float] = None,
+        retry_interval: float = 30.0,
+        settings: Optional[Settings] = None
+    ):
+        config = (settings or get_settings()).kommo
+        self._request = request
+        self.client_id = config.client_id
+        self.client_secret = config.client_secret
+        self.redirect_uri = config.redirect_uri
+        self.base_url = config.base_url
+        self.path = path or config.token_path
+        self.refresh_ahead = refresh_ahead or config.token_refresh_ahead
+        self.retry_interval = retry_interval
+
+        # Valores iniciais do ambiente; o arquivo (se existir) prevalece no start()
+        self.access_token: Optional[str] = config.access_token
+        self.refresh_token: Optional[str] = config.refresh_token
+        self.expires_at: Optional[float] = self._parse_expires_at(config.token_expires_at)
+
+        self._singleflight = SingleFlight()
+        self._refresher: Optional[asyncio.Task] = None
+        # Sinaliza tokens novos (exchange/refresh) para o loop reagendar a renovação
+        self._changed = asyncio.Event()
+
+        # Métricas expostas no /health
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @staticmethod
+    def _parse_expires_at(value: Optional[str]) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            logger.warning(f"KOMMO_TOKEN_EXPIRES_AT inválido: {value}")
+            return None
+
+    async def start(self):
+        """Carrega os tokens persistidos e inicia a renovação antecipada"""
+        saved = await asyncio.to_thread(self._read)
+        if saved:
+            self._apply(saved)
+            logger.info(f"Tokens do Kommo carregados de {self.path}")
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    @property
+    def token_expires_at(self) -> Optional[datetime]:
+        return datetime.fromtimestamp(self.expires_at) if self.expires_at is not None else None
+
+    def expires_in(self) -> Optional[float]:
+        """Segundos até o vencimento do access token (None se desconhecido)"""
+        return self.expires_at - time.time() if self.expires_at is not None else None
+
+    def is_expired(self) -> bool:
+        remaining = self.expires_in()
+        return remaining is not None and remaining <= 0
+
+    async def get_token(self) -> Optional[str]:
+        """Access token atual; só espera o Kommo se o token já tiver vencido"""
+        if self.is_expired() and self.refresh_token:
+            await self.refresh()
+        return self.access_token
+
+    async def invalidate(self, rejected_token: Optional[str]) -> bool:
+        """
+        Chamado após um 401: renova se o token rejeitado ainda é o atual
+
+        Se outra requisição já trocou o token, apenas sinaliza que vale
+        repetir a chamada com o novo.
+        """
+        if rejected_token != self.access_token:
+            return True
+        return await self.refresh()
+
+    async def refresh(self) -> bool:
+        """Renova o access token (chamadas simultâneas compartilham a mesma renovação)"""
+        return await self._singleflight.do("refresh", self._refresh)
+
+    async def _refresh(self) -> bool:
+        current = self.access_token
+        async with self._file_lock():
+            # Outro worker pode ter renovado enquanto esperávamos a trava
+            saved = await asyncio.to_thread(self._read)
+            if saved and saved.get("access_token") != current:
+                self._apply(saved)
+                if not self._due():
+                    return True
+
+            if not self.refresh_token:
+                self.last_error = "KOMMO_REFRESH_TOKEN não configurado"
+                logger.warning(self.last_error)
+                return False
+
+            logger.info("Renovando token do Kommo...")
+            return await self._refresh_locked(self.refresh_token)
+
+    async def refresh_with(self, refresh_token: str) -> bool:
+        """
+        Renova usando um refresh token informado pelo chamador (POST /oauth/refresh)
+
+        O estado atual só é trocado se o Kommo aceitar o token; chamadas
+        simultâneas com o mesmo token compartilham a renovação.
+        """
+        return await self._singleflight.do(("refresh", refresh_token), lambda: self._refresh_with(refresh_token))
+
+    async def _refresh_with(self, refresh_token: str) -> bool:
+        async with self._file_lock():
+            logger.info("Renovando token do Kommo com o refresh token informado...")
+            return await self._refresh_locked(refresh_token)
+
+    async def _refresh_locked(self, refresh_token: str) -> bool:
+        tokens = await self._token_request({
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token
+        })
+        if not tokens:
+            self.failures += 1
+            return False
+
+        await self._save_locked(tokens)
+        self.refreshes += 1
+        logger.info("Token renovado com sucesso!")
+        return True
+
+    async def exchange_code(self, code: str) -> Optional[Dict[str, Any]]:
+        """Troca o código de autorização do OAuth por tokens e os persiste"""
+        tokens = await self._token_request({"grant_type": "authorization_code", "code": code})
+        if tokens:
+            await self.save(tokens)
+        return tokens
+
+    async def _token_request(self, grant: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        data = {
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "redirect_uri": self.redirect_uri,
+            **grant
+        }
+        try:
+            status, result = await self._request("POST", f"{self.base_url}/oauth2/access_token", json=data, headers={})
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Erro ao obter token do Kommo: {e}")
+            return None
+
+        if status != 200 or not isinstance(result, dict) or not result.get("access_token"):
+            self.last_error = f"Status {status}: {result}"
+            logger.error(f"Erro ao obter token do Kommo: {status} - {result}")
+            return None
+
+        self.last_error = None
+        expires_in = result.get("expires_in", 86400)
+        return {
+            "access_token": result["access_token"],
+            "refresh_token": result.get("refresh_token") or grant.get("refresh_token") or self.refresh_token,
+            "expires_in": expires_in,
+            "expires_at": time.time() + float(expires_in)
+        }
+
+    async def adopt(self, config: KommoSettings) -> bool:
+        """Adota tokens rotacionados fora da aplicação (recarga da configuração)"""
+        tokens = {"access_token": config.access_token, "refresh_token": config.refresh_token}
+        if config.token_expires_at:
+            tokens["expires_at"] = config.token_expires_at
+        saved = await self.save(tokens)
+        logger.info("Tokens do Kommo recarregados da configuração")
+        return saved
+
+    async def save(self, tokens: Dict[str, Any]) -> bool:
+        """Adota e persiste tokens obtidos fora da renovação automática"""
+        async with self._file_lock():
+            return await self._save_locked(tokens)
+
+    async def _save_locked(self, tokens: Dict[str, Any]) -> bool:
+        if "expires_at" not in tokens and "expires_in" in tokens:
+            tokens = {**tokens, "expires_at": time.time() + float(tokens["expires_in"])}
+        self._apply(tokens)
+        try:
+            await asyncio.to_thread(self._write, {
+                "access_token": self.access_token,
+                "refresh_token": self.refresh_token,
+                "expires_at": self.expires_at
+            })
+            return True
+        except OSError as e:
+            # Tokens seguem válidos em memória; só não sobrevivem a um restart
+            logger.error(f"Erro ao gravar tokens em {self.path}: {e}")
+            return False
+
+    def _apply(self, tokens: Dict[str, Any]):
+        self.access_token = tokens.get("access_token") or self.access_token
+        self.refresh_token = tokens.get("refresh_token") or self.refresh_token
+        expires_at = tokens.get("expires_at")
+        self.expires_at = self._parse_expires_at(str(expires_at)) if expires_at is not None else self.expires_at
+        self._changed.set()
+
+    def _due(self) -> bool:
+        remaining = self.expires_in()
+        return remaining is not None and remaining <= self.refresh_ahead
+
+    async def _refresh_loop(self):
+        while True:
+            self._changed.clear()
+            remaining = self.expires_in()
+            if remaining is None or not self.refresh_token:
+                # Sem vencimento conhecido: renova nos 401 até chegarem tokens novos
+                await self._changed.wait()
+                continue
+            if remaining > self.refresh_ahead:
+                await self._wait_changed(remaining - self.refresh_ahead)
+                continue
+            try:
+                ok = await self.refresh()
+            except Exception as e:
+                ok = False
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error(f"Erro ao renovar token do Kommo: {e}")
+            if not ok:
+                await asyncio.sleep(self.retry_interval)
+
+    async def _wait_changed(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # ==========================================
+    # PERSISTÊNCIA
+    # ==========================================
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Erro ao ler tokens de {self.path}: {e}")
+            return None
+
+    def _write(self, data: Dict[str, Any]):
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".kommo_tokens.", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @asynccontextmanager
+    async def _file_lock(self):
+        """Trava exclusiva entre workers (arquivo .lock ao lado dos tokens)"""
+        if fcntl is None:
+            yield
+            return
+
+        def acquire():
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            handle = open(f"{self.path}.lock", "a")
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            return handle
+
+        handle = await asyncio.to_thread(acquire)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Vencimento do token e contadores de renovação"""
+        remaining = self.expires_in()
+        return {
+            "configured": bool(self.access_token),
+            "expires_at": self.token_expires_at.isoformat() if self.token_expires_at else None,
+            "expires_in_seconds": round(remaining, 1) if remaining is not None else None,
+            "refresh_ahead_seconds": self.refresh_ahead,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "persisted_to": self.path
+        }
@@ -0,0 +1,164 @@
+import time
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from app.config import Settings, get_settings
+from app.services.kommo_service import KommoService
+from app.services.conversation_store import ConversationStore
+from app.utils.singleflight import SingleFlight
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+class VendedoresCache:
+    """
+    Cache dos vendedores do Kommo com stale-while-revalidate
+
+    Sempre responde com o último snapshot válido; a atualização roda em
+    background antes do vencimento (`ttl - refresh_ahead`) e, se o Kommo
+    falhar, o snapshot anterior continua sendo servido. O snapshot é
+    persistido no ConversationStore para sobreviver a restarts.
+    """
+
+    SNAPSHOT_NAME = "vendedores"
+
+    def __init__(
+        self,
+        kommo: KommoService,
+        store: ConversationStore,
+        ttl: Optional[float] = None,
+        refresh_ahead: Optional[float] = None,
+        retry_interval: float = 30.0,
+        settings: Optional[Settings] = None
+    ):
+        config = (settings or get_settings()).store
+        self.kommo = kommo
+        self.store = store
+        self.ttl = ttl or config.vendedores_cache_ttl
+        # No máximo metade do TTL: com refresh_ahead >= ttl o loop renovaria sem pausa
+        self.refresh_ahead = min(refresh_ahead or config.vendedores_refresh_ahead, self.ttl / 2)
+        self.retry_interval = retry_interval
+
+        self._vendedores: Dict[str, Dict[str, Any]] = {}
+        self._updated_at: Optional[float] = None
+        self._singleflight = SingleFlight()
+        self._refresher: Optional[asyncio.Task] = None
+
+        # Métricas expostas no /health
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    async def start(self):
+        """Carrega o último snapshot persistido e inicia o refresher"""
+        snapshot = await self.store.load_snapshot(self.SNAPSHOT_NAME)
+        if snapshot:
+            self._vendedores, self._updated_at = snapshot
+            logger.info(f"Snapshot de vendedores carregado ({len(self._vendedores)} vendedores, {self.age():.0f}s)")
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    def age(self) -> Optional[float]:
+        """Idade do snapshot em segundos (None se ainda não houver)"""
+        return time.time() - self._updated_at if self._updated_at is not None else None
+
+    @property
+    def updated_at(self) -> Optional[datetime]:
+        return datetime.fromtimestamp(self._updated_at) if self._updated_at is not None else None
+
+    async def get(self) -> Dict[str, Dict[str, Any]]:
+        """Vendedores ativos; só espera o Kommo se ainda não houver nenhum snapshot"""
+        if self._updated_at is None:
+            await self.refresh()
+        elif self.age() >= self.ttl - self.refresh_ahead and (self._refresher is None or self._refresher.done()):
+            # Sem refresher rodando: dispara em background e responde com o snapshot atual
+            asyncio.ensure_future(self.refresh())
+        return self._vendedores
+
+    async def refresh(self) -> bool:
+        """Atualiza o snapshot (chamadas simultâneas compartilham a mesma busca)"""
+        return await self._singleflight.do("refresh", self._refresh)
+
+    async def _refresh(self) -> bool:
+        # Outro worker pode ter atualizado o snapshot compartilhado há pouco
+        snapshot = await self.store.load_snapshot(self.SNAPSHOT_NAME)
+        if snapshot and (self._updated_at is None or snapshot[1] > self._updated_at) and time.time() - snapshot[1] < self.ttl - self.refresh_ahead:
+            self._vendedores, self._updated_at = snapshot
+            return True
+        
+        started = time.perf_counter()
+        users = await self.kommo.get_users()
+        self.last_refresh_latency = time.perf_counter() - started
+
+        if users is None:
+            self.failures += 1
+            self.last_error = "Falha ao buscar /users no Kommo"
+            logger.warning(f"Atualização de vendedores falhou - mantendo snapshot anterior ({len(self._vendedores)} vendedores)")
+            return False
+
+        vendedores = self._build(users)
+        self._vendedores = vendedores
+        self._updated_at = time.time()
+        self.refreshes += 1
+        self.last_error = None
+        await self.store.save_snapshot(self.SNAPSHOT_NAME, vendedores)
+
+        logger.info(f"Encontrados {len(vendedores)} vendedores reais no Kommo")
+        logger.info("Cache de vendedores atualizado com dados reais")
+        return True
+
+    def _build(self, users: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        vendedores = {}
+        for user in users:
+            if user.get("rights", {}).get("is_active", False):
+                nome = user.get("name", "").strip()
+                if nome:
+                    vendedores[nome] = {
+                        "id": user.get("id"),
+                        "name": nome,
+                        "email": user.get("email", ""),
+                        "phone_api": f"{nome.lower().replace(' ', '_')}_whatsapp",
+                        "display_name": f"{nome} - Previdas",
+                        "area_atuacao": "nao_identificada"
+                    }
+        return vendedores
+
+    async def _refresh_loop(self):
+        while True:
+            age = self.age()
+            if age is None or age >= self.ttl - self.refresh_ahead:
+                try:
+                    ok = await self.refresh()
+                except Exception as e:
+                    ok = False
+                    self.failures += 1
+                    self.last_error = str(e)
+                    logger.error(f"Erro ao atualizar vendedores: {e}")
+                await asyncio.sleep(self.ttl - self.refresh_ahead if ok else self.retry_interval)
+            else:
+                await asyncio.sleep(self.ttl - self.refresh_ahead - age)
+
+    def stats(self) -> Dict[str, Any]:
+        """Idade do snapshot e latência da última atualização"""
+        age = self.age()
+        return {
+            "vendedores": len(self._vendedores),
+            "age_seconds": round(age, 3) if age is not None else None,
+            "stale": age is None or age >= self.ttl,
+            "ttl_seconds": self.ttl,
+            "refresh_ahead_seconds": self.refresh_ahead,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "last_refresh_latency_ms": round(self.last_refresh_latency * 1000, 1) if self.last_refresh_latency is not None else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "last_error": self.last_error
+        }
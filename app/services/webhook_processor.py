@@ -1,16 +1,47 @@
-from typing import Dict, Any
+import asyncio
+import logging
+import aiohttp
+from typing import Dict, Any, List, Optional
+from app.config import Settings, get_settings
 from app.services.kommo_service import KommoService
-from app.services.n8n_service import N8nService
-from app.models.kommo_models import N8nPayload, KommoWebhook, ConversationState
-from app.utils.logger import setup_logger
+from app.services.n8n_service import N8nService, DEFAULT_WEBHOOK_URL as DEFAULT_N8N_WEBHOOK_URL
+from app.services.conversation_store import ConversationStore
+from app.services.vendedores_cache import VendedoresCache
+from app.services.message_aggregator import MessageAggregator
+from app.services.api_stats import record_proactive_started, record_first_response
+from app.models.kommo_models import N8nPayload
+from app.utils.logger import setup_logger, payload_preview, sample_payload
+from app.utils.custom_fields import index_custom_fields
 from datetime import datetime
 
 logger = setup_logger(__name__)
 
+# Campos de telefone/WhatsApp (código PHONE ou nome), em ordem de preferência
+PHONE_FIELDS = ("PHONE", "whatsapp", "telefone", "celular")
+
 class WebhookProcessor:
-    def __init__(self):
-        self.kommo = KommoService()
-        self.n8n = N8nService()
+    def __init__(
+        self,
+        session: Optional[aiohttp.ClientSession] = None,
+        kommo: Optional[KommoService] = None,
+        n8n: Optional[N8nService] = None,
+        settings: Optional[Settings] = None,
+        store: Optional[ConversationStore] = None,
+        vendedores: Optional[VendedoresCache] = None
+    ):
+        settings = settings or get_settings()
+        self.kommo = kommo or KommoService(session=session, settings=settings)
+        self.n8n = n8n or N8nService(session=session, settings=settings)
+        # Contexto das conversas proativas (o mesmo store do KommoService)
+        self.store = store or self.kommo.store
+        self.vendedores = vendedores
+        
+        # Janela de agregação de mensagens consecutivas antes do n8n
+        self.aggregator = MessageAggregator(
+            flush=self._send_aggregated_to_n8n,
+            window=settings.n8n.aggregation_window,
+            max_wait=settings.n8n.aggregation_max_wait
+        )
         
         # Mapeamento vendedor -> configurações WhatsApp
         self.vendedor_config = {
@@ -28,15 +59,20 @@ class WebhookProcessor:
             }
         }
     
-    async def process_webhook(self, webhook_data: Dict[str, Any]):
-        """Processa webhook recebido do Kommo"""
+    async def process_webhook(self, webhook_data: Dict[str, Any]) -> Optional[asyncio.Future]:
+        """
+        Processa webhook recebido do Kommo
+
+        Quando a mensagem entra em um lote do agregador, retorna o future do
+        lote (resolvido após o envio ao n8n ou o spool); senão, None.
+        """
         try:
             logger.info("Iniciando processamento de webhook")
-            logger.info(f"Dados recebidos: {webhook_data}")
+            logger.debug("Dados recebidos: %s", payload_preview(webhook_data))
             
             # Verificar se é uma mensagem de chat
             if "chats" in webhook_data and "message" in webhook_data["chats"]:
-                await self._process_chat_message(webhook_data)
+                return await self._process_chat_message(webhook_data)
             elif "message" in webhook_data:
                 await self._process_direct_message(webhook_data)
             else:
@@ -45,25 +81,89 @@ class WebhookProcessor:
         except Exception as e:
             logger.error(f"Erro no processamento de webhook: {e}")
     
-    async def _process_chat_message(self, webhook_data: Dict[str, Any]):
+    async def process_kommo_event(self, webhook_data: Dict[str, Any]) -> Optional[asyncio.Future]:
+        """
+        Handler da fila do /webhooks/kommo: repassa a mensagem do contato ao n8n
+
+        Mesmo contrato do antigo handler inline do main.py: contexto da conversa
+        proativa vem do ConversationStore e o do vendedor do cache de vendedores,
+        sem filtro por área de atuação. Retorna o future do lote do agregador,
+        ou None quando o evento é ignorado.
+        """
+        if "chats" not in webhook_data or "message" not in webhook_data["chats"]:
+            logger.info("Webhook ignorado: não é mensagem de chat")
+            return None
+
+        message_data = webhook_data["chats"]["message"]
+        conversation_id = message_data.get("conversation_id") or webhook_data["chats"].get("conversation_id")
+        contact_id = message_data.get("contact_id")
+        message_text = message_data.get("text", "")
+        author_type = message_data.get("author", {}).get("type")
+
+        logger.info("Mensagem de contato %s: %s (autor: %s)", contact_id, payload_preview(message_text, 200), author_type)
+
+        # Processar apenas mensagens de contatos (não de agentes)
+        if author_type != "contact":
+            logger.info(f"Mensagem ignorada (autor: {author_type} - não é contato)")
+            return None
+
+        vendedores = await self._get_vendedores()
+        conversation_context = await self.store.get(contact_id) or {}
+        vendedor = conversation_context.get("vendedor", "default")
+        vendedor_config = vendedores.get(vendedor, {})
+
+        payload = {
+            "conversation_id": conversation_id,
+            "contact_id": contact_id,
+            "message_text": message_text,
+            "timestamp": datetime.now().isoformat(),
+            "chat_type": "whatsapp",
+            "lead_id": conversation_context.get("lead_id"),
+            "contact_name": conversation_context.get("lead_data", {}).get("name", ""),
+            "proactive_context": {
+                "initiated_by_bot": conversation_context.get("initiated_by_bot", False),
+                "trigger_source": conversation_context.get("trigger_type"),
+                "first_response": conversation_context.get("first_response_received", False),
+                "initiated_at": conversation_context.get("initiated_at")
+            },
+            "vendor_context": {
+                "responsible_user": vendedor,
+                "phone_api": vendedor_config.get("phone_api"),
+                "display_name": vendedor_config.get("display_name"),
+                "area_atuacao": conversation_context.get("area_atuacao")
+            },
+            # DADOS PARA SUPABASE/AGENDAMENTO
+            "supabase_context": {
+                "vendedor_for_scheduling": vendedor,
+                "agenda_table": f"agenda_{vendedor.lower()}" if vendedor else None,
+                "client_id": contact_id,
+                "lead_id": conversation_context.get("lead_id"),
+                "conversation_active": True,
+                "scheduling_enabled": True
+            }
+        }
+
+        # Agrupar com mensagens consecutivas da mesma conversa antes de enviar ao n8n
+        return await self.aggregator.add(f"contact:{contact_id}", payload)
+
+    async def _get_vendedores(self) -> Dict[str, Dict[str, Any]]:
+        """Último snapshot de vendedores ({} sem cache ou em caso de erro)"""
+        if self.vendedores is None:
+            return {}
+        try:
+            return await self.vendedores.get()
+        except Exception as e:
+            logger.error(f"Erro ao buscar vendedores: {e}")
+            return {}
+
+    async def _process_chat_message(self, webhook_data: Dict[str, Any]) -> Optional[asyncio.Future]:
         """Processa mensagem de chat"""
         try:
             chat_data = webhook_data["chats"]
             message_data = chat_data["message"]
             
             # Extrair informações da mensagem
-            conversation_id = (
-                chat_data.get("conversation_id") or 
-                message_data.get("conversation_id") or 
-                str(message_data.get("id", ""))
-            )
-            
-            # Buscar contact_id em múltiplos locais
-            contact_id = (
-                message_data.get("contact_id") or 
-                message_data.get("author", {}).get("contact_id") or 
-                message_data.get("author", {}).get("id", 0)
-            )
+            conversation_id, contact_id = self._extract_message_ids(chat_data, message_data)
             
             message_text = message_data.get("text", "")
             author_type = message_data.get("author", {}).get("type", "")
@@ -72,14 +172,13 @@ class WebhookProcessor:
             responsible_user = self._extract_responsible_user(webhook_data)
             
             # Log melhorado para debug
-            logger.info(f"Processando mensagem de chat:")
-            logger.info(f"    Conversation ID: '{conversation_id}'")
-            logger.info(f"    Contact ID: {contact_id}")
-            logger.info(f"    Mensagem: '{message_text}'")
-            logger.info(f"    Autor: {author_type}")
-            logger.info(f"    Vendedor responsável: {responsible_user}")
-            logger.info(f"    Dados brutos - chat: {chat_data}")
-            logger.info(f"    Dados brutos - message: {message_data}")
+            logger.info(
+                "Processando mensagem de chat: conversation_id=%s contact_id=%s autor=%s vendedor=%s mensagem=%s",
+                conversation_id, contact_id, author_type, responsible_user, payload_preview(message_text, 200)
+            )
+            # Dados brutos completos só em DEBUG e por amostragem
+            if logger.isEnabledFor(logging.DEBUG) and sample_payload():
+                logger.debug("Dados brutos - chat: %s", payload_preview(chat_data, 4000))
             
             # Verificar se a mensagem é do cliente (não do agente/sistema)
             if author_type == "contact":
@@ -91,6 +190,7 @@ class WebhookProcessor:
                 if conversation_state and conversation_state.get("initiated_by_bot") and not conversation_state.get("first_response_received"):
                     # Marcar que lead respondeu à abordagem proativa
                     await self.kommo.set_first_response_received(contact_id, True)
+                    record_first_response(conversation_state.get("lead_data", {}).get("responsible_user") or conversation_state.get("vendedor"))
                     logger.info(f"Lead {contact_id} respondeu à abordagem proativa!")
                     logger.info(f"Trigger original: {conversation_state.get('trigger_source', 'N/A')}")
                     logger.info(f"Vendedor: {conversation_state.get('responsible_user', 'N/A')}")
@@ -100,14 +200,29 @@ class WebhookProcessor:
                     await self._process_special_command(message_text, contact_id, responsible_user)
                     return
                 
-                # Verificar se o bot está ativo para este contato
-                if not await self.kommo.is_bot_active(contact_id):
+                # Lead já conhecido (conversa proativa ou entidade da mensagem): buscado em
+                # paralelo com o contato e cancelado se o bot estiver pausado
+                lead_id = self._known_lead_id(conversation_state, message_data)
+                lead_task = asyncio.ensure_future(self.kommo.get_lead(lead_id)) if lead_id else None
+                try:
+                    contact_info = await self._fetch_contact(contact_id)
+                    # Verificar se o bot está ativo para este contato (reaproveita o contato já buscado)
+                    bot_active = await self.kommo.is_bot_active(contact_id, contact=contact_info, fetch=False)
+                except BaseException:
+                    if lead_task is not None:
+                        lead_task.cancel()
+                    raise
+                if not bot_active:
+                    if lead_task is not None:
+                        lead_task.cancel()
                     logger.info(f"Bot pausado para contato {contact_id} - ignorando mensagem")
                     return
                 
-                # Buscar informações adicionais do contato
-                contact_info = await self.kommo.get_contact(contact_id) if contact_id > 0 else None
-                lead_info = await self.kommo.get_lead_by_contact(contact_id) if contact_id > 0 else None
+                if lead_task is not None:
+                    lead_info = await lead_task
+                else:
+                    # Lead pelo id embutido no contato (with=leads), sem buscar o contato de novo
+                    lead_info = await self.kommo.get_lead_by_contact(contact_id, contact=contact_info) if contact_info else None
                 
                 # Verificar área de atuação se disponível
                 area_atuacao = self._extract_area_atuacao(lead_info)
@@ -115,20 +230,8 @@ class WebhookProcessor:
                     logger.info(f"Área de atuação '{area_atuacao}' não elegível para bot - ignorando mensagem")
                     return
                 
-                # Extrair telefone do contato/lead
-                phone_number = None
-                if lead_info and lead_info.get("id"):
-                    phone_number = await self.kommo.extract_phone_from_lead(lead_info.get("id"))
-                elif contact_info:
-                    # Tentar extrair telefone do contato diretamente
-                    custom_fields = contact_info.get("custom_fields_values", [])
-                    for field in custom_fields:
-                        field_name = field.get("field_name", "").lower()
-                        if field_name in ["whatsapp", "telefone", "celular", "phone"]:
-                            values = field.get("values", [])
-                            if values:
-                                phone_number = values[0].get("value")
-                                break
+                # Extrair telefone dos dados já carregados (sem nova chamada)
+                phone_number = self._extract_phone(contact_info, lead_info)
                 
                 # Criar payload para n8n com informações de contexto proativo e vendedor
                 n8n_payload = N8nPayload(
@@ -143,7 +246,7 @@ class WebhookProcessor:
                 )
                 
                 # Adicionar contexto de conversa proativa e vendedor ao payload
-                n8n_payload_dict = n8n_payload.dict()
+                n8n_payload_dict = n8n_payload.model_dump()
                 
                 # Contexto proativo
                 if conversation_state:
@@ -154,7 +257,7 @@ class WebhookProcessor:
                         "initiated_at": conversation_state.get("initiated_at"),
                         "responsible_user": conversation_state.get("responsible_user")
                     }
-                    logger.info(f"Contexto proativo adicionado: {n8n_payload_dict['proactive_context']}")
+                    logger.debug("Contexto proativo adicionado: %s", payload_preview(n8n_payload_dict["proactive_context"]))
                 
                 # Contexto do vendedor
                 if responsible_user:
@@ -165,18 +268,12 @@ class WebhookProcessor:
                         "display_name": vendor_config.get("display_name"),
                         "area_atuacao": area_atuacao
                     }
-                    logger.info(f"Contexto vendedor adicionado: {n8n_payload_dict['vendor_context']}")
-                
-                logger.info(f"Enviando payload para n8n: {n8n_payload_dict}")
+                    logger.debug("Contexto vendedor adicionado: %s", payload_preview(n8n_payload_dict["vendor_context"]))
                 
-                # Enviar para n8n
-                result = await self.n8n.send_to_n8n_with_dict(n8n_payload_dict)
+                logger.debug("Enviando payload para n8n: %s", payload_preview(n8n_payload_dict))
                 
-                if "error" not in result:
-                    logger.info(f"Mensagem processada e enviada para n8n: {conversation_id}")
-                    logger.info(f"Resposta do n8n: {result}")
-                else:
-                    logger.error(f"Erro ao enviar para n8n: {result['error']}")
+                # Agrupar com mensagens consecutivas da mesma conversa antes de enviar ao n8n
+                return await self.aggregator.add(f"contact:{contact_id}", n8n_payload_dict)
             else:
                 logger.info(f"Mensagem ignorada (autor: {author_type} - não é contato)")
                 
@@ -185,6 +282,164 @@ class WebhookProcessor:
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
     
+    async def _send_aggregated_to_n8n(self, payloads: List[Dict[str, Any]]):
+        """Envia ao n8n um único payload com todas as mensagens agrupadas"""
+        n8n_payload_dict = self._merge_payloads(payloads)
+        conversation_id = n8n_payload_dict.get("conversation_id")
+        
+        result = await self.n8n.send_to_n8n_with_dict(
+            n8n_payload_dict,
+            url=self.n8n.webhook_url or DEFAULT_N8N_WEBHOOK_URL
+        )
+
+        if "error" not in result:
+            await self._mark_first_response(n8n_payload_dict.get("contact_id"))
+            logger.info("Mensagem processada e enviada para n8n: %s", conversation_id)
+            logger.debug("Resposta do n8n: %s", payload_preview(result))
+        else:
+            logger.error(f"Erro ao enviar para n8n: {result['error']}")
+
+    async def _mark_first_response(self, contact_id: Any):
+        """Após a entrega ao n8n: registra a primeira resposta à abordagem proativa"""
+        conversation_context = await self.store.get(contact_id)
+        if not conversation_context or conversation_context.get("first_response_received"):
+            return
+        if conversation_context.get("initiated_by_bot"):
+            record_first_response(conversation_context.get("vendedor"))
+        await self.store.update(contact_id, first_response_received=True)
+    
+    def _merge_payloads(self, payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Combina payloads consecutivos: contexto da última mensagem + lista de todas as mensagens"""
+        merged = dict(payloads[-1])
+        merged["messages"] = [
+            {"text": payload.get("message_text", ""), "timestamp": payload.get("timestamp")}
+            for payload in payloads
+        ]
+        merged["message_text"] = "\n".join(
+            payload.get("message_text", "") for payload in payloads if payload.get("message_text")
+        )
+        return merged
+    
+    def _extract_message_ids(self, chat_data: Dict[str, Any], message_data: Dict[str, Any]):
+        """Extrai conversation_id e contact_id da mensagem (buscando em múltiplos locais)"""
+        conversation_id = (
+            chat_data.get("conversation_id") or 
+            message_data.get("conversation_id") or 
+            str(message_data.get("id", ""))
+        )
+        
+        contact_id = (
+            message_data.get("contact_id") or 
+            message_data.get("author", {}).get("contact_id") or 
+            message_data.get("author", {}).get("id", 0)
+        )
+        
+        return conversation_id, contact_id
+    
+    def split_events(self, webhook_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Separa uma entrega do Kommo em um webhook por mensagem
+
+        O formulário do Kommo traz `message[add][N]` com várias mensagens por
+        entrega; cada uma vira um payload no formato `chats.message` esperado
+        por process_webhook (deduplicado e ordenado individualmente). Outros
+        formatos (JSON já normalizado, eventos de leads) seguem inalterados.
+        """
+        message_events = webhook_data.get("message")
+        added = message_events.get("add") if isinstance(message_events, dict) else None
+        if not isinstance(added, list):
+            return [webhook_data]
+
+        events = []
+        for message_data in added:
+            if not isinstance(message_data, dict):
+                continue
+            message_data = self._normalize_form_message(message_data)
+            event = {key: value for key, value in webhook_data.items() if key != "message"}
+            event["chats"] = {
+                "message": message_data,
+                "conversation_id": message_data.get("talk_id") or message_data.get("chat_id")
+            }
+            events.append(event)
+        return events
+
+    @staticmethod
+    def _normalize_form_message(message_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Ids numéricos do formulário (str) viram int; mensagem recebida é do contato"""
+        message = {}
+        for key, value in message_data.items():
+            if isinstance(value, str) and value.isdigit() and (key.endswith("_id") or key.endswith("_at")):
+                value = int(value)
+            message[key] = value
+
+        author = dict(message.get("author") or {})
+        # No formulário o cliente aparece como autor "external" em mensagens "incoming"
+        if message.get("type") == "incoming" and author.get("type") in (None, "", "external"):
+            author["type"] = "contact"
+        if isinstance(author.get("id"), str) and author["id"].isdigit():
+            author["id"] = int(author["id"])
+        message["author"] = author
+        return message
+
+    def conversation_key(self, webhook_data: Dict[str, Any]) -> Optional[str]:
+        """
+        Chave de ordenação do webhook: mensagens do mesmo contato (ou conversa)
+        são processadas em ordem. Retorna None para eventos sem conversa.
+        """
+        chat_data = webhook_data.get("chats")
+        if not isinstance(chat_data, dict) or not isinstance(chat_data.get("message"), dict):
+            return None
+        
+        conversation_id, contact_id = self._extract_message_ids(chat_data, chat_data["message"])
+        if contact_id:
+            return f"contact:{contact_id}"
+        if conversation_id:
+            return f"conversation:{conversation_id}"
+        return None
+    
+    def dedup_key(self, webhook_data: Dict[str, Any]) -> Optional[str]:
+        """
+        Chave de idempotência do webhook (conversation_id + id da mensagem)
+        Retorna None quando a mensagem não tem id (não é possível deduplicar).
+        """
+        chat_data = webhook_data.get("chats")
+        if not isinstance(chat_data, dict) or not isinstance(chat_data.get("message"), dict):
+            return None
+        
+        message_data = chat_data["message"]
+        message_id = message_data.get("id") or message_data.get("msgid")
+        if not message_id:
+            return None
+        
+        conversation_id, _ = self._extract_message_ids(chat_data, message_data)
+        return f"{conversation_id}:{message_id}"
+    
+    async def _fetch_contact(self, contact_id: int) -> Optional[Dict[str, Any]]:
+        """Busca o contato no Kommo (None para ids inválidos)"""
+        if not contact_id or contact_id <= 0:
+            return None
+        return await self.kommo.get_contact(contact_id)
+    
+    @staticmethod
+    def _known_lead_id(conversation_state: Dict[str, Any], message_data: Dict[str, Any]) -> Optional[int]:
+        """Lead conhecido antes de buscar o contato: conversa proativa ou entidade da mensagem"""
+        lead_id = (conversation_state or {}).get("lead_id")
+        if not lead_id and message_data.get("entity_type") == "lead":
+            lead_id = message_data.get("entity_id")
+        try:
+            return int(lead_id) if lead_id else None
+        except (TypeError, ValueError):
+            return None
+    
+    def _extract_phone(self, contact_info: Optional[Dict[str, Any]], lead_info: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Extrai telefone/WhatsApp do contato ou, em último caso, do lead"""
+        for entity, kind in ((contact_info, "contacts"), (lead_info, "leads")):
+            phone = index_custom_fields(entity, kind).value(*PHONE_FIELDS)
+            if phone:
+                return phone
+        
+        return None
+    
     def _extract_responsible_user(self, webhook_data: Dict[str, Any]) -> str:
         """Extrai informações do vendedor responsável do webhook"""
         # Tentar diferentes locais onde o vendedor pode estar
@@ -215,13 +470,7 @@ class WebhookProcessor:
             return "unknown"
         
         # Buscar em campos customizados
-        custom_fields = lead_info.get("custom_fields_values", [])
-        for field in custom_fields:
-            if field.get("field_name") == "area_atuacao" or field.get("field_code") == "area_atuacao":
-                value = field.get("values", [{}])[0].get("value", "")
-                return str(value).lower()
-        
-        return "unknown"
+        return index_custom_fields(lead_info, "leads").text("area_atuacao", default="unknown")
     
     def _should_activate_bot(self, area_atuacao: str) -> bool:
         """Verifica se deve ativar bot baseado na área de atuação"""
@@ -309,7 +558,7 @@ Funciona apenas para áreas: previdenciário, tributário, outros
             message_data = webhook_data["message"]
             
             logger.info("Mensagem direta recebida (implementar se necessário)")
-            logger.info(f"Dados da mensagem: {message_data}")
+            logger.debug("Dados da mensagem: %s", payload_preview(message_data))
             
         except Exception as e:
             logger.error(f"Erro ao processar mensagem direta: {e}")
@@ -355,6 +604,7 @@ Funciona apenas para áreas: previdenciário, tributário, outros
                     }
                 )
                 
+                record_proactive_started(responsible_user, trigger_type)
                 logger.info(f"Conversa proativa iniciada para contato {contact_id}")
                 return {
                     "status": "initiated",
@@ -0,0 +1,95 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+# Lista de chaves -> {chave: valor}; chaves ausentes do resultado resolvem como None
+BatchFn = Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+
+class BatchLoader:
+    """
+    Agrupa buscas por chave no estilo DataLoader
+
+    Chaves pedidas na mesma volta do event loop (ou dentro de `window`
+    segundos) são buscadas juntas em uma chamada de `batch_fn`, em lotes
+    de até `max_batch`. Pedidos repetidos da mesma chave no lote
+    compartilham o resultado; um erro do lote é repassado a todos os que
+    esperavam por ele.
+    """
+
+    def __init__(self, batch_fn: BatchFn, window: float = 0.0, max_batch: int = 250):
+        self._batch_fn = batch_fn
+        self.window = window
+        self.max_batch = max(1, max_batch)
+
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._scheduled: Optional[asyncio.Handle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Contadores expostos no /health
+        self.loads = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.keys = 0
+
+    async def load(self, key: Hashable) -> Any:
+        """Valor da chave, buscado junto com as demais chaves do lote"""
+        self.loads += 1
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._dispatch()
+            elif self._scheduled is None:
+                if self.window > 0:
+                    self._scheduled = loop.call_later(self.window, self._dispatch)
+                else:
+                    self._scheduled = loop.call_soon(self._dispatch)
+        else:
+            self.coalesced += 1
+
+        # shield: o cancelamento de um chamador não afeta os demais do lote
+        return await asyncio.shield(future)
+
+    def _dispatch(self):
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: Dict[Hashable, asyncio.Future]):
+        self.batches += 1
+        self.keys += len(batch)
+        try:
+            results = await self._batch_fn(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Evita aviso de "exception never retrieved" se todos os chamadores saíram
+                    future.exception()
+            return
+        except BaseException:
+            # Lote cancelado (shutdown) ou interrompido: ninguém fica esperando para sempre
+            for future in batch.values():
+                future.cancel()
+            raise
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do agrupamento"""
+        return {
+            "loads": self.loads,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "avg_batch_size": round(self.keys / self.batches, 2) if self.batches else 0.0,
+            "pending": len(self._pending)
+        }
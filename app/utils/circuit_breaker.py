@@ -0,0 +1,88 @@
+import time
+from typing import Any, Dict, Optional
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Circuito aberto - a chamada não foi tentada"""
+
+class CircuitBreaker:
+    """
+    Circuit breaker por destino
+
+    - closed: chamadas liberadas; `failure_threshold` falhas seguidas abrem o circuito.
+    - open: chamadas recusadas por `reset_timeout` segundos.
+    - half_open: uma chamada de teste; sucesso fecha, falha reabre.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        # Contadores expostos no status
+        self.successes = 0
+        self.failures_total = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = STATE_HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Indica se a chamada pode ser feita agora"""
+        state = self.state
+        if state == STATE_CLOSED:
+            return True
+        if state == STATE_HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.successes += 1
+        self._failures = 0
+        self._probe_in_flight = False
+        self._state = STATE_CLOSED
+
+    def record_failure(self, error: Optional[str] = None):
+        self.failures_total += 1
+        self._failures += 1
+        self._probe_in_flight = False
+        self.last_error = error
+
+        if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != STATE_OPEN:
+                self.times_opened += 1
+            self._state = STATE_OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado e contadores do circuito"""
+        state = self.state
+        retry_in = self.reset_timeout - (time.monotonic() - self._opened_at) if state == STATE_OPEN else 0.0
+        return {
+            "name": self.name,
+            "state": state,
+            "consecutive_failures": self._failures,
+            "failure_threshold": self.failure_threshold,
+            "retry_in_seconds": round(max(0.0, retry_in), 3),
+            "successes": self.successes,
+            "failures": self.failures_total,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+            "last_error": self.last_error
+        }
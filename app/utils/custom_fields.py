@@ -0,0 +1,96 @@
+import unicodedata
+from typing import Any, Dict, List, Optional
+from app.utils.cache import TTLCache
+
+def field_key(value: Any) -> str:
+    """Normaliza código/nome do campo: "Bot Ativo", "BOT_ATIVO" e "bot_ativo" viram "bot_ativo" """
+    text = str(value)
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return "_".join(text.lower().replace("-", " ").split())
+
+class CustomFieldIndex:
+    """
+    custom_fields_values de uma entidade do Kommo indexado em uma passada
+
+    Cada campo fica acessível pelo field_id (int) e pelo field_code e
+    field_name, sem distinguir maiúsculas. Quando código e nome de campos
+    diferentes colidem, vale o primeiro campo da lista, como na busca
+    linear que este índice substitui.
+    """
+
+    __slots__ = ("_fields",)
+
+    def __init__(self, custom_fields_values: Optional[List[Dict[str, Any]]]):
+        fields: Dict[Any, Dict[str, Any]] = {}
+        for field in custom_fields_values or []:
+            field_id = field.get("field_id")
+            if field_id is not None:
+                fields.setdefault(field_id, field)
+            for key in (field.get("field_code"), field.get("field_name")):
+                if key:
+                    fields.setdefault(key, field)
+                    fields.setdefault(key.lower(), field)
+        self._fields = fields
+
+    def get(self, *keys: Any) -> Optional[Dict[str, Any]]:
+        """Primeiro campo encontrado entre as chaves (id, código ou nome)"""
+        fields = self._fields
+        for key in keys:
+            field = fields.get(key)
+            if field is None and isinstance(key, str):
+                field = fields.get(key.lower())
+            if field is not None:
+                return field
+        return None
+
+    def values(self, *keys: Any) -> List[Dict[str, Any]]:
+        field = self.get(*keys)
+        return (field.get("values") or []) if field else []
+
+    def value(self, *keys: Any, default: Any = None) -> Any:
+        """Valor do primeiro item do campo (ignora campos vazios)"""
+        for key in keys:
+            values = self.values(key)
+            if values and values[0].get("value") not in (None, ""):
+                return values[0]["value"]
+        return default
+
+    def text(self, *keys: Any, default: str = "") -> str:
+        """Valor como texto minúsculo e sem espaços nas pontas"""
+        value = self.value(*keys)
+        return str(value).strip().lower() if value is not None else default
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len({id(field) for field in self._fields.values()})
+
+# Índices por (tipo, id, updated_at): a mesma versão da entidade é indexada uma vez
+_index_cache = TTLCache(maxsize=5000, ttl=3600.0, name="custom_field_index")
+
+def index_custom_fields(entity: Optional[Dict[str, Any]], kind: str) -> CustomFieldIndex:
+    """
+    Índice dos campos customizados de um lead/contato (`kind`: leads ou contacts)
+
+    Memoizado pelo id e updated_at da entidade; sem esses dados (payloads
+    de webhook, por exemplo) o índice é montado sem cache.
+    """
+    if not entity:
+        return CustomFieldIndex(None)
+
+    entity_id = entity.get("id")
+    updated_at = entity.get("updated_at")
+    if entity_id is None or updated_at is None:
+        return CustomFieldIndex(entity.get("custom_fields_values"))
+
+    key = (kind, entity_id, updated_at)
+    index = _index_cache.get(key)
+    if index is None:
+        index = CustomFieldIndex(entity.get("custom_fields_values"))
+        _index_cache.set(key, index)
+    return index
+
+def custom_field_index_stats() -> Dict[str, Any]:
+    return _index_cache.stats()
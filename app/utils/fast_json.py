@@ -0,0 +1,70 @@
+import json
+from typing import Any, Callable, Type, Union
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = setup_logger(__name__)
+
+_enabled = None
+
+def fast_json_enabled() -> bool:
+    """FAST_JSON ligado e orjson instalado (decidido uma vez por processo)"""
+    global _enabled
+
+    if _enabled is None:
+        configured = get_settings().fast_json
+        _enabled = configured and orjson is not None
+        if configured and orjson is None:
+            logger.warning("FAST_JSON=true mas orjson não está instalado - usando json da stdlib")
+    return _enabled
+
+def dumps(obj: Any) -> bytes:
+    """Serializa para bytes UTF-8 (corpo pronto para o aiohttp, sem passar pelo json=)"""
+    if fast_json_enabled():
+        # Chaves não-str (ex.: ids int) viram str, como no json da stdlib
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode("utf-8")
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Desserializa bytes ou str; erros são json.JSONDecodeError nos dois modos"""
+    if fast_json_enabled():
+        return orjson.loads(data)
+    return json.loads(data)
+
+def response_class() -> Type[Response]:
+    """Classe de resposta padrão da aplicação"""
+    if fast_json_enabled():
+        from fastapi.responses import ORJSONResponse
+        return ORJSONResponse
+    return JSONResponse
+
+def route_class() -> Type[APIRoute]:
+    """Classe de rota padrão (corpo JSON lido com orjson no modo rápido)"""
+    return FastJsonRoute if fast_json_enabled() else APIRoute
+
+class FastJsonRequest(Request):
+    """Request cujo corpo JSON é lido com orjson"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+class FastJsonRoute(APIRoute):
+    """Rota que entrega o FastJsonRequest ao FastAPI (parse do corpo dos endpoints)"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await handler(FastJsonRequest(request.scope, request.receive))
+
+        return route_handler
@@ -0,0 +1,105 @@
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import unquote_plus
+
+# Profundidade máxima de colchetes por chave (acima disso a chave fica literal)
+MAX_DEPTH = 16
+
+def decode_bracket_form(body: Union[bytes, str], max_depth: int = MAX_DEPTH) -> Dict[str, Any]:
+    """
+    Decodifica um corpo form-urlencoded com chaves em notação de colchetes
+
+    `message[add][0][text]=oi&message[add][0][author][type]=contact` vira
+    {"message": {"add": [{"text": "oi", "author": {"type": "contact"}}]}}.
+    Índices numéricos viram listas (ordenadas pelo índice) e `[]` acrescenta
+    um item. Valores são sempre str; só passam por unquote os pares com `%`
+    ou `+`. Um par que conflita com outro já lido (ex.: `a=1&a[b]=2`) é
+    ignorado, mantendo o primeiro.
+    """
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+
+    root: Dict[str, Any] = {}
+    # Prefixo do pai (ex.: "message[add][0]") -> dict já criado: as chaves
+    # irmãs não percorrem a árvore de novo
+    parents: Dict[str, Dict[str, Any]] = {}
+    nested = False
+    for pair in body.split("&"):
+        if not pair:
+            continue
+        key, _, value = pair.partition("=")
+        if "%" in key or "+" in key:
+            key = unquote_plus(key)
+        if "%" in value or "+" in value:
+            value = unquote_plus(value)
+
+        start = key.find("[")
+        if start <= 0 or key[-1] != "]":
+            # Chave simples (ou malformada, tratada como literal)
+            root.setdefault(key, value)
+            continue
+
+        split_at = key.rfind("[")
+        prefix = key[:split_at]
+        leaf = key[split_at + 1:-1]
+        node = parents.get(prefix)
+        if node is None:
+            inner = key[start + 1:-1]
+            segments = inner.split("][")
+            separators = len(segments) - 1
+            if (
+                separators >= max_depth
+                or inner.count("[") != separators
+                or inner.count("]") != separators
+            ):
+                root.setdefault(key, value)
+                continue
+            node = _walk(root, key[:start], segments[:-1])
+            if node is None:
+                continue
+            if "[]" not in prefix:
+                parents[prefix] = node
+
+        nested = True
+        if not leaf:
+            leaf = _next_index(node)
+        if leaf not in node:
+            node[leaf] = value
+
+    if nested:
+        for key, value in root.items():
+            if isinstance(value, dict):
+                root[key] = _listify(value)
+    return root
+
+def _walk(root: Dict[str, Any], name: str, segments: List[str]) -> Optional[Dict[str, Any]]:
+    """Desce (criando) até o dict pai da folha; None se cruzar um valor já lido"""
+    node = root
+    for segment in segments:
+        child = node.get(name)
+        if child is None:
+            child = node[name] = {}
+        elif not isinstance(child, dict):
+            return None
+        node = child
+        name = segment if segment else _next_index(node)
+    child = node.get(name)
+    if child is None:
+        child = node[name] = {}
+    elif not isinstance(child, dict):
+        return None
+    return child
+
+def _next_index(node: Dict[str, Any]) -> str:
+    index = len(node)
+    while str(index) in node:
+        index += 1
+    return str(index)
+
+def _listify(node: Dict[str, Any]) -> Any:
+    """Converte (recursivamente) dicts com chaves só numéricas em listas"""
+    for key, value in node.items():
+        if isinstance(value, dict):
+            node[key] = _listify(value)
+    if node and all(key.isdigit() for key in node):
+        return [node[key] for key in sorted(node, key=int)]
+    return node
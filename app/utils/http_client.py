@@ -0,0 +1,48 @@
+import aiohttp
+from typing import Optional
+from app.config import get_settings
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Sessão HTTP compartilhada por toda a aplicação (keep-alive + pool de conexões)
+_session: Optional[aiohttp.ClientSession] = None
+
+def create_http_session() -> aiohttp.ClientSession:
+    """Cria sessão aiohttp com pool limitado, keep-alive e cache de DNS"""
+    http = get_settings().http
+    connector = aiohttp.TCPConnector(
+        limit=http.pool_limit,
+        limit_per_host=http.pool_limit_per_host,
+        ttl_dns_cache=http.dns_cache_ttl,
+        keepalive_timeout=http.keepalive_timeout,
+        enable_cleanup_closed=True
+    )
+    timeout = aiohttp.ClientTimeout(total=30, connect=10)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+async def start_http_session() -> aiohttp.ClientSession:
+    """Abre a sessão compartilhada (chamado no startup da aplicação)"""
+    global _session
+
+    if _session is None or _session.closed:
+        _session = create_http_session()
+        logger.info("Sessão HTTP compartilhada iniciada")
+    return _session
+
+async def close_http_session():
+    """Fecha a sessão compartilhada (chamado no shutdown da aplicação)"""
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Sessão HTTP compartilhada encerrada")
+    _session = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Retorna a sessão compartilhada, criando-a sob demanda fora do lifespan (scripts)"""
+    global _session
+
+    if _session is None or _session.closed:
+        _session = create_http_session()
+    return _session
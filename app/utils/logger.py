@@ -1,24 +1,150 @@
+import json
+import atexit
 import logging
-import os
-from datetime import datetime
+import logging.handlers
+import queue
+import random
+import reprlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Optional
+from app.config import get_settings
+
+# Id de correlação da requisição/job atual (propagado entre tasks pelo contextvars)
+_correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def set_correlation_id(value: Optional[str]):
+    """Define o id de correlação do contexto atual; retorna o token para reset"""
+    return _correlation_id.set(value)
+
+def reset_correlation_id(token):
+    _correlation_id.reset(token)
+
+def get_correlation_id() -> Optional[str]:
+    return _correlation_id.get()
+
+class _CorrelationFilter(logging.Filter):
+    """Anota o registro com o id de correlação (no thread que gerou o log)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = _correlation_id.get()
+        return True
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que não formata a mensagem no event loop
+
+    O QueueHandler padrão monta msg % args antes de enfileirar; aqui só o
+    traceback é resolvido (depende do frame atual) e a formatação fica
+    para o thread do QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        correlation_id = getattr(record, "correlation_id", None)
+        if correlation_id:
+            entry["correlation_id"] = correlation_id
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Formato texto original, com o id de correlação quando houver"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        correlation_id = getattr(record, "correlation_id", None)
+        return f"[{correlation_id}] {message}" if correlation_id else message
+
+def _get_queue_handler() -> logging.handlers.QueueHandler:
+    """Handler compartilhado: o event loop só enfileira; um thread escreve no stream"""
+    global _queue_handler, _listener
+
+    if _queue_handler is None:
+        stream_handler = logging.StreamHandler()
+        if get_settings().log.format == "text":
+            stream_handler.setFormatter(TextFormatter())
+        else:
+            stream_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = _LazyQueueHandler(log_queue)
+        _queue_handler.addFilter(_CorrelationFilter())
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+    return _queue_handler
 
 def setup_logger(name: str) -> logging.Logger:
     """Configura logger para o módulo"""
     logger = logging.getLogger(name)
-    
+
     if not logger.handlers:
-        # Configurar formato
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        
-        # Handler para console
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-        
+        # Handler assíncrono (fila + thread de escrita)
+        logger.addHandler(_get_queue_handler())
+        # Sem propagar para o root: evita a mesma linha duas vezes (e escrita síncrona)
+        logger.propagate = False
+
         # Nível de log
-        log_level = os.getenv("LOG_LEVEL", "INFO")
-        logger.setLevel(getattr(logging, log_level.upper()))
-    
+        logger.setLevel(getattr(logging, get_settings().log.level))
+
     return logger
+
+# ==========================================
+# PAYLOADS: TRUNCAMENTO E AMOSTRAGEM
+# ==========================================
+
+class PayloadPreview:
+    """
+    Representação truncada de um payload, montada só quando o log é escrito
+
+    Uso: logger.debug("Payload: %s", PayloadPreview(payload))
+    """
+
+    __slots__ = ("payload", "max_chars")
+
+    def __init__(self, payload: Any, max_chars: Optional[int] = None):
+        self.payload = payload
+        self.max_chars = max_chars or get_settings().log.payload_max_chars
+
+    def __str__(self) -> str:
+        try:
+            text = json.dumps(self.payload, ensure_ascii=False, default=str)
+        except Exception:
+            # Payload alterado durante a serialização (outro thread) ou não serializável
+            text = reprlib.repr(self.payload)
+        if len(text) > self.max_chars:
+            return f"{text[:self.max_chars]}... (+{len(text) - self.max_chars} chars)"
+        return text
+
+def payload_preview(payload: Any, max_chars: Optional[int] = None) -> PayloadPreview:
+    """Payload truncado para logs (serialização adiada)"""
+    return PayloadPreview(payload, max_chars)
+
+def sample_payload(rate: Optional[float] = None) -> bool:
+    """Decide se este payload completo entra no log (LOG_PAYLOAD_SAMPLE_RATE, 0 a 1)"""
+    if rate is None:
+        rate = get_settings().log.payload_sample_rate
+    return rate >= 1 or random.random() < rate
@@ -0,0 +1,123 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+# Prioridades: menor valor é atendido primeiro
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+class TokenBucketLimiter:
+    """
+    Token bucket assíncrono com prioridades e controle adaptativo
+
+    - acquire(priority) espera um token; chamadas interativas passam na
+      frente das de background quando há fila.
+    - penalize(seconds) bloqueia o bucket (Retry-After) e reduz a taxa
+      pela metade; a taxa volta gradualmente ao valor configurado.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, min_rate: float = 1.0, recovery_seconds: float = 60.0):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.min_rate = min(min_rate, rate)
+        self.recovery_seconds = recovery_seconds
+
+        self._current_rate = rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+
+        self._waiters: List[Deque[asyncio.Future]] = [deque(), deque()]
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        # Contadores expostos no /health
+        self.acquired = 0
+        self.waited = 0
+        self.throttled = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        # Tempo bloqueado por Retry-After não gera tokens
+        unblocked = now - max(self._updated_at, self._blocked_until)
+        self._updated_at = now
+
+        # Recuperação aditiva da taxa após penalizações
+        if self._current_rate < self.rate:
+            step = (self.rate - self.min_rate) / self.recovery_seconds
+            self._current_rate = min(self.rate, self._current_rate + step * elapsed)
+
+        if unblocked > 0:
+            self._tokens = min(self.capacity, self._tokens + unblocked * self._current_rate)
+
+    def _has_waiters(self) -> bool:
+        return any(self._waiters)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE):
+        """Aguarda até um token estar disponível"""
+        self._refill()
+        if not self._has_waiters() and self._tokens >= 1 and time.monotonic() >= self._blocked_until:
+            self._tokens -= 1
+            self.acquired += 1
+            return
+
+        self.waited += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[min(priority, len(self._waiters) - 1)].append(future)
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        await future
+        self.acquired += 1
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for waiters in self._waiters:
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    return future
+        return None
+
+    async def _dispatch(self):
+        """Entrega tokens aos chamadores em espera, por prioridade"""
+        while self._has_waiters():
+            self._refill()
+            now = time.monotonic()
+
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._current_rate)
+                continue
+
+            future = self._next_waiter()
+            if future is not None:
+                self._tokens -= 1
+                future.set_result(None)
+
+    def penalize(self, retry_after: float):
+        """Pausa o bucket por retry_after segundos e reduz a taxa (resposta 429)"""
+        self._refill()
+        self.throttled += 1
+        self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+        self._tokens = 0
+        self._current_rate = max(self.min_rate, self._current_rate / 2)
+
+    def stats(self) -> Dict[str, Any]:
+        """Estatísticas do limitador"""
+        self._refill()
+        return {
+            "rate": self.rate,
+            "current_rate": round(self._current_rate, 3),
+            "tokens": round(self._tokens, 3),
+            "blocked_for_seconds": round(max(0.0, self._blocked_until - time.monotonic()), 3),
+            "waiting_interactive": len(self._waiters[PRIORITY_INTERACTIVE]),
+            "waiting_background": len(self._waiters[PRIORITY_BACKGROUND]),
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "throttled": self.throttled
+        }
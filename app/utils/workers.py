@@ -0,0 +1,18 @@
+import os
+import socket
+import uuid
+from app.config import get_settings
+
+# Identificador único deste processo (host:pid:sufixo) - dono de jobs/leases em SQLite
+_worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def worker_count() -> int:
+    """Quantidade de processos uvicorn servindo a aplicação (WEB_CONCURRENCY)"""
+    return get_settings().web_concurrency
+
+def is_multi_worker() -> bool:
+    return worker_count() > 1
+
+def worker_id() -> str:
+    """Identificador do processo atual"""
+    return _worker_id
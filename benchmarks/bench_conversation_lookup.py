@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Busca da conversa por conversation_id/lead_id: varredura linear x índice do store
+
+Compara a varredura de todas as conversas (como o /agendamento/request
+fazia) com find_by_conversation_id/find_by_lead_id do
+InMemoryConversationStore, e mede o custo extra das escritas que mantêm
+os índices.
+
+Uso:
+    python benchmarks/bench_conversation_lookup.py
+    python benchmarks/bench_conversation_lookup.py --sizes 10000 100000 --lookups 2000
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.conversation_store import InMemoryConversationStore
+
+def _state(contact_id: int) -> dict:
+    return {
+        "conversation_id": f"conv_{contact_id}_20250101_120000",
+        "lead_id": 10_000_000 + contact_id,
+        "vendedor": "Asaf",
+        "initiated_by_bot": True,
+        "first_response_received": False,
+    }
+
+def _linear_find(conversations: dict, conversation_id: str):
+    """Implementação anterior: percorre todas as conversas"""
+    for contact_id, conversation in conversations.items():
+        if conversation.get("conversation_id") == conversation_id:
+            return contact_id, conversation
+    return None
+
+async def run(size: int, lookups: int, scan_lookups: int):
+    rng = random.Random(size)
+    store = InMemoryConversationStore(ttl=3600.0)
+    plain = {}
+
+    started = time.perf_counter()
+    for contact_id in range(size):
+        plain[contact_id] = _state(contact_id)
+    plain_put = (time.perf_counter() - started) / size
+
+    started = time.perf_counter()
+    for contact_id in range(size):
+        await store.put(contact_id, _state(contact_id))
+    store_put = (time.perf_counter() - started) / size
+
+    targets = [rng.randrange(size) for _ in range(lookups)]
+    conversation_ids = [_state(contact_id)["conversation_id"] for contact_id in targets]
+    lead_ids = [_state(contact_id)["lead_id"] for contact_id in targets]
+
+    started = time.perf_counter()
+    for conversation_id in conversation_ids[:scan_lookups]:
+        assert _linear_find(plain, conversation_id) is not None
+    scan = (time.perf_counter() - started) / scan_lookups
+
+    started = time.perf_counter()
+    for conversation_id in conversation_ids:
+        assert await store.find_by_conversation_id(conversation_id) is not None
+    by_conversation = (time.perf_counter() - started) / lookups
+
+    started = time.perf_counter()
+    for lead_id in lead_ids:
+        assert await store.find_by_lead_id(lead_id) is not None
+    by_lead = (time.perf_counter() - started) / lookups
+
+    print(
+        f"{size:>9,} conversas | varredura {scan * 1e6:>10.1f} us | "
+        f"índice conversation_id {by_conversation * 1e6:5.2f} us, lead_id {by_lead * 1e6:5.2f} us | "
+        f"put {plain_put * 1e6:4.2f} -> {store_put * 1e6:4.2f} us"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=10_000, help="buscas pelo índice por tamanho")
+    parser.add_argument("--scan-lookups", type=int, default=50, help="buscas por varredura (lentas) por tamanho")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        asyncio.run(run(size, args.lookups, min(args.scan_lookups, args.lookups)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Leituras e escritas por segundo do ConversationStore com 100k conversas ativas
+
+Popula cada backend (memory, sqlite com write-behind e shared) com
+`--conversations` conversas e mede, em um diretório temporário:
+
+- get / find_by_lead_id: leituras por segundo
+- put / update: escritas por segundo no caminho do webhook; no sqlite,
+  mais o tempo para o lote pendente chegar ao disco (flush)
+
+Uso:
+    python benchmarks/bench_conversation_store.py
+    python benchmarks/bench_conversation_store.py --conversations 100000 --ops 20000 --backends memory sqlite
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.conversation_store import (
+    InMemoryConversationStore,
+    SqliteConversationStore,
+    SharedSqliteConversationStore
+)
+
+def _state(contact_id: int) -> dict:
+    return {
+        "conversation_id": f"conv_{contact_id}_20250101_120000",
+        "lead_id": 10_000_000 + contact_id,
+        "vendedor": "Asaf",
+        "area_atuacao": "previdenciario",
+        "trigger_type": "formulario_preenchido",
+        "initiated_by_bot": True,
+        "first_response_received": False,
+        "lead_data": {"name": f"Contato {contact_id}"},
+    }
+
+def _create(backend: str, directory: str):
+    path = os.path.join(directory, f"{backend}.db")
+    if backend == "memory":
+        return InMemoryConversationStore(ttl=None)
+    if backend == "sqlite":
+        return SqliteConversationStore(path=path, ttl=None)
+    return SharedSqliteConversationStore(path=path, ttl=None)
+
+async def _rate(ops: int, fn) -> float:
+    started = time.perf_counter()
+    for n in range(ops):
+        await fn(n)
+    return ops / (time.perf_counter() - started)
+
+async def run(backend: str, conversations: int, ops: int, directory: str):
+    rng = random.Random(42)
+    store = _create(backend, directory)
+    await store.start()
+    try:
+        started = time.perf_counter()
+        for contact_id in range(conversations):
+            await store.put(contact_id, _state(contact_id))
+        if isinstance(store, SqliteConversationStore):
+            await store._flush()
+        populate = time.perf_counter() - started
+
+        targets = [rng.randrange(conversations) for _ in range(ops)]
+        gets = await _rate(ops, lambda n: store.get(targets[n]))
+        finds = await _rate(ops, lambda n: store.find_by_lead_id(10_000_000 + targets[n]))
+        puts = await _rate(ops, lambda n: store.put(targets[n], _state(targets[n])))
+        updates = await _rate(ops, lambda n: store.update(targets[n], first_response_received=True))
+
+        flush = ""
+        if isinstance(store, SqliteConversationStore):
+            pending = len(store._pending)
+            started = time.perf_counter()
+            await store._flush()
+            flush = f" | flush de {pending:,} escritas pendentes {(time.perf_counter() - started) * 1000:6.1f} ms"
+    finally:
+        await store.stop()
+
+    print(
+        f"{backend:>6} | {conversations:,} conversas (carga {populate:5.1f} s) | "
+        f"get {gets:>9,.0f}/s | find_by_lead_id {finds:>9,.0f}/s | "
+        f"put {puts:>9,.0f}/s | update {updates:>9,.0f}/s{flush}"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=10_000, help="operações medidas de cada tipo")
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite", "shared"], choices=["memory", "sqlite", "shared"])
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            asyncio.run(run(backend, args.conversations, args.ops, directory))
+
+if __name__ == "__main__":
+    main()
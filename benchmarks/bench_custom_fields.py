@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Campos customizados: varreduras lineares x CustomFieldIndex
+
+Reproduz as quatro extrações feitas por webhook (area_atuacao, telefone
+do lead, bot_ativo e telefone de fallback) em entidades com 100+ campos:
+como antes (uma varredura de custom_fields_values por extração), com o
+índice montado a cada webhook (frio) e com o índice memoizado por id +
+updated_at (index_custom_fields).
+
+Uso:
+    python benchmarks/bench_custom_fields.py
+    python benchmarks/bench_custom_fields.py --fields 100 250 500
+"""
+
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.custom_fields import CustomFieldIndex, index_custom_fields
+
+PHONE_NAMES = ["whatsapp", "telefone", "celular", "phone"]
+
+def _lead(fields: int) -> dict:
+    # Campos usados pela integração no fim da lista (pior caso da varredura)
+    values = [
+        {"field_id": 1000 + i, "field_name": f"Campo Personalizado {i}", "field_code": None, "values": [{"value": f"v{i}"}]}
+        for i in range(fields)
+    ]
+    values += [
+        {"field_id": 7, "field_name": "Área de Atuação", "field_code": "area_atuacao", "values": [{"value": "Previdenciario"}]},
+        {"field_id": 8, "field_name": "Telefone", "field_code": "PHONE", "values": [{"value": "+55 11 99999-0000"}]},
+        {"field_id": 9, "field_name": "bot_ativo", "field_code": None, "values": [{"value": True}]},
+    ]
+    return {"id": 1, "updated_at": 1700000000, "custom_fields_values": values}
+
+def linear(lead: dict):
+    """Implementação anterior: uma varredura por extração"""
+    area = phone = bot_ativo = fallback_phone = None
+    for field in lead["custom_fields_values"]:
+        if field.get("field_name") == "area_atuacao" or field.get("field_code") == "area_atuacao":
+            area = str(field["values"][0]["value"]).lower()
+            break
+    for field in lead.get("custom_fields_values") or []:
+        if (field.get("field_code") or "").upper() == "PHONE" or (field.get("field_name") or "").lower() in PHONE_NAMES:
+            phone = field["values"][0]["value"]
+            break
+    for field in lead["custom_fields_values"]:
+        if field.get("field_name") == "bot_ativo" or field.get("field_code") == "bot_ativo":
+            bot_ativo = str(field["values"][0]["value"]).lower()
+            break
+    for field in lead["custom_fields_values"]:
+        if field.get("field_code") == "PHONE":
+            fallback_phone = field["values"][0]["value"]
+            break
+    return area, phone, bot_ativo, fallback_phone
+
+def _extract(index: CustomFieldIndex):
+    return (
+        index.text("area_atuacao"),
+        index.value("PHONE", "whatsapp", "telefone", "celular"),
+        index.text("bot_ativo"),
+        index.value("PHONE"),
+    )
+
+def cold(lead: dict):
+    """Índice montado a cada webhook (entidade sem id/updated_at)"""
+    return _extract(CustomFieldIndex(lead["custom_fields_values"]))
+
+def memoized(lead: dict):
+    """index_custom_fields: mesma versão da entidade indexada uma vez"""
+    return _extract(index_custom_fields(lead, "leads"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fields", type=int, nargs="+", default=[100, 250, 500])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    for fields in args.fields:
+        lead = _lead(fields)
+        assert linear(lead) == cold(lead) == memoized(lead)
+        results = {
+            fn.__name__: timeit.timeit(lambda: fn(lead), number=args.number) / args.number
+            for fn in (linear, cold, memoized)
+        }
+        base = results["linear"]
+        print(
+            f"{fields + 3:>4} campos | varreduras {base * 1e6:7.2f} us | "
+            f"índice frio {results['cold'] * 1e6:7.2f} us ({base / results['cold']:.1f}x) | "
+            f"memoizado {results['memoized'] * 1e6:5.2f} us ({base / results['memoized']:.1f}x)"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Enriquecimento da mensagem de chat: buscas sequenciais x lead em paralelo com o contato
+
+Sobe um Kommo de mentira local (aiohttp, com latência configurável por
+requisição) e mede o tempo de WebhookProcessor.process_webhook por
+mensagem em três cenários:
+
+- original: as 5 idas ao Kommo em série do código antigo (is_bot_active,
+  get_contact, get_lead_by_contact com o contato de novo e o lead)
+- sequencial: contato, checagem de pausa e só então o lead (id embutido no contato)
+- paralelo: lead já conhecido (conversa proativa) buscado junto com o contato
+
+Uso:
+    python benchmarks/bench_enrichment.py
+    python benchmarks/bench_enrichment.py --latency 0.08 --messages 100
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+from dataclasses import replace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from aiohttp import web
+
+from app.config import get_settings
+from app.services.conversation_store import InMemoryConversationStore
+from app.services.kommo_service import KommoService
+from app.services.webhook_processor import WebhookProcessor
+from app.utils.rate_limiter import TokenBucketLimiter
+
+LEAD_OFFSET = 1_000_000
+
+def _contact(contact_id: int) -> dict:
+    return {
+        "id": contact_id,
+        "name": f"Contato {contact_id}",
+        "updated_at": 1700000000,
+        "custom_fields_values": [{"field_code": "PHONE", "values": [{"value": f"+55119{contact_id:08d}"}]}],
+        "_embedded": {"leads": [{"id": LEAD_OFFSET + contact_id}]},
+    }
+
+def _lead(lead_id: int) -> dict:
+    return {
+        "id": lead_id,
+        "updated_at": 1700000000,
+        "custom_fields_values": [{"field_code": "area_atuacao", "values": [{"value": "Previdenciario"}]}],
+    }
+
+def _event(contact_id: int) -> dict:
+    return {"chats": {"conversation_id": f"conv-{contact_id}", "message": {
+        "id": f"m{contact_id}", "contact_id": contact_id, "text": "oi", "author": {"type": "contact"}
+    }}}
+
+async def _start_server(latency: float):
+    async def entities(request, embedded, build):
+        await asyncio.sleep(latency)
+        ids = [int(value) for value in request.query.getall("filter[id][]", [])]
+        return web.json_response({"_embedded": {embedded: [build(entity_id) for entity_id in ids]}})
+
+    app = web.Application()
+    app.router.add_get("/api/v4/contacts", lambda request: entities(request, "contacts", _contact))
+    app.router.add_get("/api/v4/leads", lambda request: entities(request, "leads", _lead))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+def _processor(session, port: int, store) -> WebhookProcessor:
+    settings = get_settings()
+    settings = replace(settings, kommo=replace(settings.kommo, response_cache_ttl=0.001))
+    kommo = KommoService(session=session, rate_limiter=TokenBucketLimiter(rate=10_000), store=store, settings=settings)
+    kommo.api_url = f"http://127.0.0.1:{port}/api/v4"
+
+    async def get_headers():
+        return {"Authorization": "Bearer bench"}
+
+    kommo.get_headers = get_headers
+    processor = WebhookProcessor(kommo=kommo, settings=settings, store=store)
+    processor.enriched = []
+
+    async def add(key, payload):
+        processor.enriched.append((payload["contact_id"], payload["lead_id"]))
+
+    processor.aggregator.add = add
+    return processor
+
+async def _original(processor: WebhookProcessor, contact_id: int):
+    """Fluxo antigo: cada etapa com o seu GET, uma depois da outra"""
+    kommo = processor.kommo
+    await kommo._load_contacts([contact_id])  # is_bot_active
+    await kommo._load_contacts([contact_id])  # get_contact
+    await kommo._load_contacts([contact_id])  # get_lead_by_contact: contato de novo
+    await kommo._load_leads([LEAD_OFFSET + contact_id])  # get_lead_by_contact: lead
+    await kommo._load_leads([LEAD_OFFSET + contact_id])  # extract_phone_from_lead
+
+async def run(latency: float, messages: int):
+    runner, port = await _start_server(latency)
+    results = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            for name in ("original", "sequencial", "paralelo"):
+                store = InMemoryConversationStore(ttl=3600.0)
+                processor = _processor(session, port, store)
+                timings = []
+                for n in range(messages):
+                    # Ids novos a cada mensagem: nada vem do cache de respostas
+                    contact_id = len(results) * messages + n + 1
+                    if name == "paralelo":
+                        await store.put(contact_id, {"conversation_id": f"conv-{contact_id}", "lead_id": LEAD_OFFSET + contact_id})
+                    started = time.perf_counter()
+                    if name == "original":
+                        await _original(processor, contact_id)
+                    else:
+                        await processor.process_webhook(_event(contact_id))
+                    timings.append(time.perf_counter() - started)
+                if name != "original":
+                    # Toda mensagem precisa chegar ao agregador com o lead certo
+                    assert all(lead_id == LEAD_OFFSET + contact_id for contact_id, lead_id in processor.enriched)
+                    assert len(processor.enriched) == messages, f"{name}: {len(processor.enriched)}/{messages} mensagens enriquecidas"
+                results[name] = timings
+    finally:
+        await runner.cleanup()
+
+    baseline = statistics.mean(results["original"])
+    print(f"latência do Kommo de mentira: {latency * 1000:.0f} ms por GET, {messages} mensagens por cenário")
+    for name, timings in results.items():
+        mean = statistics.mean(timings)
+        print(
+            f"{name:>10} | média {mean * 1000:7.1f} ms | p50 {statistics.median(timings) * 1000:7.1f} ms | "
+            f"max {max(timings) * 1000:7.1f} ms | {baseline / mean:4.1f}x"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.05, help="latência de cada GET no Kommo de mentira (s)")
+    parser.add_argument("--messages", type=int, default=50, help="mensagens por cenário")
+    args = parser.parse_args()
+
+    # Logs do serviço (INFO por chamada) fora da medição
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args.latency, args.messages))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+JSON da stdlib x orjson (FAST_JSON) nos payloads do Kommo/n8n
+
+Para cada tamanho de payload mede, nos dois modos de app.utils.fast_json:
+leitura do corpo do webhook (loads), serialização do payload para o n8n/
+Kommo (dumps) e renderização da resposta da API (JSONResponse x
+ORJSONResponse).
+
+Uso:
+    python benchmarks/bench_fast_json.py
+    python benchmarks/bench_fast_json.py --seconds 0.5
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from app.utils import fast_json
+
+def _message(n: int) -> dict:
+    return {
+        "id": f"b2c1f0e8-1f2a-4c1e-9a8e-3c1d2b4a5f{n:02d}", "chat_id": "7f6e5d4c", "talk_id": 12345 + n,
+        "contact_id": 987654, "created_at": 1757088751, "element_type": 2, "entity_type": "contact",
+        "element_id": 987654, "entity_id": 987654, "type": "incoming", "origin": "waba",
+        "text": "Olá, gostaria de saber mais sobre aposentadoria por invalidez " * 3,
+        "author": {"id": "a1", "type": "contact", "name": "Maria da Silva", "avatar_url": "https://x/y.png"},
+    }
+
+def _lead(fields: int) -> dict:
+    return {
+        "id": 1, "name": "Lead", "updated_at": 1757088751, "responsible_user_id": 123,
+        "custom_fields_values": [
+            {"field_id": 1137760 + i, "field_name": f"Campo {i}", "values": [{"value": "x" * 40, "enum_id": i}]}
+            for i in range(fields)
+        ],
+    }
+
+ACCOUNT = {"id": "34592139", "subdomain": "previdas", "_links": {"self": "https://previdas.kommo.com"}}
+
+PAYLOADS = {
+    "1 mensagem": {"account": ACCOUNT, "message": {"add": [_message(0)]}},
+    "10 mensagens + 5 leads": {"account": ACCOUNT, "leads": {"update": [_lead(40)] * 5}, "message": {"add": [_message(n) for n in range(10)]}},
+    "lead com 150 campos": {"account": ACCOUNT, "leads": {"update": [_lead(150)]}},
+}
+
+def per_call(fn, seconds: float) -> float:
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while True:
+        for _ in range(50):
+            fn()
+        count += 50
+        now = time.perf_counter()
+        if now >= deadline:
+            return (now - started) / count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=0.3, help="tempo de medição por caso")
+    args = parser.parse_args()
+
+    if fast_json.orjson is None:
+        sys.exit("orjson não instalado (pip install -r requirements.txt)")
+
+    for name, payload in PAYLOADS.items():
+        body = fast_json.dumps(payload)
+        rows = []
+        for enabled, response in ((False, JSONResponse), (True, ORJSONResponse)):
+            # Mesmo caminho do FAST_JSON=false/true, sem reiniciar o processo
+            fast_json._enabled = enabled
+            rows.append((
+                per_call(lambda: fast_json.loads(body), args.seconds),
+                per_call(lambda: fast_json.dumps(payload), args.seconds),
+                per_call(lambda: response(payload), args.seconds),
+            ))
+        (std_loads, std_dumps, std_response), (fast_loads, fast_dumps, fast_response) = rows
+        print(f"{name} ({len(body):,} bytes)")
+        for label, std, fast in (("loads", std_loads, fast_loads), ("dumps", std_dumps, fast_dumps), ("resposta", std_response, fast_response)):
+            print(f"  {label:<9} stdlib {std * 1e6:8.1f} us | orjson {fast * 1e6:7.1f} us | {std / fast:4.1f}x")
+
+if __name__ == "__main__":
+    main()
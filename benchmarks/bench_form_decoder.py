@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Decodificação de webhooks form-urlencoded: decode_bracket_form x parse_qsl ingênuo
+
+Monta entregas do Kommo como chegam em /webhooks/kommo
+(`message[add][0][text]=...&message[add][0][author][type]=...`), com 1 a
+50 mensagens, e compara:
+
+- ingênuo: `urllib.parse.parse_qsl` em todos os pares, regex para separar
+  os colchetes e inserção recursiva a partir da raiz para cada par, depois
+  conversão dos dicts de índices em listas
+- decode_bracket_form: uma passada, unquote só quando há `%`/`+` e o dict
+  pai memoizado por prefixo da chave
+
+Os dois resultados são conferidos antes de medir. Reporta tempo por
+entrega e entregas por segundo.
+
+Uso:
+    python benchmarks/bench_form_decoder.py
+    python benchmarks/bench_form_decoder.py --messages 1 10 50 200 --number 5000
+"""
+
+import os
+import re
+import sys
+import timeit
+import argparse
+from urllib.parse import parse_qsl, quote_plus
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.form_decoder import decode_bracket_form
+
+SEGMENT = re.compile(r"\[([^\[\]]*)\]")
+
+def _delivery(messages: int) -> bytes:
+    """Corpo no formato do Kommo: conta + N mensagens de chat"""
+    pairs = [
+        ("account[subdomain]", "escritorio"),
+        ("account[id]", "31234567"),
+        ("account[_links][self]", "https://escritorio.kommo.com"),
+    ]
+    for n in range(messages):
+        prefix = f"message[add][{n}]"
+        pairs += [
+            (f"{prefix}[id]", f"6f1c2a7e-{n:04d}-4b1e-9c1d-2f3a4b5c6d7e"),
+            (f"{prefix}[chat_id]", f"a1b2c3d4-{n:04d}-4e5f-8a9b-0c1d2e3f4a5b"),
+            (f"{prefix}[talk_id]", str(500 + n)),
+            (f"{prefix}[contact_id]", str(24000000 + n)),
+            (f"{prefix}[text]", f"Olá, gostaria de saber sobre a aposentadoria ({n})"),
+            (f"{prefix}[created_at]", str(1700000000 + n)),
+            (f"{prefix}[element_type]", "2"),
+            (f"{prefix}[entity_type]", "lead"),
+            (f"{prefix}[element_id]", str(18000000 + n)),
+            (f"{prefix}[entity_id]", str(18000000 + n)),
+            (f"{prefix}[type]", "incoming"),
+            (f"{prefix}[origin]", "waba"),
+            (f"{prefix}[author][id]", f"f0e1d2c3-{n:04d}-4a5b-8c7d-9e0f1a2b3c4d"),
+            (f"{prefix}[author][type]", "external"),
+            (f"{prefix}[author][name]", "Maria da Conceição"),
+            (f"{prefix}[author][avatar_url]", "https://amojo.kommo.com/attachments/profiles/avatar.jpg"),
+        ]
+    return "&".join(f"{quote_plus(key, safe='[]')}={quote_plus(value)}" for key, value in pairs).encode()
+
+def naive(body: bytes) -> dict:
+    """parse_qsl + inserção recursiva a partir da raiz para cada par"""
+    root = {}
+    for key, value in parse_qsl(body.decode("utf-8", errors="replace"), keep_blank_values=True):
+        start = key.find("[")
+        if start <= 0:
+            root.setdefault(key, value)
+            continue
+        _insert(root, [key[:start]] + SEGMENT.findall(key[start:]), value)
+    return {key: _listify(value) for key, value in root.items()}
+
+def _insert(node: dict, path: list, value: str):
+    head = path[0]
+    if len(path) == 1:
+        node.setdefault(head, value)
+        return
+    child = node.setdefault(head, {})
+    if isinstance(child, dict):
+        _insert(child, path[1:], value)
+
+def _listify(node):
+    if not isinstance(node, dict):
+        return node
+    node = {key: _listify(value) for key, value in node.items()}
+    if node and all(key.isdigit() for key in node):
+        return [node[key] for key in sorted(node, key=int)]
+    return node
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, nargs="+", default=[1, 2, 10, 50])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    for messages in args.messages:
+        body = _delivery(messages)
+        assert naive(body) == decode_bracket_form(body)
+        results = {
+            name: timeit.timeit(lambda: fn(body), number=args.number) / args.number
+            for name, fn in (("naive", naive), ("native", decode_bracket_form))
+        }
+        base = results["naive"]
+        print(
+            f"{messages:>4} mensagens ({len(body) / 1024:6.1f} KB) | "
+            f"ingênuo {base * 1e6:8.1f} us ({1 / base:8,.0f}/s) | "
+            f"decode_bracket_form {results['native'] * 1e6:8.1f} us ({1 / results['native']:8,.0f}/s) | "
+            f"{base / results['native']:.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
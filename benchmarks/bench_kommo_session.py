@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Vazão das chamadas ao Kommo: sessão compartilhada x ClientSession por chamada
+
+Sobe um Kommo de mentira local (aiohttp) e dispara GETs concorrentes de
+contatos de duas formas:
+
+- por chamada: `async with aiohttp.ClientSession()` a cada requisição, como
+  os métodos do KommoService faziam (nova conexão TCP por chamada)
+- compartilhada: a sessão da aplicação (create_http_session: pool limitado,
+  keep-alive e cache de DNS)
+
+Reporta requisições/s, latência e quantas conexões TCP o servidor recebeu.
+O servidor é HTTP puro em localhost: contra o Kommo real cada conexão nova
+também paga DNS e handshake TLS, então a diferença só aumenta.
+
+Uso:
+    python benchmarks/bench_kommo_session.py
+    python benchmarks/bench_kommo_session.py --requests 5000 --concurrency 50 --latency 0.005
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from aiohttp import web
+
+from app.utils.http_client import create_http_session
+
+async def _start_server(latency: float, peers: set):
+    async def contact(request):
+        # Porta de origem identifica a conexão TCP do cliente
+        peers.add(request.transport.get_extra_info("peername"))
+        if latency:
+            await asyncio.sleep(latency)
+        contact_id = int(request.match_info["contact_id"])
+        return web.json_response({"id": contact_id, "name": f"Contato {contact_id}", "updated_at": 1700000000})
+
+    app = web.Application()
+    app.router.add_get("/api/v4/contacts/{contact_id}", contact)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+async def _per_call(url: str):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers={"Authorization": "Bearer bench"}) as response:
+            return await response.json()
+
+def _shared(session: aiohttp.ClientSession):
+    async def get(url: str):
+        async with session.get(url, headers={"Authorization": "Bearer bench"}) as response:
+            return await response.json()
+    return get
+
+async def _measure(get, base_url: str, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(n: int):
+        async with semaphore:
+            started = time.perf_counter()
+            body = await get(f"{base_url}/contacts/{n}")
+            latencies.append(time.perf_counter() - started)
+            assert body["id"] == n
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(n) for n in range(requests)))
+    return time.perf_counter() - started, latencies
+
+async def run(requests: int, concurrency: int, latency: float):
+    peers = set()
+    runner, port = await _start_server(latency, peers)
+    base_url = f"http://127.0.0.1:{port}/api/v4"
+    try:
+        # Aquecimento (imports, primeiro accept)
+        await _per_call(f"{base_url}/contacts/0")
+
+        rows = []
+        peers.clear()
+        elapsed, latencies = await _measure(_per_call, base_url, requests, concurrency)
+        rows.append(("por chamada", elapsed, latencies, len(peers)))
+
+        session = create_http_session()
+        try:
+            peers.clear()
+            elapsed, latencies = await _measure(_shared(session), base_url, requests, concurrency)
+            rows.append(("compartilhada", elapsed, latencies, len(peers)))
+        finally:
+            await session.close()
+    finally:
+        await runner.cleanup()
+
+    print(f"{requests} GETs, {concurrency} concorrentes, latência do servidor {latency * 1000:.1f} ms")
+    baseline = rows[0][1]
+    for name, elapsed, latencies, connections in rows:
+        latencies.sort()
+        print(
+            f"{name:>13} | {requests / elapsed:8.0f} req/s | p50 {statistics.median(latencies) * 1000:6.2f} ms | "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.2f} ms | "
+            f"{connections:5d} conexões TCP | {baseline / elapsed:4.1f}x"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20, help="requisições simultâneas (<= HTTP_POOL_LIMIT_PER_HOST reaproveita o pool)")
+    parser.add_argument("--latency", type=float, default=0.0, help="latência do Kommo de mentira por requisição (s)")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.requests, args.concurrency, args.latency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tempo de event loop gasto com logs por webhook: pipeline antigo x fila
+
+Antigo: StreamHandler síncrono e f-strings com o payload inteiro em INFO
+(Dados recebidos, Dados brutos - chat, Enviando payload para n8n, Resposta
+do n8n). Novo: _LazyQueueHandler + QueueListener (JSON) com os payloads em
+DEBUG via payload_preview. Mede só o tempo no thread que chama o logger
+(o event loop); a escrita do pipeline novo acontece no thread do listener.
+
+Uso:
+    python benchmarks/bench_logging.py
+    python benchmarks/bench_logging.py --webhooks 5000 --messages 10
+"""
+
+import os
+import sys
+import time
+import queue
+import logging
+import logging.handlers
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.logger import _LazyQueueHandler, _CorrelationFilter, JsonFormatter, payload_preview, set_correlation_id
+
+def _webhook(messages: int) -> dict:
+    message = {
+        "id": "b2c1f0e8-1f2a-4c1e-9a8e-3c1d2b4a5f6e", "chat_id": "7f6e5d4c", "talk_id": 12345,
+        "contact_id": 987654, "created_at": 1757088751, "type": "incoming", "origin": "waba",
+        "text": "Olá, gostaria de saber mais sobre aposentadoria por invalidez " * 3,
+        "author": {"id": "a1", "type": "contact", "name": "Maria da Silva", "avatar_url": "https://x/y.png"},
+    }
+    return {"account": {"id": "34592139", "subdomain": "previdas"}, "chats": {"message": message, "history": [message] * messages}}
+
+def _old_logger(stream) -> logging.Logger:
+    logger = logging.getLogger("bench.old")
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    return logger
+
+def _new_logger(stream, level: int):
+    logger = logging.getLogger(f"bench.new.{level}")
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LazyQueueHandler(log_queue)
+    queue_handler.addFilter(_CorrelationFilter())
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger, listener
+
+def old_webhook(logger: logging.Logger, webhook: dict, result: dict):
+    chat = webhook["chats"]
+    logger.info(f"Dados recebidos: {webhook}")
+    logger.info(f"Dados brutos - chat: {chat}")
+    logger.info(f"Enviando payload para n8n: {chat['message']}")
+    logger.info(f"Resposta do n8n: {result}")
+
+def new_webhook(logger: logging.Logger, webhook: dict, result: dict):
+    chat = webhook["chats"]
+    logger.info("Iniciando processamento de webhook")
+    logger.debug("Dados recebidos: %s", payload_preview(webhook))
+    logger.info(
+        "Processando mensagem de chat: conversation_id=%s contact_id=%s mensagem=%s",
+        chat["message"]["talk_id"], chat["message"]["contact_id"], payload_preview(chat["message"]["text"], 200)
+    )
+    logger.debug("Enviando payload para n8n: %s", payload_preview(chat["message"]))
+    logger.info("Mensagem processada e enviada para n8n: %s", chat["message"]["talk_id"])
+    logger.debug("Resposta do n8n: %s", payload_preview(result))
+
+def measure(fn, logger, webhook, result, count: int) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        fn(logger, webhook, result)
+    return (time.perf_counter() - started) / count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--webhooks", type=int, default=3000)
+    parser.add_argument("--messages", type=int, default=5, help="mensagens de histórico no payload")
+    args = parser.parse_args()
+
+    webhook = _webhook(args.messages)
+    result = {"status": "ok", "echo": webhook["chats"]["message"]}
+    set_correlation_id("bench")
+
+    with tempfile.TemporaryFile("w") as stream:
+        old = measure(old_webhook, _old_logger(stream), webhook, result, args.webhooks)
+
+        rows = []
+        for label, level in (("fila, INFO", logging.INFO), ("fila, DEBUG", logging.DEBUG)):
+            logger, listener = _new_logger(stream, level)
+            elapsed = measure(new_webhook, logger, webhook, result, args.webhooks)
+            # Escrita do listener fora da medição: só o tempo do event loop conta
+            listener.stop()
+            rows.append((label, elapsed))
+
+    size = len(str(webhook))
+    print(f"payload ~{size:,} chars, {args.webhooks} webhooks")
+    print(f"  antigo (síncrono, f-string INFO): {old * 1e6:8.1f} us por webhook")
+    for label, elapsed in rows:
+        print(f"{f'  novo ({label}):':<35}{elapsed * 1e6:8.1f} us por webhook ({old / elapsed:.1f}x menos)")
+
+if __name__ == "__main__":
+    main()
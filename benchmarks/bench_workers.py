@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Teste de carga do modo multi-worker: vazão com WEB_CONCURRENCY=1, 2 e 4
+
+Para cada quantidade de workers sobe `uvicorn app.main:app --workers N`
+com o backend "shared" (estado de conversas, pausas, dedup, journal e
+spool em SQLite num diretório temporário) e dispara requisições
+concorrentes por `--duration` segundos:
+
+- POST /webhooks/kommo com mensagens novas (dedup + journal + fila; o
+  processamento envia ao n8n de mentira)
+- POST /bot/pause/{id} e /bot/resume/{id} (escritas no store compartilhado)
+
+Kommo e n8n são servidores de mentira locais. Reporta requisições/s,
+latência e erros. A vazão só escala até o número de CPUs da máquina (o
+próprio gerador de carga também usa uma).
+
+Uso:
+    python benchmarks/bench_workers.py
+    python benchmarks/bench_workers.py --workers 1 2 4 8 --duration 20 --concurrency 64
+"""
+
+import os
+import sys
+import time
+import json
+import signal
+import socket
+import asyncio
+import argparse
+import itertools
+import tempfile
+import statistics
+import subprocess
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _start_upstreams():
+    """Kommo (usuários e campos customizados) e n8n de mentira, respondendo na hora"""
+    async def users(request):
+        return web.json_response({"_embedded": {"users": [{"id": 1, "name": "Asaf"}]}})
+
+    async def custom_fields(request):
+        return web.json_response({"_embedded": {"custom_fields": []}})
+
+    async def n8n(request):
+        await request.read()
+        return web.json_response({"status": "ok"})
+
+    app = web.Application()
+    app.router.add_get("/api/v4/users", users)
+    app.router.add_get("/api/v4/{entity}/custom_fields", custom_fields)
+    app.router.add_post("/webhook/serena", n8n)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+def _env(directory: str, workers: int, upstream: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "ENVIRONMENT": "production",
+        "WEB_CONCURRENCY": str(workers),
+        "LOG_LEVEL": "WARNING",
+        "CONVERSATION_STORE_BACKEND": "shared",
+        "CONVERSATION_STORE_PATH": os.path.join(directory, "conversations.db"),
+        "WEBHOOK_JOURNAL_PATH": os.path.join(directory, "webhook_jobs.db"),
+        "WEBHOOK_DEDUP_PATH": os.path.join(directory, "webhook_dedup.db"),
+        "N8N_SPOOL_PATH": os.path.join(directory, "n8n_spool.db"),
+        "KOMMO_TOKEN_PATH": os.path.join(directory, "kommo_tokens.json"),
+        "KOMMO_API_URL": f"{upstream}/api/v4",
+        "KOMMO_ACCESS_TOKEN": "bench",
+        "N8N_WEBHOOK_URL": f"{upstream}/webhook/serena",
+        "N8N_AGGREGATION_WINDOW": "0",
+    })
+    return env
+
+async def _wait_ready(session: aiohttp.ClientSession, base_url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn saiu com código {process.returncode}")
+        try:
+            async with session.get(f"{base_url}/webhooks/test") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("uvicorn não respondeu a tempo")
+
+def _webhook(message_id: str, contact_id: int) -> str:
+    return json.dumps({"chats": {"conversation_id": f"conv-{contact_id}", "message": {
+        "id": message_id, "contact_id": contact_id, "text": "oi", "author": {"type": "contact"}
+    }}})
+
+def _requests(run_id: int):
+    """Sequência infinita de requisições: 2 webhooks para cada pausa/retomada"""
+    for n in itertools.count():
+        contact_id = n % 1000 + 1
+        yield "POST", "/webhooks/kommo", _webhook(f"{run_id}-{n}-a", contact_id)
+        yield "POST", "/webhooks/kommo", _webhook(f"{run_id}-{n}-b", contact_id)
+        yield "POST", f"/bot/{'pause' if n % 2 else 'resume'}/{contact_id}", None
+
+async def _load(session: aiohttp.ClientSession, base_url: str, duration: float, concurrency: int, run_id: int):
+    requests = _requests(run_id)
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async def client():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            method, path, body = next(requests)
+            started = time.perf_counter()
+            try:
+                async with session.request(method, f"{base_url}{path}", data=body,
+                                           headers={"Content-Type": "application/json"}) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return time.perf_counter() - started, latencies, errors
+
+async def run(worker_counts, duration: float, concurrency: int):
+    upstream_runner, upstream_port = await _start_upstreams()
+    upstream = f"http://127.0.0.1:{upstream_port}"
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    rows = []
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            for run_id, workers in enumerate(worker_counts):
+                with tempfile.TemporaryDirectory() as directory:
+                    port = _free_port()
+                    base_url = f"http://127.0.0.1:{port}"
+                    process = subprocess.Popen(
+                        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+                         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+                        cwd=ROOT, env=_env(directory, workers, upstream)
+                    )
+                    try:
+                        await _wait_ready(session, base_url, process)
+                        # Aquecimento: todos os workers com o container iniciado
+                        await _load(session, base_url, 1.0, concurrency, run_id * 2)
+                        elapsed, latencies, errors = await _load(session, base_url, duration, concurrency, run_id * 2 + 1)
+                    finally:
+                        process.send_signal(signal.SIGTERM)
+                        try:
+                            process.wait(timeout=30)
+                        except subprocess.TimeoutExpired:
+                            process.kill()
+                    rows.append((workers, len(latencies) / elapsed, latencies, errors))
+    finally:
+        await upstream_runner.cleanup()
+
+    print(f"{duration:.0f} s por rodada, {concurrency} conexões, {os.cpu_count()} CPUs, backend shared")
+    baseline = rows[0][1]
+    for workers, rps, latencies, errors in rows:
+        latencies.sort()
+        print(
+            f"WEB_CONCURRENCY={workers} | {rps:8.0f} req/s | p50 {statistics.median(latencies) * 1000:6.1f} ms | "
+            f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.1f} ms | erros {errors:5d} | {rps / baseline:4.1f}x"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0, help="segundos de carga por rodada")
+    parser.add_argument("--concurrency", type=int, default=32, help="requisições simultâneas")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.workers, args.duration, args.concurrency))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Aquece ou inspeciona o esquema de campos customizados do Kommo
+
+Uso:
+    python kommo_custom_fields.py warm                  # busca no Kommo e persiste no store
+    python kommo_custom_fields.py show [leads|contacts] # lista os campos conhecidos
+    python kommo_custom_fields.py resolve leads bot_ativo [valor]
+
+O esquema fica no mesmo ConversationStore da aplicação (CONVERSATION_STORE_*),
+então um `warm` antes do deploy deixa o serviço subir já com os field_ids.
+"""
+
+import sys
+import json
+import asyncio
+import argparse
+from app.services.kommo_service import KommoService
+from app.services.conversation_store import create_conversation_store
+from app.services.custom_field_schema import CustomFieldSchema, ENTITIES
+from app.utils.http_client import close_http_session
+
+async def run(args) -> int:
+    store = create_conversation_store()
+    kommo = KommoService(store=store)
+    schema = CustomFieldSchema(kommo=kommo, store=store)
+
+    await store.start()
+    await kommo.tokens.start()
+    try:
+        loaded = await schema.load()
+        if args.command == "warm" or args.refresh or not loaded:
+            if not await schema.refresh():
+                print(f"❌ Falha ao buscar campos no Kommo: {schema.last_error}")
+                return 1
+            if args.command == "warm":
+                print(f"✅ Esquema atualizado: {schema.stats()['fields']}")
+                return 0
+
+        if args.command == "show":
+            entities = [args.entity] if args.entity else ENTITIES
+            for entity in entities:
+                print(f"\n📋 {entity} ({len(schema.fields(entity))} campos, {schema.age():.0f}s)")
+                for field in schema.fields(entity):
+                    print(f"   {field['id']:>10}  {field['type'] or '-':<14} {field['code'] or '-':<20} {field['name']}")
+            return 0
+
+        field = schema.resolve(args.entity, args.key)
+        if field is None:
+            print(f"❌ Campo '{args.key}' não encontrado em {args.entity}")
+            return 1
+        print(json.dumps(field, ensure_ascii=False, indent=2))
+        if args.value is not None:
+            print(json.dumps(schema.field_value(args.entity, args.key, args.value), ensure_ascii=False))
+        return 0
+    finally:
+        await kommo.tokens.stop()
+        await store.stop()
+        await close_http_session()
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Esquema de campos customizados do Kommo")
+    parser.add_argument("--refresh", action="store_true", help="busca no Kommo mesmo com esquema persistido")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("warm", help="busca os campos no Kommo e persiste o esquema")
+
+    show = commands.add_parser("show", help="lista os campos conhecidos")
+    show.add_argument("entity", nargs="?", choices=ENTITIES)
+
+    resolve = commands.add_parser("resolve", help="mostra field_id/tipo de um campo (e o valor formatado)")
+    resolve.add_argument("entity", choices=ENTITIES)
+    resolve.add_argument("key", help="código, nome ou id do campo")
+    resolve.add_argument("value", nargs="?", help="valor a formatar para escrita")
+
+    return asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    sys.exit(main())
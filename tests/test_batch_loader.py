@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from app.utils.batch_loader import BatchLoader
+
+def test_concurrent_loads_share_one_batch():
+    calls = []
+
+    async def batch_fn(keys):
+        calls.append(sorted(keys))
+        return {key: key * 10 for key in keys if key != 3}
+
+    async def scenario():
+        loader = BatchLoader(batch_fn)
+        return await asyncio.gather(*(loader.load(key) for key in (1, 2, 2, 3))), loader.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [10, 20, 20, None]
+    assert calls == [[1, 2, 3]]
+    assert (stats["batches"], stats["coalesced"]) == (1, 1)
+
+def test_batch_error_reaches_every_waiter():
+    async def batch_fn(keys):
+        raise RuntimeError("kommo fora")
+
+    async def scenario():
+        loader = BatchLoader(batch_fn)
+        return await asyncio.gather(loader.load(1), loader.load(2), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results] == ["kommo fora", "kommo fora"]
+
+def test_cancelled_batch_releases_waiters():
+    started = None
+
+    async def batch_fn(keys):
+        started.set()
+        await asyncio.sleep(10)
+
+    async def scenario():
+        nonlocal started
+        started = asyncio.Event()
+        loader = BatchLoader(batch_fn)
+        waiters = [asyncio.ensure_future(loader.load(key)) for key in (1, 2)]
+        await started.wait()
+        for task in list(loader._tasks):
+            task.cancel()
+        return await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), timeout=1.0)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+
+def test_cancelled_caller_does_not_cancel_the_batch():
+    async def batch_fn(keys):
+        await asyncio.sleep(0.01)
+        return {key: key for key in keys}
+
+    async def scenario():
+        loader = BatchLoader(batch_fn)
+        first = asyncio.ensure_future(loader.load(1))
+        second = asyncio.ensure_future(loader.load(1))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,46 @@
+import asyncio
+from app.services.kommo_service import KommoService
+from app.services.conversation_store import InMemoryConversationStore
+
+def _contact(bot_ativo):
+    return {"id": 5, "custom_fields_values": [{"field_code": "bot_ativo", "values": [{"value": bot_ativo}]}]}
+
+def _service(store, lead=None):
+    service = KommoService(store=store)
+
+    async def get_lead_by_contact(contact_id):
+        return lead
+
+    service.get_lead_by_contact = get_lead_by_contact
+    return service
+
+def test_pause_is_shared_through_the_store():
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        # Dois workers com o mesmo store
+        first, second = _service(store), _service(store)
+
+        assert await second.is_bot_active(5, contact=_contact("true"), fetch=False)
+        assert await first.pause_bot(5)
+        assert not await second.is_bot_active(5, contact=_contact("true"), fetch=False)
+        assert await store.paused_contacts() == [5]
+
+        assert await second.resume_bot(5)
+        assert await first.is_bot_active(5, contact=_contact("false"), fetch=False)
+        assert await store.paused_contacts() == []
+
+    asyncio.run(scenario())
+
+def test_manual_pause_from_bot_control_is_honored():
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        service = _service(store)
+        await store.set_bot_status(5, {"status": "paused", "paused_by": "manual_control"})
+        assert not await service.is_bot_active(5, contact=_contact("true"), fetch=False)
+
+        # Sem registro no store vale o campo bot_ativo do contato
+        await store.clear_bot_status(5)
+        assert not await service.is_bot_active(5, contact=_contact("false"), fetch=False)
+        assert await service.is_bot_active(5, contact=_contact("sim"), fetch=False)
+
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import os
+import pytest
+import dotenv
+from app import config
+from app.config import Settings, SettingsError, reload_settings
+
+@pytest.fixture
+def dotenv_file(tmp_path, monkeypatch):
+    """Aponta o .env da aplicação para um arquivo temporário e zera o snapshot"""
+    path = tmp_path / ".env"
+    path.write_text("")
+    monkeypatch.setattr(config, "dotenv_values", lambda: dotenv.dotenv_values(str(path)))
+    monkeypatch.setattr(config, "_settings", None)
+    monkeypatch.setattr(config, "_reload_listeners", [])
+    for name in ("KOMMO_ACCESS_TOKEN", "KOMMO_REFRESH_TOKEN", "LOG_LEVEL", "WEB_CONCURRENCY"):
+        monkeypatch.delenv(name, raising=False)
+    return path
+
+def test_reload_reads_rotated_tokens_without_touching_os_environ(dotenv_file):
+    dotenv_file.write_text("KOMMO_ACCESS_TOKEN=antigo\nKOMMO_REFRESH_TOKEN=r1\n")
+    assert config.get_settings().kommo.access_token == "antigo"
+
+    dotenv_file.write_text("KOMMO_ACCESS_TOKEN=novo\nKOMMO_REFRESH_TOKEN=r2\n")
+    seen = []
+    config.add_reload_listener(lambda previous, settings: seen.append((previous.kommo.access_token, settings.kommo.access_token)))
+    settings = reload_settings()
+
+    assert settings.kommo.refresh_token == "r2"
+    assert config.get_settings() is settings
+    assert seen == [("antigo", "novo")]
+    assert "KOMMO_ACCESS_TOKEN" not in os.environ
+    assert "KOMMO_REFRESH_TOKEN" not in os.environ
+
+def test_real_environment_wins_over_dotenv(dotenv_file, monkeypatch):
+    monkeypatch.setenv("KOMMO_ACCESS_TOKEN", "do-ambiente")
+    dotenv_file.write_text("KOMMO_ACCESS_TOKEN=do-arquivo\n")
+    assert config.get_settings().kommo.access_token == "do-ambiente"
+    assert reload_settings().kommo.access_token == "do-ambiente"
+
+def test_invalid_reload_keeps_the_previous_snapshot(dotenv_file):
+    dotenv_file.write_text("KOMMO_ACCESS_TOKEN=antigo\n")
+    previous = config.get_settings()
+
+    dotenv_file.write_text("KOMMO_ACCESS_TOKEN=novo\nLOG_LEVEL=barulhento\n")
+    with pytest.raises(SettingsError):
+        reload_settings()
+
+    assert config.get_settings() is previous
+    assert "LOG_LEVEL" not in os.environ
+
+@pytest.mark.parametrize("raw", ["dois", "0"])
+def test_invalid_web_concurrency_is_rejected(raw):
+    with pytest.raises(SettingsError, match="WEB_CONCURRENCY"):
+        Settings.from_env({"WEB_CONCURRENCY": raw})
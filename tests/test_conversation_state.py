@@ -0,0 +1,34 @@
+import asyncio
+from app.services.kommo_service import KommoService
+from app.services.conversation_store import InMemoryConversationStore
+
+def test_proactive_state_lives_in_the_store():
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        # /proactive/start salva o contexto da conversa direto no store
+        await store.put(5, {"conversation_id": "conv_5", "vendedor": "Asaf", "lead_id": 9})
+
+        first, second = KommoService(store=store), KommoService(store=store)
+        assert await first.set_conversation_initiated(5, True, trigger_source="formulario_preenchido", lead_data={"name": "Ana"})
+
+        state = await second.get_conversation_state(5)
+        assert state["initiated_by_bot"] and not state["first_response_received"]
+        assert state["trigger_source"] == "formulario_preenchido"
+        # Contexto salvo antes continua lá
+        assert (state["conversation_id"], state["vendedor"]) == ("conv_5", "Asaf")
+
+        assert await second.set_first_response_received(5, True)
+        assert (await store.get(5))["first_response_received"] is True
+        assert await first.set_conversation_active(5, False)
+        assert (await first.get_conversation_state(5))["conversation_active"] is False
+
+    asyncio.run(scenario())
+
+def test_unknown_contact_has_no_state():
+    async def scenario():
+        service = KommoService(store=InMemoryConversationStore(ttl=60.0))
+        assert await service.get_conversation_state(7) == {}
+        assert not await service.set_first_response_received(7, True)
+        assert not await service.set_conversation_active(7, True)
+
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+import time
+import asyncio
+import sqlite3
+import pytest
+from app.config import Settings
+from app.services.conversation_store import (
+    InMemoryConversationStore,
+    SqliteConversationStore,
+    SharedSqliteConversationStore
+)
+
+def _stores(tmp_path, ttl=None):
+    return [
+        InMemoryConversationStore(ttl=ttl),
+        SqliteConversationStore(path=str(tmp_path / "sqlite.db"), ttl=ttl, flush_interval=0.01),
+        SharedSqliteConversationStore(path=str(tmp_path / "shared.db"), ttl=ttl),
+    ]
+
+@pytest.mark.parametrize("backend", [0, 1, 2])
+def test_lead_id_lookup_is_normalized_in_every_backend(tmp_path, backend):
+    async def scenario():
+        store = _stores(tmp_path)[backend]
+        await store.start()
+        try:
+            # lead_id do webhook (str) e da API (int) são a mesma chave
+            await store.put("5", {"conversation_id": "conv_5", "lead_id": "9"})
+            found_int = await store.find_by_lead_id(9)
+            found_str = await store.find_by_lead_id("9")
+        finally:
+            await store.stop()
+        return found_int, found_str
+
+    found_int, found_str = asyncio.run(scenario())
+    assert found_int == found_str
+    assert found_int[0] == 5
+
+def test_sqlite_backends_write_the_same_lead_id_column(tmp_path):
+    async def scenario():
+        for store in _stores(tmp_path)[1:]:
+            await store.start()
+            await store.put(5, {"conversation_id": "conv_5", "lead_id": "9"})
+            await store.stop()
+
+    asyncio.run(scenario())
+    for name in ("sqlite.db", "shared.db"):
+        conn = sqlite3.connect(str(tmp_path / name))
+        assert conn.execute("SELECT lead_id, typeof(lead_id) FROM conversations").fetchall() == [(9, "integer")]
+        conn.close()
+
+def test_conversations_do_not_expire_by_default(tmp_path, monkeypatch):
+    monkeypatch.delenv("CONVERSATION_TTL", raising=False)
+    assert Settings.from_env().store.ttl is None
+
+    async def scenario():
+        memory = InMemoryConversationStore(ttl=None)
+        await memory.put(5, {"conversation_id": "conv_5"})
+        for store in _stores(tmp_path)[1:]:
+            await store.start()
+            await store.put(5, {"conversation_id": "conv_5"})
+            await store.stop()
+
+        # Daqui a um ano a conversa continua lá (nos backends SQLite, relida do disco)
+        monkeypatch.setattr(time, "time", lambda now=time.time(): now + 365 * 86400)
+        results = [await memory.get(5)]
+        for store in _stores(tmp_path)[1:]:
+            await store.start()
+            results.append(await store.get(5))
+            await store.stop()
+        return results
+
+    assert asyncio.run(scenario()) == [{"conversation_id": "conv_5"}] * 3
+
+def test_conversation_ttl_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.setenv("CONVERSATION_TTL", "60")
+    assert Settings.from_env().store.ttl == 60.0
+
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        await store.put(5, {"conversation_id": "conv_5"})
+        monkeypatch.setattr(time, "time", lambda now=time.time(): now + 61)
+        return await store.get(5)
+
+    assert asyncio.run(scenario()) is None
@@ -0,0 +1,135 @@
+import random
+import string
+from urllib.parse import quote_plus
+from app.utils.form_decoder import decode_bracket_form
+from app.services.webhook_processor import WebhookProcessor
+
+def encode_bracket_form(data):
+    """Codificador de referência: dict/list aninhados -> form com colchetes (como o Kommo envia)"""
+    pairs = []
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                walk(f"{prefix}[{key}]", child)
+        elif isinstance(value, list):
+            for index, child in enumerate(value):
+                walk(f"{prefix}[{index}]", child)
+        else:
+            pairs.append(f"{prefix}={quote_plus(value)}")
+
+    for key, value in data.items():
+        if isinstance(value, (dict, list)):
+            walk(key, value)
+        else:
+            pairs.append(f"{key}={quote_plus(value)}")
+    return "&".join(pairs)
+
+def _random_key(rng):
+    # Sem chaves só numéricas: dicts com elas viram listas na decodificação
+    return rng.choice(string.ascii_lowercase) + "".join(rng.choice(string.ascii_lowercase + "_") for _ in range(rng.randint(0, 6)))
+
+def _random_text(rng):
+    alphabet = string.ascii_letters + string.digits + " &=+%[]#?çãé😀/"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+
+def _random_tree(rng, depth):
+    kind = rng.random()
+    if depth <= 0 or kind < 0.4:
+        return _random_text(rng)
+    if kind < 0.7:
+        return [_random_tree(rng, depth - 1) for _ in range(rng.randint(1, 12))]
+    return {_random_key(rng): _random_tree(rng, depth - 1) for _ in range(rng.randint(1, 4))}
+
+def test_kommo_message_form():
+    body = (
+        "message%5Badd%5D%5B0%5D%5Bid%5D=abc&message[add][0][chat_id]=c1&message[add][0][talk_id]=42"
+        "&message[add][0][text]=Ol%C3%A1+mundo&message[add][0][author][type]=external"
+        "&message[add][1][id]=def&message[add][1][text]=segunda&account[id]=9&account[subdomain]=previdas"
+    )
+    assert decode_bracket_form(body) == {
+        "message": {"add": [
+            {"id": "abc", "chat_id": "c1", "talk_id": "42", "text": "Olá mundo", "author": {"type": "external"}},
+            {"id": "def", "text": "segunda"},
+        ]},
+        "account": {"id": "9", "subdomain": "previdas"},
+    }
+
+def test_round_trip_random_trees():
+    rng = random.Random(20)
+    for _ in range(500):
+        data = {_random_key(rng): _random_tree(rng, 4) for _ in range(rng.randint(1, 4))}
+        body = encode_bracket_form(data)
+        assert decode_bracket_form(body) == data, body
+        assert decode_bracket_form(body.encode("utf-8")) == data
+
+def test_round_trip_shuffled_pairs_keeps_list_order():
+    rng = random.Random(3)
+    data = {"message": {"add": [{"id": str(n), "author": {"type": "contact"}} for n in range(15)]}}
+    pairs = encode_bracket_form(data).split("&")
+    rng.shuffle(pairs)
+    # Índices de dois dígitos ordenados como número, não como texto
+    assert decode_bracket_form("&".join(pairs)) == data
+
+def test_nested_brackets():
+    body = "a[b][c][d][e]=1&a[b][c][f]=2&a[b][g][0][h]=3&a[b][g][1][h]=4"
+    assert decode_bracket_form(body) == {"a": {"b": {"c": {"d": {"e": "1"}, "f": "2"}, "g": [{"h": "3"}, {"h": "4"}]}}}
+
+def test_repeated_indices_keep_first_value():
+    assert decode_bracket_form("a[0]=x&a[0]=y&a[1]=z") == {"a": ["x", "z"]}
+    assert decode_bracket_form("a[0][b]=1&a[0][b]=2&a[0][c]=3") == {"a": [{"b": "1", "c": "3"}]}
+
+def test_sparse_and_appended_indices():
+    assert decode_bracket_form("a[3]=d&a[1]=b") == {"a": ["b", "d"]}
+    assert decode_bracket_form("a[]=1&a[]=2&a[]=3") == {"a": ["1", "2", "3"]}
+    assert decode_bracket_form("a[x][]=1&a[x][]=2") == {"a": {"x": ["1", "2"]}}
+    # Mistura de índice e nome: continua dict
+    assert decode_bracket_form("a[0]=1&a[x]=2") == {"a": {"0": "1", "x": "2"}}
+
+def test_conflicting_pairs_keep_first():
+    assert decode_bracket_form("a=1&a[b]=2") == {"a": "1"}
+    assert decode_bracket_form("a[b]=2&a=1") == {"a": {"b": "2"}}
+    assert decode_bracket_form("a[b][c]=1&a[b]=2") == {"a": {"b": {"c": "1"}}}
+
+def test_malformed_keys_stay_literal():
+    for key in ("a[b", "a]", "[x]", "a[b]c]", "a[b][", "a[[b]]", "a[b]]"):
+        assert decode_bracket_form(f"{key}=1") == {key: "1"}, key
+
+def test_depth_limit():
+    deep = "a" + "[b]" * 20
+    assert decode_bracket_form(f"{deep}=1") == {deep: "1"}
+    assert decode_bracket_form("a[b][c]=1", max_depth=1) == {"a[b][c]": "1"}
+
+def test_empty_and_valueless_pairs():
+    assert decode_bracket_form("") == {}
+    assert decode_bracket_form("&&a&b=&=1") == {"a": "", "b": "", "": "1"}
+
+def test_fuzz_never_raises():
+    rng = random.Random(11)
+    alphabet = "ab01[]=&%+5BDx "
+    for _ in range(5000):
+        body = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        result = decode_bracket_form(body)
+        assert isinstance(result, dict), body
+
+def test_fuzz_invalid_utf8_bytes():
+    rng = random.Random(5)
+    for _ in range(500):
+        body = bytes(rng.randrange(256) for _ in range(rng.randint(0, 40)))
+        assert isinstance(decode_bracket_form(body), dict)
+
+def test_split_events_sets_conversation_id_from_talk():
+    processor = WebhookProcessor()
+    body = (
+        "message[add][0][id]=m1&message[add][0][chat_id]=chat-1&message[add][0][talk_id]=77"
+        "&message[add][0][contact_id]=5&message[add][0][type]=incoming&message[add][0][author][type]=external"
+        "&message[add][1][id]=m2&message[add][1][chat_id]=chat-2&message[add][1][contact_id]=6"
+    )
+    events = processor.split_events(decode_bracket_form(body))
+
+    assert [event["chats"]["conversation_id"] for event in events] == [77, "chat-2"]
+    first = events[0]["chats"]
+    assert first["message"]["author"]["type"] == "contact"
+    assert processor._extract_message_ids(first, first["message"]) == (77, 5)
+    assert processor.dedup_key(events[0]) == "77:m1"
+    assert processor.conversation_key(events[1]) == "contact:6"
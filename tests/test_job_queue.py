@@ -0,0 +1,104 @@
+import json
+import asyncio
+import sqlite3
+from app.services.job_queue import WebhookJobQueue
+from app.services.message_aggregator import MessageAggregator
+
+def _pending_jobs(path):
+    """Payloads ainda no journal, em ordem"""
+    conn = sqlite3.connect(path)
+    try:
+        return [json.loads(payload) for (payload,) in conn.execute("SELECT payload FROM webhook_jobs ORDER BY id")]
+    finally:
+        conn.close()
+
+def _make_queue(path, aggregator):
+    async def handler(payload):
+        return await aggregator.add(payload["key"], payload)
+
+    return WebhookJobQueue(handler=handler, key_fn=lambda payload: payload["key"], workers=4, maxsize=100, journal_path=path)
+
+def test_job_stays_in_journal_while_batch_is_open(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    delivered = []
+
+    async def scenario():
+        async def flush(items):
+            delivered.append([item["n"] for item in items])
+
+        aggregator = MessageAggregator(flush=flush, window=60.0, max_wait=60.0)
+        queue = _make_queue(path, aggregator)
+        await queue.start()
+        await queue.enqueue({"key": "contact:1", "n": 1})
+        await queue.enqueue({"key": "contact:1", "n": 2})
+        await asyncio.sleep(0.1)
+
+        assert queue.stats()["awaiting_delivery"] == 2
+        assert [job["n"] for job in await asyncio.to_thread(_pending_jobs, path)] == [1, 2]
+
+        # Queda antes do fim da janela: sem drain, os jobs continuam no journal
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert delivered == []
+    assert [job["n"] for job in _pending_jobs(path)] == [1, 2]
+
+def test_job_leaves_journal_after_batch_delivery(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    delivered = []
+
+    async def scenario():
+        async def flush(items):
+            delivered.append([item["n"] for item in items])
+
+        aggregator = MessageAggregator(flush=flush, window=0.05, max_wait=1.0)
+        queue = _make_queue(path, aggregator)
+        await queue.start()
+        for n in range(3):
+            await queue.enqueue({"key": "contact:1", "n": n})
+        await asyncio.sleep(0.3)
+
+        assert delivered == [[0, 1, 2]]
+        assert queue.stats()["awaiting_delivery"] == 0
+        assert await asyncio.to_thread(_pending_jobs, path) == []
+        await queue.stop(drain=aggregator.stop)
+
+    asyncio.run(scenario())
+
+def test_shutdown_drain_flushes_open_batches(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    delivered = []
+
+    async def scenario():
+        async def flush(items):
+            delivered.append([item["n"] for item in items])
+
+        aggregator = MessageAggregator(flush=flush, window=60.0, max_wait=60.0)
+        queue = _make_queue(path, aggregator)
+        await queue.start()
+        await queue.enqueue({"key": "contact:1", "n": 1})
+        await queue.enqueue({"key": "contact:2", "n": 2})
+        await asyncio.sleep(0.1)
+        await queue.stop(drain=aggregator.stop)
+
+    asyncio.run(scenario())
+    assert sorted(delivered) == [[1], [2]]
+    assert _pending_jobs(path) == []
+
+def test_failed_batch_is_removed_from_journal(tmp_path):
+    path = str(tmp_path / "jobs.db")
+
+    async def scenario():
+        async def flush(items):
+            raise RuntimeError("n8n fora")
+
+        aggregator = MessageAggregator(flush=flush, window=0.01, max_wait=0.01)
+        queue = _make_queue(path, aggregator)
+        await queue.start()
+        await queue.enqueue({"key": "contact:1", "n": 1})
+        await asyncio.sleep(0.2)
+        assert queue.stats()["awaiting_delivery"] == 0
+        await queue.stop(drain=aggregator.stop)
+
+    asyncio.run(scenario())
+    assert _pending_jobs(path) == []
@@ -0,0 +1,119 @@
+import random
+import asyncio
+from collections import defaultdict
+from app.services.keyed_dispatcher import KeyedDispatcher
+
+KEYS = 50
+ITEMS_PER_KEY = 40
+
+def test_same_key_items_run_in_submission_order_under_load():
+    processed = defaultdict(list)
+    active_per_key = defaultdict(int)
+    overlaps = []
+
+    async def handler(item):
+        key, seq = item
+        active_per_key[key] += 1
+        if active_per_key[key] > 1:
+            overlaps.append(item)
+        # Tempos variados: itens de outras chaves ultrapassam, os da mesma chave não
+        await asyncio.sleep(random.random() * 0.002)
+        processed[key].append(seq)
+        active_per_key[key] -= 1
+
+    async def scenario():
+        dispatcher = KeyedDispatcher(handler, concurrency=16, maxsize=KEYS * ITEMS_PER_KEY)
+        submissions = [(f"contact:{key}", seq) for seq in range(ITEMS_PER_KEY) for key in range(KEYS)]
+        for item in submissions:
+            dispatcher.submit(item[0], item)
+            # Submissões intercaladas com o processamento, como no endpoint
+            if random.random() < 0.1:
+                await asyncio.sleep(0)
+
+        while dispatcher.pending:
+            await asyncio.sleep(0.01)
+        assert dispatcher.stats()["processed"] == KEYS * ITEMS_PER_KEY
+        assert dispatcher.stats()["active_keys"] == 0
+
+    random.seed(7)
+    asyncio.run(scenario())
+    assert overlaps == []
+    assert len(processed) == KEYS
+    for key, sequence in processed.items():
+        assert sequence == list(range(ITEMS_PER_KEY)), key
+
+def test_different_keys_run_in_parallel_up_to_concurrency():
+    concurrency = 8
+    active = 0
+    peak = 0
+
+    async def handler(item):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.05)
+        active -= 1
+
+    async def scenario():
+        dispatcher = KeyedDispatcher(handler, concurrency=concurrency, maxsize=1000)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for key in range(32):
+            dispatcher.submit(f"contact:{key}", key)
+        while dispatcher.pending:
+            await asyncio.sleep(0.005)
+        return loop.time() - started
+
+    elapsed = asyncio.run(scenario())
+    assert peak == concurrency
+    # 32 chaves de 50 ms em 8 slots: ~4 rodadas, longe dos 1,6 s sequenciais
+    assert elapsed < 0.6
+
+def test_slow_key_does_not_block_other_keys():
+    finished = []
+    release = None
+
+    async def handler(item):
+        key, seq = item
+        if key == "slow":
+            await release.wait()
+        finished.append(item)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        dispatcher = KeyedDispatcher(handler, concurrency=4, maxsize=1000)
+        dispatcher.submit("slow", ("slow", 0))
+        dispatcher.submit("slow", ("slow", 1))
+        for seq in range(20):
+            dispatcher.submit(f"fast:{seq % 5}", (f"fast:{seq % 5}", seq))
+        while len(finished) < 20:
+            await asyncio.sleep(0.005)
+
+        # Os itens rápidos terminaram com a chave lenta ainda parada
+        assert all(not key.startswith("slow") for key, _ in finished)
+        release.set()
+        while dispatcher.pending:
+            await asyncio.sleep(0.005)
+
+    asyncio.run(scenario())
+    assert finished[-2:] == [("slow", 0), ("slow", 1)]
+
+def test_is_full_tracks_pending_items():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def handler(item):
+            await gate.wait()
+
+        dispatcher = KeyedDispatcher(handler, concurrency=2, maxsize=3)
+        for key in range(3):
+            dispatcher.submit(key, key)
+        assert dispatcher.is_full()
+        gate.set()
+        while dispatcher.pending:
+            await asyncio.sleep(0.005)
+        assert not dispatcher.is_full()
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,44 @@
+import json
+import asyncio
+import aiohttp
+from aiohttp import web
+from app.services.kommo_service import KommoService, KOMMO_RESPONSE_BYTES, _endpoint_label
+from app.services.conversation_store import InMemoryConversationStore
+
+BODY = json.dumps({"id": 5, "name": "João Ação", "updated_at": 1700000000}, ensure_ascii=False).encode("utf-8")
+
+def test_response_bytes_count_encoded_body():
+    async def contact(request):
+        return web.Response(body=BODY, content_type="application/json", charset="utf-8")
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/api/v4/contacts/5", contact)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        async with aiohttp.ClientSession() as session:
+            service = KommoService(session=session, store=InMemoryConversationStore(ttl=60.0))
+            service.api_url = f"http://127.0.0.1:{port}/api/v4"
+
+            async def get_headers():
+                return {"Authorization": "Bearer test"}
+
+            service.get_headers = get_headers
+            label = _endpoint_label("/contacts/5")
+            before = KOMMO_RESPONSE_BYTES.values().get((label,), 0)
+            status, text, _, size = await service._send("GET", "/contacts/5")
+            after = KOMMO_RESPONSE_BYTES.values().get((label,), 0)
+
+        await runner.cleanup()
+        return status, text, size, after - before
+
+    status, text, size, counted = asyncio.run(scenario())
+    assert status == 200
+    assert json.loads(text)["name"] == "João Ação"
+    # Acentos: bytes > caracteres
+    assert len(BODY) > len(text)
+    assert size == counted == len(BODY)
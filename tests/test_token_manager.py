@@ -0,0 +1,36 @@
+import asyncio
+from app.config import Settings
+from app.services.token_manager import TokenManager
+
+def _manager(tmp_path, responses, posted):
+    async def request(method, url, json=None, headers=None):
+        posted.append(json)
+        return responses.pop(0)
+
+    manager = TokenManager(request=request, path=str(tmp_path / "tokens.json"), settings=Settings())
+    manager.access_token = "access-atual"
+    manager.refresh_token = "refresh-atual"
+    return manager
+
+def test_refresh_with_rejected_token_keeps_current_state(tmp_path):
+    posted = []
+    manager = _manager(tmp_path, [(400, {"hint": "Token has been revoked"})], posted)
+
+    assert asyncio.run(manager.refresh_with("refresh-do-request")) is False
+    assert posted[0]["refresh_token"] == "refresh-do-request"
+    assert (manager.access_token, manager.refresh_token) == ("access-atual", "refresh-atual")
+    assert not (tmp_path / "tokens.json").exists()
+
+def test_refresh_with_accepted_token_adopts_and_persists(tmp_path):
+    posted = []
+    manager = _manager(tmp_path, [(200, {"access_token": "access-novo", "expires_in": 3600})], posted)
+
+    async def scenario():
+        # Chamadas simultâneas com o mesmo token: uma única renovação no Kommo
+        return await asyncio.gather(*(manager.refresh_with("refresh-do-request") for _ in range(3)))
+
+    assert asyncio.run(scenario()) == [True] * 3
+    assert len(posted) == 1
+    # Sem refresh_token na resposta, o informado pelo chamador passa a valer
+    assert (manager.access_token, manager.refresh_token) == ("access-novo", "refresh-do-request")
+    assert manager._read()["refresh_token"] == "refresh-do-request"
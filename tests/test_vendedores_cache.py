@@ -0,0 +1,36 @@
+import asyncio
+from app.config import Settings
+from app.services.vendedores_cache import VendedoresCache
+
+class StubKommo:
+    def __init__(self):
+        self.calls = 0
+
+    async def get_users(self):
+        self.calls += 1
+        return [{"id": 1, "name": "Asaf", "rights": {"is_active": True}}]
+
+class StubStore:
+    async def load_snapshot(self, name):
+        return None
+
+    async def save_snapshot(self, name, data):
+        pass
+
+def test_refresh_ahead_is_clamped_to_half_the_ttl():
+    cache = VendedoresCache(kommo=StubKommo(), store=StubStore(), ttl=10.0, refresh_ahead=60.0, settings=Settings())
+    assert cache.refresh_ahead == 5.0
+
+def test_refresh_loop_does_not_spin_when_refresh_ahead_exceeds_ttl():
+    kommo = StubKommo()
+
+    async def scenario():
+        cache = VendedoresCache(kommo=kommo, store=StubStore(), ttl=1.0, refresh_ahead=5.0, settings=Settings())
+        await cache.start()
+        await asyncio.sleep(0.2)
+        await cache.stop()
+        return await cache.get()
+
+    assert list(asyncio.run(scenario())) == ["Asaf"]
+    # Uma busca na partida; a próxima só depois de ttl/2
+    assert kommo.calls == 1
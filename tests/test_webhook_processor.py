@@ -0,0 +1,209 @@
+import asyncio
+from app.services.webhook_processor import WebhookProcessor
+from app.services.conversation_store import InMemoryConversationStore
+from app.services.kommo_service import KommoService
+from app.services.n8n_service import DEFAULT_WEBHOOK_URL
+
+CONTACT = {
+    "id": 5,
+    "name": "Ana",
+    "custom_fields_values": [{"field_code": "PHONE", "values": [{"value": "+5511999990000"}]}],
+    "_embedded": {"leads": [{"id": 9}]},
+}
+LEAD = {"id": 9, "custom_fields_values": [{"field_code": "area_atuacao", "values": [{"value": "Previdenciario"}]}]}
+
+def _event(text="oi"):
+    return {"chats": {"conversation_id": "77", "message": {"id": "m1", "contact_id": 5, "text": text, "author": {"type": "contact"}}}}
+
+def _processor(store):
+    kommo = KommoService(store=store)
+    calls = []
+
+    async def load_entity(resource, loader, entity_id):
+        calls.append(resource)
+        return CONTACT if resource == "/contacts" else LEAD
+
+    kommo._load_entity = load_entity
+    processor = WebhookProcessor(kommo=kommo)
+    sent = []
+
+    async def add(key, payload):
+        sent.append(payload)
+
+    processor.aggregator.add = add
+    return processor, calls, sent
+
+def test_paused_contact_skips_lead_fetch():
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        await store.set_bot_status(5, {"status": "paused"})
+        processor, calls, sent = _processor(store)
+        await processor.process_webhook(_event())
+        return calls, sent
+
+    calls, sent = asyncio.run(scenario())
+    assert calls == ["/contacts"]
+    assert sent == []
+
+def test_active_contact_reuses_fetched_contact_for_lead():
+    async def scenario():
+        processor, calls, sent = _processor(InMemoryConversationStore(ttl=60.0))
+        await processor.process_webhook(_event())
+        return calls, sent
+
+    calls, sent = asyncio.run(scenario())
+    assert calls == ["/contacts", "/leads"]
+    assert len(sent) == 1
+    assert (sent[0]["conversation_id"], sent[0]["lead_id"], sent[0]["phone_number"]) == ("77", 9, "+5511999990000")
+
+class StubVendedores:
+    async def get(self):
+        return {"Asaf": {"phone_api": "asaf_whatsapp", "display_name": "Asaf - Previdas"}}
+
+def _live_processor(store):
+    processor = WebhookProcessor(kommo=KommoService(store=store), store=store, vendedores=StubVendedores())
+    processor.aggregator.window = 0
+    # Sem N8N_WEBHOOK_URL: vale a URL padrão, como no handler antigo
+    processor.n8n.webhook_url = None
+    posted = []
+
+    async def send_to_n8n_with_dict(payload, url=None):
+        posted.append((url, payload))
+        return {"status": "ok"}
+
+    processor.n8n.send_to_n8n_with_dict = send_to_n8n_with_dict
+    return processor, posted
+
+def _without_timestamps(payload):
+    payload = dict(payload)
+    payload.pop("timestamp")
+    payload["messages"] = [{"text": message["text"]} for message in payload["messages"]]
+    return payload
+
+def test_kommo_event_keeps_the_n8n_payload_contract():
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        await store.put(5, {
+            "conversation_id": "conv_5",
+            "lead_id": 9,
+            "vendedor": "Asaf",
+            "area_atuacao": "Previdenciario",
+            "trigger_type": "formulario_preenchido",
+            "initiated_at": "2024-01-01T10:00:00",
+            "initiated_by_bot": True,
+            "first_response_received": False,
+            "lead_data": {"name": "Ana"}
+        })
+        processor, posted = _live_processor(store)
+        delivered = await processor.process_kommo_event(_event())
+        await delivered
+        return posted, await store.get(5)
+
+    posted, state = asyncio.run(scenario())
+    [(url, payload)] = posted
+    assert url == DEFAULT_WEBHOOK_URL
+    assert _without_timestamps(payload) == {
+        "conversation_id": "77",
+        "contact_id": 5,
+        "message_text": "oi",
+        "chat_type": "whatsapp",
+        "lead_id": 9,
+        "contact_name": "Ana",
+        "proactive_context": {
+            "initiated_by_bot": True,
+            "trigger_source": "formulario_preenchido",
+            "first_response": False,
+            "initiated_at": "2024-01-01T10:00:00"
+        },
+        "vendor_context": {
+            "responsible_user": "Asaf",
+            "phone_api": "asaf_whatsapp",
+            "display_name": "Asaf - Previdas",
+            "area_atuacao": "Previdenciario"
+        },
+        "supabase_context": {
+            "vendedor_for_scheduling": "Asaf",
+            "agenda_table": "agenda_asaf",
+            "client_id": 5,
+            "lead_id": 9,
+            "conversation_active": True,
+            "scheduling_enabled": True
+        },
+        "messages": [{"text": "oi"}]
+    }
+    # Marcada só depois da entrega ao n8n
+    assert state["first_response_received"] is True
+
+def test_kommo_event_without_context_still_reaches_n8n():
+    async def scenario():
+        processor, posted = _live_processor(InMemoryConversationStore(ttl=60.0))
+        await (await processor.process_kommo_event(_event()))
+        return posted
+
+    [(_, payload)] = asyncio.run(scenario())
+    # Sem conversa proativa nem área de atuação: vendedor "default", sem filtro
+    assert payload["vendor_context"]["responsible_user"] == "default"
+    assert payload["vendor_context"]["area_atuacao"] is None
+    assert payload["supabase_context"]["agenda_table"] == "agenda_default"
+    assert payload["lead_id"] is None
+
+def test_kommo_event_ignores_agent_messages():
+    async def scenario():
+        processor, posted = _live_processor(InMemoryConversationStore(ttl=60.0))
+        event = _event()
+        event["chats"]["message"]["author"]["type"] = "user"
+        return await processor.process_kommo_event(event), posted
+
+    assert asyncio.run(scenario()) == (None, [])
+
+def test_known_lead_is_fetched_alongside_the_contact():
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        await store.put(5, {"conversation_id": "conv_5", "lead_id": 9})
+        processor, calls, sent = _processor(store)
+        lead_started = asyncio.Event()
+
+        async def load_entity(resource, loader, entity_id):
+            calls.append(resource)
+            if resource == "/leads":
+                lead_started.set()
+                return LEAD
+            # O contato só responde depois que o lead já foi pedido
+            await asyncio.wait_for(lead_started.wait(), timeout=1.0)
+            return CONTACT
+
+        processor.kommo._load_entity = load_entity
+        await processor.process_webhook(_event())
+        return calls, sent
+
+    calls, sent = asyncio.run(scenario())
+    assert sorted(calls) == ["/contacts", "/leads"]
+    assert sent[0]["lead_id"] == 9
+
+def test_paused_contact_cancels_the_parallel_lead_fetch():
+    async def scenario():
+        store = InMemoryConversationStore(ttl=60.0)
+        await store.put(5, {"conversation_id": "conv_5", "lead_id": 9})
+        await store.set_bot_status(5, {"status": "paused"})
+        processor, calls, sent = _processor(store)
+        cancelled = asyncio.Event()
+
+        async def load_entity(resource, loader, entity_id):
+            calls.append(resource)
+            if resource == "/contacts":
+                await asyncio.sleep(0.01)
+                return CONTACT
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        processor.kommo._load_entity = load_entity
+        await processor.process_webhook(_event())
+        await asyncio.wait_for(cancelled.wait(), timeout=1.0)
+        return calls, sent
+
+    calls, sent = asyncio.run(scenario())
+    assert sorted(calls) == ["/contacts", "/leads"]
+    assert sent == []
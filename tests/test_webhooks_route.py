@@ -0,0 +1,113 @@
+import asyncio
+import httpx
+from app.main import app
+from app.services.container import get_webhook_queue, get_dedup_index, get_webhook_processor
+from app.services.job_queue import WebhookJobQueue
+from app.services.webhook_processor import WebhookProcessor
+
+FORM = "application/x-www-form-urlencoded"
+
+class MemoryDedup:
+    def __init__(self):
+        self.keys = set()
+
+    async def check_and_mark(self, key):
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    async def forget(self, key):
+        self.keys.discard(key)
+
+def _form_message(index, message_id, contact_id, text):
+    prefix = f"message[add][{index}]"
+    return "&".join([
+        f"{prefix}[id]={message_id}",
+        f"{prefix}[chat_id]=chat-{contact_id}",
+        f"{prefix}[talk_id]={contact_id}00",
+        f"{prefix}[contact_id]={contact_id}",
+        f"{prefix}[text]={text}",
+        f"{prefix}[type]=incoming",
+        f"{prefix}[author][type]=external",
+    ])
+
+def _run(scenario, tmp_path, handler, workers=4, maxsize=100):
+    processor = WebhookProcessor()
+    queue = WebhookJobQueue(
+        handler=handler,
+        key_fn=processor.conversation_key,
+        workers=workers,
+        maxsize=maxsize,
+        journal_path=str(tmp_path / "jobs.db")
+    )
+    dedup = MemoryDedup()
+    app.dependency_overrides.update({
+        get_webhook_queue: lambda: queue,
+        get_dedup_index: lambda: dedup,
+        get_webhook_processor: lambda: processor,
+    })
+
+    async def main():
+        await queue.start()
+        try:
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await scenario(client, queue)
+        finally:
+            await queue.stop()
+
+    try:
+        return asyncio.run(main())
+    finally:
+        app.dependency_overrides.clear()
+
+def test_live_endpoint_enqueues_and_keeps_per_contact_order(tmp_path):
+    seen = []
+
+    async def handler(payload):
+        message = payload["chats"]["message"]
+        await asyncio.sleep(0.001 * (message["contact_id"] % 3))
+        seen.append((message["contact_id"], message["text"]))
+
+    async def scenario(client, queue):
+        for n in range(10):
+            body = "&".join(_form_message(i, f"m{n}-{contact}", contact, f"msg{n}") for i, contact in enumerate((1, 2, 3)))
+            response = await client.post("/webhooks/kommo", content=body, headers={"content-type": FORM})
+            assert response.status_code == 202
+            assert [event["status"] for event in response.json()["events"]] == ["received"] * 3
+        while queue.stats()["depth"]:
+            await asyncio.sleep(0.01)
+
+    _run(scenario, tmp_path, handler)
+    for contact in (1, 2, 3):
+        assert [text for c, text in seen if c == contact] == [f"msg{n}" for n in range(10)]
+
+def test_live_endpoint_ignores_redeliveries(tmp_path):
+    async def handler(payload):
+        pass
+
+    async def scenario(client, queue):
+        body = _form_message(0, "abc", 5, "oi")
+        first = await client.post("/webhooks/kommo", content=body, headers={"content-type": FORM})
+        second = await client.post("/webhooks/kommo", content=body, headers={"content-type": FORM})
+        return first.json(), second.json(), queue.stats()["accepted"]
+
+    first, second, accepted = _run(scenario, tmp_path, handler)
+    assert first["status"] == "received"
+    assert second["status"] == "duplicate"
+    assert accepted == 1
+
+def test_live_endpoint_returns_503_when_queue_is_full(tmp_path):
+    async def handler(payload):
+        await asyncio.sleep(10)
+
+    async def scenario(client, queue):
+        statuses = []
+        for n in range(3):
+            response = await client.post("/webhooks/kommo", content=_form_message(0, f"m{n}", n + 1, "oi"), headers={"content-type": FORM})
+            statuses.append((response.status_code, response.headers.get("retry-after")))
+        return statuses
+
+    statuses = _run(scenario, tmp_path, handler, workers=1, maxsize=2)
+    assert statuses == [(202, None), (202, None), (503, "5")]